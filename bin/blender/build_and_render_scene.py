@@ -25,29 +25,40 @@ def create_metadata(info):
     return metadata
 
 
-if __name__ == '__main__':
-    argv = sys.argv
-    if "--" not in argv:
-        argv = []  # as if no args are passed
-    else:
-        argv = argv[argv.index("--") + 1:]  # get all args after "--"
+def head_metadata(character):
+    from simulants import simulant
+
+    head_info = simulant.head_proxy_properties(character['head_proxy']['id'])
+    head_info['class_name'] = 'head'
+    head_info['id'] = character['head_id']
+    head_info['center'] = [x for x in head_info['center']]
 
+    return head_info
+
+
+def main(argv):
+    """Run with the arguments after "--", also called in process by warm_worker.py"""
     parser = ArgumentParser()
     parser.add_argument('--info', '-i', type=str, help='info json describing scene', required=True)
+    parser.add_argument('--id', type=str, help='if set, --info is a descriptor store and this the id of the '
+                                               'scene in it', default=None)
     parser.add_argument('--out', '-o', type=str, help='directory to store resultant scene', required=True)
     parser.add_argument('--save', '-s', type=str, help='set true to save scene file', default='False')
     parser.add_argument('--base', '-b', type=str, help='base blend file', default='./data/base_scene.blend')
+    parser.add_argument('--single_render', type=str, help='set true to render head masks, UV and the full image in '
+                                                          'one render', default='False')
     args, _ = parser.parse_known_args(argv)
 
     cwd = os.path.dirname(os.path.abspath(__file__))
     import_dir = cwd.replace('/bin/blender', '', 1)
-    sys.path.append(import_dir)
+    if import_dir not in sys.path:
+        sys.path.append(import_dir)
 
-    from simulants import camera, render, simulant
+    from simulants import asset_library, camera, render
     from simulants.description import random_position
+    from simulants.tools.descriptor_store import load_descriptor
 
-    with open(args.info) as jd:
-        info = json.load(jd)
+    info = load_descriptor(args.info, args.id, 'scene_id')
 
     out_path = os.path.join(args.out, info['scene_id'])
 
@@ -62,13 +73,7 @@ if __name__ == '__main__':
     # Import objects
     for obj in info['objects']:
         assert os.path.isfile(obj['path']), 'blend file {} does not exist'.format(obj['path'])
-        with bpy.data.libraries.load(obj['path'], link=False) as (source, target):
-            target.objects = [name for name in source.objects if name.endswith(obj['id'])]
-
-        # Append to current scene
-        for t_obj in target.objects:
-            if t_obj is not None:
-                bpy.context.scene.objects.link(t_obj)
+        asset_library.load_objects(obj['path'], obj['id'])
 
         # assign simulant body render layers
         sim = bpy.data.objects['body_{}'.format(obj['id'])]
@@ -89,6 +94,9 @@ if __name__ == '__main__':
         # reposition simulant
         bpy.data.objects[obj['skeleton']].location = random_position(type=info['distribution'])
 
+    # simulants made in library mode reference the same texture files, render each of them once
+    asset_library.merge_duplicate_images()
+
     image_size = info['image_size']
     image_percent = int(info['percent_size'])
     tile_size = int(info['tile_size'])
@@ -102,40 +110,52 @@ if __name__ == '__main__':
         layer_id = int(character['head_proxy']['layer'])
         head_proxy.layers = [i == layer_id for i in range(len(head_proxy.layers))]
 
-    # Render head masks
-    bpy.data.scenes['Scene'].use_nodes = True
-    for character in simulants:
-        layer_id = int(character['head_proxy']['layer'])
-        render.set_head_passes(bpy.context)
+    if args.single_render == 'True':
+        # Head masks, UV and full image from one render, head proxies as object index layers
+        bpy.data.scenes['Scene'].use_nodes = True
+        render.set_single_render_passes(bpy.context)
         render.set_output_nodes(bpy.context, info['scene_id'], os.path.abspath(out_path), info)
-        render.set_head_render_settings(image_size, image_percent, tile_size)
-        head_mask_path = os.path.join(os.path.abspath(out_path), character['head_id'],
-                                      'head_{}.png'.format(character['head_id']))
-        bpy.context.scene.render.filepath = head_mask_path
-        bpy.context.scene.layers = [i == layer_id for i in range(len(bpy.context.scene.layers))]
-        bpy.ops.render.render(animation=False, write_still=True)
-
-        head_info = simulant.head_proxy_properties(character['head_proxy']['id'])
-        head_info['class_name'] = 'head'
-        head_info['id'] = character['head_id']
-        head_info['center'] = [x for x in head_info['center']]
-        metadata['objects'].append(head_info)
-
-    # Render UV map
-    bpy.data.scenes['Scene'].use_nodes = True
-    bpy.context.scene.layers = [i == 0 for i in range(len(bpy.context.scene.layers))]
-    render.set_uv_passes(bpy.context)
-    render.set_output_nodes(bpy.context, info['scene_id'], os.path.abspath(out_path), info)
-    render.set_uv_render_settings(image_size, image_percent, tile_size)
-    bpy.ops.render.render(animation=False)
-
-    # Render full image
-    bpy.data.scenes['Scene'].use_nodes = True
-    bpy.context.scene.layers = [i == 0 for i in range(len(bpy.context.scene.layers))]
-    render.set_passes(bpy.context)
-    render.set_output_nodes(bpy.context, info['scene_id'], os.path.abspath(out_path), info)
-    render.set_render_settings(image_size, image_percent, tile_size)
-    bpy.ops.render.render(animation=False)
+        render.set_render_settings(image_size, image_percent, tile_size)
+        render.add_head_index_layers(bpy.context, simulants, os.path.abspath(out_path))
+        bpy.ops.render.render(animation=False)
+
+        # file output nodes add the frame number, keep the names of the separate head renders
+        frame = '{:04d}'.format(bpy.context.scene.frame_current)
+        for character in simulants:
+            mask_path = os.path.join(os.path.abspath(out_path), render.head_mask_path(character))
+            os.rename(mask_path + frame + '.png', mask_path + '.png')
+            metadata['objects'].append(head_metadata(character))
+    else:
+        # Render head masks
+        bpy.data.scenes['Scene'].use_nodes = True
+        for character in simulants:
+            layer_id = int(character['head_proxy']['layer'])
+            render.set_head_passes(bpy.context)
+            render.set_output_nodes(bpy.context, info['scene_id'], os.path.abspath(out_path), info)
+            render.set_head_render_settings(image_size, image_percent, tile_size)
+            head_mask_path = os.path.join(os.path.abspath(out_path), character['head_id'],
+                                          'head_{}.png'.format(character['head_id']))
+            bpy.context.scene.render.filepath = head_mask_path
+            bpy.context.scene.layers = [i == layer_id for i in range(len(bpy.context.scene.layers))]
+            bpy.ops.render.render(animation=False, write_still=True)
+
+            metadata['objects'].append(head_metadata(character))
+
+        # Render UV map
+        bpy.data.scenes['Scene'].use_nodes = True
+        bpy.context.scene.layers = [i == 0 for i in range(len(bpy.context.scene.layers))]
+        render.set_uv_passes(bpy.context)
+        render.set_output_nodes(bpy.context, info['scene_id'], os.path.abspath(out_path), info)
+        render.set_uv_render_settings(image_size, image_percent, tile_size)
+        bpy.ops.render.render(animation=False)
+
+        # Render full image
+        bpy.data.scenes['Scene'].use_nodes = True
+        bpy.context.scene.layers = [i == 0 for i in range(len(bpy.context.scene.layers))]
+        render.set_passes(bpy.context)
+        render.set_output_nodes(bpy.context, info['scene_id'], os.path.abspath(out_path), info)
+        render.set_render_settings(image_size, image_percent, tile_size)
+        bpy.ops.render.render(animation=False)
 
     # Only save scene file if requested
     if args.save == 'True':
@@ -144,3 +164,13 @@ if __name__ == '__main__':
     # Save metadata info on depth, etc
     with open(os.path.join(out_path, '{}.json'.format(info['scene_id'])), 'w') as outfile:
         json.dump(metadata, outfile, indent=2)
+
+
+if __name__ == '__main__':
+    argv = sys.argv
+    if "--" not in argv:
+        argv = []  # as if no args are passed
+    else:
+        argv = argv[argv.index("--") + 1:]  # get all args after "--"
+
+    main(argv)
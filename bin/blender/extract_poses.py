@@ -0,0 +1,94 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import bpy
+import sys
+import random
+import numpy as np
+
+from argparse import ArgumentParser
+
+
+def load_animation(skeleton, animation_path):
+    """Reset the skeleton's pose and load a mocap clip onto it, return the clip's action"""
+    for obj in bpy.data.objects:
+        obj.select = False
+    skeleton.select = True
+    bpy.context.scene.objects.active = skeleton
+    bpy.ops.mbast.pose_reset()
+    bpy.ops.mbast.load_animation(filepath=animation_path)
+
+    return skeleton.animation_data.action
+
+
+def clip_rotations(skeleton, bones):
+    """(frames, bones, 4) quaternions of the bones' local rotations for every frame of the scene's frame range"""
+    scene = bpy.context.scene
+    frames = range(scene.frame_start, scene.frame_end + 1)
+    rotations = np.empty((len(frames), len(bones), 4), dtype=np.float32)
+    pose_bones = [skeleton.pose.bones[name] for name in bones]
+    for i, frame in enumerate(frames):
+        scene.frame_set(frame)
+        for j, bone in enumerate(pose_bones):
+            # matrix_basis gives the rotation whatever the bone's rotation mode
+            rotations[i, j] = bone.matrix_basis.to_quaternion()
+
+    return rotations
+
+
+def main(argv):
+    """Run with the arguments after "--", also called in process by warm_worker.py"""
+    parser = ArgumentParser()
+    parser.add_argument('--mocap_list', type=str, help='list of mocap (bvh) files to extract', required=True)
+    parser.add_argument('--archive', type=str, help='pose archive path without extension, clips already in it are '
+                                                    'skipped', required=True)
+    parser.add_argument('--base_scene', type=str, help='blender base file',
+                        default='data/base_scene.blend')
+    parser.add_argument('--base_mesh', type=str, help='MB-Lab character to pose, random if not set', default=None)
+    args, _ = parser.parse_known_args(argv)
+
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    import_dir = cwd.replace('/bin/blender', '', 1)
+    if import_dir not in sys.path:
+        sys.path.append(import_dir)
+
+    from simulants import description, simulant
+    from simulants.blend_ops import get_blend_obj
+    from simulants.tools.pose_archive import PoseArchive
+    from dataset_toolbox.src.tools.common import get_list
+
+    archive = PoseArchive(args.archive)
+    mocaps = [path for path in get_list(args.mocap_list)
+              if os.path.splitext(os.path.basename(path))[0] not in archive]
+    if len(mocaps) == 0:
+        return
+
+    # one finalized character for every clip
+    bpy.ops.wm.open_mainfile(filepath=args.base_scene)
+    simulant.initialize_base(args.base_mesh or random.choice(description.BASE_MESHES))
+    simulant.finalize()
+    skeleton = get_blend_obj('MBlab_sk')
+    bones = archive.bones or [bone.name for bone in skeleton.pose.bones]
+
+    for i, mocap_path in enumerate(mocaps):
+        clip = os.path.splitext(os.path.basename(mocap_path))[0]
+        print('{} of {}: {}'.format(i + 1, len(mocaps), clip))
+
+        action = load_animation(skeleton, mocap_path)
+        archive.append(clip, clip_rotations(skeleton, bones), bones, bpy.context.scene.frame_start)
+
+        # keep the session from collecting every clip's keyframes
+        skeleton.animation_data.action = None
+        if action is not None:
+            bpy.data.actions.remove(action)
+
+
+if __name__ == '__main__':
+    argv = sys.argv
+
+    if "--" not in argv:
+        argv = []  # as if no args are passed
+    else:
+        argv = argv[argv.index("--") + 1:]  # get all args after "--"
+
+    main(argv)
@@ -4,53 +4,72 @@ from __future__ import print_function
 import bpy
 
 import os
-import json
 import sys
 
 from argparse import ArgumentParser
 
-if __name__ == '__main__':
-    argv = sys.argv
-    if "--" not in argv:
-        argv = []  # as if no args are passed
-    else:
-        argv = argv[argv.index("--") + 1:]  # get all args after "--"
 
+def main(argv):
+    """Run with the arguments after "--", also called in process by warm_worker.py"""
     parser = ArgumentParser()
     parser.add_argument('--info', '-i', type=str, help='info json describing character', required=True)
+    parser.add_argument('--id', type=str, help='if set, --info is a descriptor store and this the id of the '
+                                               'scene in it', default=None)
     parser.add_argument('--base_scene', type=str, help='blender base file',
                         default='/usr/local/share/datasets/simulants/base_scene.blend')
+    parser.add_argument('--asset_library', type=str, help='if set, reference shared textures in this directory '
+                                                          'and link simulants instead of packing copies into the '
+                                                          'scene', default=None)
+    parser.add_argument('--cache', type=str, help='if set, simulant cache directory to reuse identical simulants '
+                                                  'from', default=None)
+    parser.add_argument('--cache_gb', type=float, help='size limit of the simulant cache', default=None)
     args, _ = parser.parse_known_args(argv)
 
     cwd = os.path.dirname(os.path.abspath(__file__))
     import_dir = cwd.replace('/bin/blender', '', 1)
-    sys.path.append(import_dir)
+    if import_dir not in sys.path:
+        sys.path.append(import_dir)
 
-    from simulants import camera, render, simulant
+    from simulants import asset_library, camera, render, simulant
+    from simulants.tools.descriptor_store import load_descriptor
+    from simulants.tools.simulant_cache import SimulantCache
     from dataset_toolbox.src.tools import common
 
-    with open(args.info) as jd:
-        info = json.load(jd)
+    info = load_descriptor(args.info, args.id, 'scene_id')
+
+    cache = None
+    if args.cache is not None:
+        cache = SimulantCache(args.cache, None if args.cache_gb is None else int(args.cache_gb * 1e9))
 
     # Generate objects if needed
     for obj_properties in info['objects']:
         if obj_properties['class_name'] == 'simulant':
-            if not os.path.isfile(obj_properties['path']):
-                # reset Blender setup
-                bpy.ops.wm.open_mainfile(filepath=args.base_scene)
-
-                # Load simulant and set properties
-                this_simulant = simulant.SimulantGenerator(obj_properties)
-                this_simulant.personalize()
-                this_simulant.clothe()
-                this_simulant.set_pose()
-                this_simulant.set_position()
-                this_simulant.proxy_fit()
-    
-                # Pack and save blendfile
-                bpy.ops.file.pack_all()
+            if cache is not None:
+                # rebuild when the blend at path is not the one built from this descriptor
+                if cache.up_to_date(obj_properties, 'make_a_scene'):
+                    continue
                 common.mkdirp(os.path.split(obj_properties['path'])[0])
-                bpy.ops.wm.save_as_mainfile(filepath=obj_properties['path'])
+                if simulant.from_cache(obj_properties, cache, 'make_a_scene'):
+                    continue
+            elif os.path.isfile(obj_properties['path']):
+                continue
+
+            # reset Blender setup
+            bpy.ops.wm.open_mainfile(filepath=args.base_scene)
+
+            # Load simulant and set properties
+            this_simulant = simulant.SimulantGenerator(obj_properties)
+            this_simulant.personalize()
+            this_simulant.clothe()
+            this_simulant.set_pose()
+            this_simulant.set_position()
+            this_simulant.proxy_fit()
+    
+            # Pack (or store in the asset library) and save blendfile
+            common.mkdirp(os.path.split(obj_properties['path'])[0])
+            asset_library.save(obj_properties['path'], args.asset_library)
+            if cache is not None:
+                cache.add(obj_properties, 'make_a_scene')
 
     # Combine into scene
     bpy.ops.wm.open_mainfile(filepath=args.base_scene)
@@ -58,15 +77,18 @@ if __name__ == '__main__':
     camera.position()
     camera.rotate_env_tex(info['background_rotation'])
 
-    # Import any additional objects
+    # Import any additional objects, linked in library mode so the scene only references the simulant blends
     for obj in info['objects']:
-        with bpy.data.libraries.load(obj['path'], link=False) as (source, target):
-            target.objects = [name for name in source.objects if name.endswith(obj['id'])]
+        asset_library.load_objects(obj['path'], obj['id'], link=args.asset_library is not None)
+
+    asset_library.save(info['scene_path'], args.asset_library)
+
 
-        # Append to current scene
-        for obj in target.objects:
-            if obj is not None:
-                bpy.context.scene.objects.link(obj)
+if __name__ == '__main__':
+    argv = sys.argv
+    if "--" not in argv:
+        argv = []  # as if no args are passed
+    else:
+        argv = argv[argv.index("--") + 1:]  # get all args after "--"
 
-    bpy.ops.file.pack_all()
-    bpy.ops.wm.save_as_mainfile(filepath=info['scene_path'])
+    main(argv)
@@ -2,34 +2,45 @@ from __future__ import division, print_function
 
 import os
 import bpy
-import json
 import sys
 
 from argparse import ArgumentParser
 
-if __name__ == '__main__':
-    argv = sys.argv
-
-    if "--" not in argv:
-        argv = []  # as if no args are passed
-    else:
-        argv = argv[argv.index("--") + 1:]  # get all args after "--"
 
+def main(argv):
+    """Run with the arguments after "--", also called in process by warm_worker.py"""
     parser = ArgumentParser()
     parser.add_argument('--info', type=str, help='info json describing character', required=True)
+    parser.add_argument('--id', type=str, help='if set, --info is a descriptor store and this the id of the '
+                                               'simulant in it', default=None)
     parser.add_argument('--base_scene', type=str, help='blender base file',
                         default='data/base_scene.blend')
+    parser.add_argument('--asset_library', type=str, help='if set, reference shared textures in this directory '
+                                                          'instead of packing them into the blend', default=None)
+    parser.add_argument('--cache', type=str, help='if set, simulant cache directory to reuse identical simulants '
+                                                  'from', default=None)
+    parser.add_argument('--cache_gb', type=float, help='size limit of the simulant cache', default=None)
     args, _ = parser.parse_known_args(argv)
 
     cwd = os.path.dirname(os.path.abspath(__file__))
     import_dir = cwd.replace('/bin/blender', '', 1)
-    sys.path.append(import_dir)
+    if import_dir not in sys.path:
+        sys.path.append(import_dir)
 
-    from simulants import simulant
+    from simulants import asset_library, simulant
+    from simulants.tools.descriptor_store import load_descriptor
+    from simulants.tools.simulant_cache import SimulantCache
     from dataset_toolbox.src.tools import common
 
-    with open(args.info) as jd:
-        sim = json.load(jd)
+    sim = load_descriptor(args.info, args.id)
+
+    common.mkdirp(os.path.split(sim['path'])[0])
+
+    cache = None
+    if args.cache is not None:
+        cache = SimulantCache(args.cache, None if args.cache_gb is None else int(args.cache_gb * 1e9))
+        if cache.up_to_date(sim, 'make_a_simulant') or simulant.from_cache(sim, cache, 'make_a_simulant'):
+            return
 
     # ensure Blender is blank slate
     bpy.ops.wm.open_mainfile(filepath=args.base_scene)
@@ -39,6 +50,17 @@ if __name__ == '__main__':
     this_simulant.clothe()
     this_simulant.set_position()
 
-    bpy.ops.file.pack_all()
-    common.mkdirp(os.path.split(sim['path'])[0])
-    bpy.ops.wm.save_as_mainfile(filepath=sim['path'])
+    asset_library.save(sim['path'], args.asset_library)
+    if cache is not None:
+        cache.add(sim, 'make_a_simulant')
+
+
+if __name__ == '__main__':
+    argv = sys.argv
+
+    if "--" not in argv:
+        argv = []  # as if no args are passed
+    else:
+        argv = argv[argv.index("--") + 1:]  # get all args after "--"
+
+    main(argv)
@@ -2,32 +2,31 @@ from __future__ import division, print_function
 
 import os
 import bpy
-import json
 import sys
 
 from argparse import ArgumentParser
 
-if __name__ == '__main__':
-    argv = sys.argv
-
-    if "--" not in argv:
-        argv = []  # as if no args are passed
-    else:
-        argv = argv[argv.index("--") + 1:]  # get all args after "--"
 
+def main(argv):
+    """Run with the arguments after "--", also called in process by warm_worker.py"""
     parser = ArgumentParser()
     parser.add_argument('--info', '-i', type=str, help='info json describing character', required=True)
+    parser.add_argument('--id', type=str, help='if set, --info is a descriptor store and this the id of the '
+                                               'scene in it', default=None)
+    parser.add_argument('--asset_library', type=str, help='if set, reference shared textures in this directory '
+                                                          'instead of packing them into the blend', default=None)
     args, _ = parser.parse_known_args(argv)
 
     cwd = os.path.dirname(os.path.abspath(__file__))
     import_dir = cwd.replace('/bin/blender', '', 1)
-    sys.path.append(import_dir)
+    if import_dir not in sys.path:
+        sys.path.append(import_dir)
 
-    from simulants import simulant
+    from simulants import asset_library, simulant
+    from simulants.tools.descriptor_store import load_descriptor
     from dataset_toolbox.src.tools import common
 
-    with open(args.info) as jd:
-        info = json.load(jd)
+    info = load_descriptor(args.info, args.id, 'scene_id')
 
     for obj_properties in info['objects']:
         if obj_properties['class_name'] == 'simulant':
@@ -39,6 +38,16 @@ if __name__ == '__main__':
             this_simulant.clothe()
             this_simulant.set_position()
 
-            bpy.ops.file.pack_all()
             common.mkdirp(os.path.split(obj_properties['path'])[0])
-            bpy.ops.wm.save_as_mainfile(filepath=obj_properties['path'])
+            asset_library.save(obj_properties['path'], args.asset_library)
+
+
+if __name__ == '__main__':
+    argv = sys.argv
+
+    if "--" not in argv:
+        argv = []  # as if no args are passed
+    else:
+        argv = argv[argv.index("--") + 1:]  # get all args after "--"
+
+    main(argv)
@@ -0,0 +1,45 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+
+from argparse import ArgumentParser
+
+if __name__ == '__main__':
+    argv = sys.argv
+    if "--" not in argv:
+        argv = []  # as if no args are passed
+    else:
+        argv = argv[argv.index("--") + 1:]  # get all args after "--"
+
+    parser = ArgumentParser()
+    parser.add_argument('--spool', type=str, help='spool directory to take jobs from', required=True)
+    parser.add_argument('--worker_id', type=str, help='unique id of this worker', required=True)
+    parser.add_argument('--poll', type=float, help='seconds to wait when the queue is empty', default=0.05)
+    args, _ = parser.parse_known_args(argv)
+
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    import_dir = cwd.replace('/bin/blender', '', 1)
+    sys.path.append(import_dir)
+    sys.path.append(cwd)
+
+    from simulants.tools import spool
+
+    # imported once, every job then runs in this Blender; each task resets the scene with open_mainfile itself
+    import build_and_render_scene
+    import extract_poses
+    import make_a_scene
+    import make_a_simulant
+    import make_simulants
+
+    tasks = {'build_and_render_scene': build_and_render_scene.main,
+             'extract_poses': extract_poses.main,
+             'make_a_scene': make_a_scene.main,
+             'make_a_simulant': make_a_simulant.main,
+             'make_simulants': make_simulants.main}
+
+    def handle(task, task_argv):
+        assert task in tasks, 'unknown task {}, expected one of {}'.format(task, sorted(tasks))
+        tasks[task](task_argv)
+
+    spool.serve(spool.Spool(args.spool), handle, args.worker_id, args.poll)
@@ -0,0 +1,13 @@
+from __future__ import absolute_import, division, print_function
+
+from argparse import ArgumentParser
+from simulants.tools.occluders import build_index
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--coco_json', type=str, help='path to coco instance json', required=True)
+    parser.add_argument('--out', type=str, help='directory for the occluder index', required=True)
+    args = parser.parse_args()
+
+    number = build_index(args.coco_json, args.out)
+    print('indexed {} people free images'.format(number))
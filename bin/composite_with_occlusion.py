@@ -5,43 +5,55 @@ from __future__ import absolute_import
 import os
 import sys
 import random
-import OpenEXR
+import functools
+import multiprocessing
 import numpy as np
 
 from PIL import Image, ImageChops
 from argparse import ArgumentParser
 
 from combine_layers import make_clothed_person
-from combine_layers import generate_overlay
-from combine_layers import matching_method
+from combine_layers import generate_sparse_overlay
+from combine_layers import sparse_matching
+from combine_layers import sparse_composite
+from combine_layers import sparse_mask
 from combine_layers import generate_mask
 
 from dataset_toolbox.src.tools import cli, common
+from simulants import exr_io
+from simulants.tools import occluders
 
-from pycocotools.coco import COCO
+
+# Directory listings of textures, backgrounds, and simulants, scanned once per run
+assets = common.AssetCatalog()
+
+# Memory mapped occluder index, opened by init_worker in every process that makes composites
+occluder_index = None
+
+
+def init_worker(occluders_path, manifest_dir):
+    """Open the occluder index and point the asset catalog at the manifests, run in every worker process
+
+    Workers get their state from here rather than from the parent's globals, so they work whatever the start method.
+    """
+    global occluder_index
+    occluder_index = occluders.OccluderIndex(occluders_path)
+    assets.manifest_dir = manifest_dir
 
 
 def patterns_path(pattern_dir):
     """Return a random texture path"""
-    patterns = common.find_filepaths(pattern_dir, 'png')
-    patterns = sorted(patterns)
-
-    return random.choice(patterns)
+    return assets.choice(pattern_dir, 'png')
 
 
 def background_path(background_dir):
     """Return random background image"""
-    backgrounds = common.find_filepaths(background_dir, 'jpg')
-    backgrounds = sorted(backgrounds)
-
-    return random.choice(backgrounds)
+    return assets.choice(background_dir, 'jpg')
 
 
 def simulant_id(simulant_dir):
     """Return random simulant id"""
-    simulant_paths = common.find_filepaths(os.path.join(simulant_dir, 'image_combined'), 'png')
-    simulant_paths = sorted(simulant_paths)
-    simulant_path = random.choice(simulant_paths)
+    simulant_path = assets.choice(os.path.join(simulant_dir, 'image_combined'), 'png')
 
     return os.path.splitext(os.path.split(simulant_path)[1])[0]
 
@@ -64,7 +76,7 @@ def layer_paths(simulant_path, simulant_id):
 
 
 def generate_person_overlay(simulant_id, background_path, simulant_dir, pattern_dir):
-    """Return a composited simulant over transparency size of background image"""
+    """Return the layers of a composited simulant placed on the background image, as SparseOverlays"""
 
     layers = layer_paths(simulant_dir, simulant_id)
     shirt_texture = patterns_path(pattern_dir)
@@ -76,9 +88,10 @@ def generate_person_overlay(simulant_id, background_path, simulant_dir, pattern_
                                                 layers['hair'], layers['ao'], layers['head'], pants_texture,
                                                 shirt_texture, layers['uv'], layers['etc'])
 
-    person, clothes_mask, head_mask, body_mask, depth = generate_overlay(person, clothes, head, body, background_path,
-                                                                         '', 'BILINEAR', layers['depth'], scale_min=0.1,
-                                                                         scale_max=1.1)
+    person, clothes_mask, head_mask, body_mask, depth = generate_sparse_overlay(person, clothes, head, body,
+                                                                                background_path, '', 'BILINEAR',
+                                                                                layers['depth'], scale_min=0.1,
+                                                                                scale_max=1.1)
 
     return {'person': person, 'clothes': clothes_mask, 'head': head_mask, 'body': body_mask, 'depth': depth}
 
@@ -119,36 +132,21 @@ def np_array_to_mask(numpy_array):
     return mask_rgba
 
 
-def num_annotations(image_id):
-    """Return an image with an annotation"""
-    annotation_ids = coco.getAnnIds(imgIds=image_id)
-
-    return len(annotation_ids)
-
-
-def all_annotations_mask(image_id_list, randomize=False):
-    """Build mask of all Things in random coco image from list of ids"""
-    image_id = random.choice(image_id_list)
-    while num_annotations(image_id) == 0:
-        image_id = random.choice(image_id_list)
-    annotation_ids = coco.getAnnIds(imgIds=image_id)
-    annotations = coco.loadAnns(annotation_ids)
-    masks = [coco.annToMask(a) for a in annotations]
-    mask_all_things = np.sum(masks, axis=0)
-    mask_all_things_rgba = np_array_to_mask(mask_all_things)
+def all_annotations_mask(occluder_index, randomize=False):
+    """Build mask of all Things in random coco image from the occluder index
 
-    if randomize is True:
-        mask = random.choice(masks)
-        mask_all_things_rgba = np_array_to_mask(mask)
+    :param occluder_index: OccluderIndex of people free coco images with annotations
+    :param randomize: if True use a single random Thing instead of all of them
+    :return: tuple of RGBA mask, coco image id, and image file name
+    """
+    mask, image_id, file_name = occluder_index.random_mask(randomize=randomize)
 
-    return mask_all_things_rgba, image_id
+    return np_array_to_mask(mask), image_id, file_name
 
 
-def load_image(image_id, images_path):
-    """load COCO image based on image id"""
-    image_info = coco.loadImgs(ids=image_id)[0]
-    filename = image_info['file_name']
-    image_path = os.path.join(images_path, filename)
+def load_image(file_name, images_path):
+    """load COCO image based on its file name"""
+    image_path = os.path.join(images_path, file_name)
     img = Image.open(image_path).convert('RGBA')
 
     return img, image_path
@@ -156,21 +154,61 @@ def load_image(image_id, images_path):
 
 def save_layer_mask(layers, layer_name, mask, comp_id, out_paths):
     """Save specified layer with mask cut out of it"""
-    layer_mask = generate_mask(layers[layer_name])
-    occluded_mask = ImageChops.multiply(ImageChops.invert(mask), layer_mask)
-    occluded_mask.save(os.path.join(out_paths[layer_name], comp_id))
+    sparse_mask(layers[layer_name], mask).save(os.path.join(out_paths[layer_name], comp_id))
 
 
 def save_masked_depth(depth, mask, comp_id, out_paths):
     comp_id = os.path.splitext(comp_id)[0]
-    depth_array = np.asarray(depth).astype(np.float32)
+    depth_array = np.asarray(depth.to_frame()).astype(np.float32)
     mask_array = np.asarray(mask).copy()
     mask_array[mask_array > 0] = 1
     mask_array = np.ones_like(mask_array) - mask_array
     depth_data = depth_array * mask_array.astype(np.float32)
-    exr = OpenEXR.OutputFile(os.path.join(out_paths['depth'], comp_id + '.exr'), OpenEXR.Header(depth.size[0],
-                                                                                                depth.size[1]))
-    exr.writePixels({'R': depth_data, 'G': depth_data, 'B': depth_data})
+    exr_io.write_depth(os.path.join(out_paths['depth'], comp_id + '.exr'), depth_data)
+
+
+def seed_composite(seed, index):
+    """Seed random number generators for one composite so output depends only on the global seed and index"""
+    random.seed('{}_{}'.format(seed, index))
+    np.random.seed(random.getrandbits(32))
+
+
+def make_composite(index, seed, args, out_paths):
+    """Generate and save one occluded composite and its layer masks
+
+    :param index: number of this composite in the run
+    :param seed: global seed of the run
+    :param args: parsed command line arguments
+    :param out_paths: dict of output directories from ensure_dirs
+    :return: id of the saved composite
+    """
+    seed_composite(seed, index)
+
+    thing_mask, image_id, file_name = all_annotations_mask(occluder_index, randomize=True)
+    base_image, base_path = load_image(file_name, args.coco_images)
+    sim_id = simulant_id(args.simulant_dir)
+
+    comp_id = '{}_{}.png'.format(image_id, sim_id)
+
+    blank = Image.new('RGBA', base_image.size)
+    top_layer = Image.composite(base_image, blank, thing_mask)
+    top_layer.save(os.path.join(out_paths['occlusion'], comp_id))
+    top_mask = generate_mask(top_layer)
+
+    middle_layers = generate_person_overlay(sim_id, base_path, args.simulant_dir, args.patterns)
+    person = middle_layers['person']
+    person = sparse_matching(person, base_image, args.matching, base_path)
+
+    save_layer_mask(middle_layers, 'person', top_mask, comp_id, out_paths)
+    save_layer_mask(middle_layers, 'clothes', top_mask, comp_id, out_paths)
+    save_layer_mask(middle_layers, 'head', top_mask, comp_id, out_paths)
+    save_layer_mask(middle_layers, 'body', top_mask, comp_id, out_paths)
+    save_masked_depth(middle_layers['depth'], top_mask, comp_id, out_paths)
+
+    full_composite = Image.alpha_composite(sparse_composite(base_image, person), top_layer)
+    full_composite.save(os.path.join(out_paths['image'], comp_id))
+
+    return comp_id
 
 
 if __name__ == '__main__':
@@ -179,42 +217,48 @@ if __name__ == '__main__':
     parser.add_argument('--patterns', type=str, help='directory of texture patterns')
     parser.add_argument('--out', type=str, help='directory for output composites')
     parser.add_argument('--matching', type=str, help='foreground / background matching method', default='SAT')
-    parser.add_argument('--coco_json', type=str, help='path to coco instance json')
+    parser.add_argument('--coco_json', type=str, help='path to coco instance json, only needed to build the index')
+    parser.add_argument('--occluders', type=str, help='occluder index directory, built from coco_json if missing',
+                        required=True)
     parser.add_argument('--coco_images', type=str, help='path to all coco images')
     parser.add_argument('--number', type=int, help='number of images to generate')
+    parser.add_argument('--workers', type=int, help='number of worker processes', default=1)
+    parser.add_argument('--seed', type=int, help='global seed, same seed gives same composites', default=None)
+    parser.add_argument('--manifests', type=str, help='if set, directory to keep asset listing manifests in',
+                        default=None)
     args = parser.parse_args()
 
-    # load COCO json information and get people free images
-    coco = COCO(args.coco_json)
-    image_ids = coco.getImgIds()
-    image_ids_with_people = coco.getImgIds(catIds = [1])
-    image_ids_peoplefree = list(set(image_ids) - set(image_ids_with_people))
+    seed = args.seed
+    if seed is None:
+        seed = random.randint(0, 2 ** 31 - 1)
+        print('using seed {}'.format(seed))
 
-    out_paths = ensure_dirs(args.out, ['image', 'person', 'head', 'clothes', 'body', 'occlusion', 'depth'])
+    # people free coco images with annotations, memory mapped so workers share the pages
+    if not os.path.exists(args.occluders):
+        if args.coco_json is None:
+            parser.error('occluder index {} not found, give --coco_json to build it'.format(args.occluders))
+        print('building occluder index {}'.format(args.occluders))
+        occluders.build_index(args.coco_json, args.occluders)
+    init_worker(args.occluders, args.manifests)
 
-    for i in range(args.number):
-        cli.progress_bar((i+1)/args.number)
-        thing_mask, image_id = all_annotations_mask(image_ids_peoplefree, randomize=True)
-        base_image, base_path = load_image(image_id, args.coco_images)
-        sim_id = simulant_id(args.simulant_dir)
+    # scan asset directories once up front: forked workers inherit the listings, others reuse the saved manifests
+    assets.paths(args.patterns, 'png')
+    assets.paths(os.path.join(args.simulant_dir, 'image_combined'), 'png')
 
-        comp_id = '{}_{}.png'.format(image_id, sim_id)
+    out_paths = ensure_dirs(args.out, ['image', 'person', 'head', 'clothes', 'body', 'occlusion', 'depth'])
 
-        blank = Image.new('RGBA', base_image.size)
-        top_layer = Image.composite(base_image, blank, thing_mask)
-        top_layer.save(os.path.join(out_paths['occlusion'], comp_id))
-        top_mask = generate_mask(top_layer)
+    work = functools.partial(make_composite, seed=seed, args=args, out_paths=out_paths)
 
-        middle_layers = generate_person_overlay(sim_id, base_path, args.simulant_dir, args.patterns)
-        person = middle_layers['person']
-        person = matching_method(np.asarray(person), base_image, args.matching)
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers, initializer=init_worker, initargs=(args.occluders, args.manifests))
+        results = pool.imap_unordered(work, range(args.number), chunksize=4)
+    else:
+        pool = None
+        results = (work(i) for i in range(args.number))
 
-        save_layer_mask(middle_layers, 'person', top_mask, comp_id, out_paths)
-        save_layer_mask(middle_layers, 'clothes', top_mask, comp_id, out_paths)
-        save_layer_mask(middle_layers, 'head', top_mask, comp_id, out_paths)
-        save_layer_mask(middle_layers, 'body', top_mask, comp_id, out_paths)
-        save_masked_depth(middle_layers['depth'], top_mask, comp_id, out_paths)
+    for done, _ in enumerate(results):
+        cli.progress_bar((done + 1) / args.number)
 
-        top_two_layers = Image.alpha_composite(person, top_layer)
-        full_composite = Image.alpha_composite(base_image, top_two_layers)
-        full_composite.save(os.path.join(out_paths['image'], comp_id))
+    if pool is not None:
+        pool.close()
+        pool.join()
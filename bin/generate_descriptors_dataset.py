@@ -2,14 +2,12 @@ from __future__ import absolute_import, division, print_function
 
 import os
 import json
-import random
-import subprocess
-import uuid
 
 from argparse import ArgumentParser
 from dataset_toolbox.src.tools.cli import progress_bar
-from dataset_toolbox.src.tools.common import find_filepaths, get_list
-from simulants.description import update_layers
+from dataset_toolbox.src.tools.common import AssetCatalog, mkdirp
+from simulants.description import load_simulants, scene_descriptors
+from simulants.tools.descriptor_store import DescriptorStore
 
 
 distribution = {0: 4826,
@@ -38,21 +36,32 @@ if __name__ == '__main__':
     parser.add_argument('--sims_dir', type=str, help='directory of sim descriptors', required=True)
     parser.add_argument('--out_dir', type=str, help='output dir for scene json files', required=True)
     parser.add_argument('--backgrounds', type=str, help='directory of backround images', required=True)
+    parser.add_argument('--scene_dir', type=str, help='where scene blend files would be saved', default='/tmp')
+    parser.add_argument('--seed', type=int, help='random seed, same seed gives the same dataset', default=None)
+    parser.add_argument('--store', type=str, help='if set, append all scenes to this json lines descriptor store '
+                                                  'instead of writing a json per scene to out_dir', default=None)
     args = parser.parse_args()
 
     loc_distributions = ['uniform', 'beta']
 
-    for sim_count, number in distribution.iteritems():
-        print('scenes containing {} simulants\n'.format(sim_count))
-        for i in range(number):
-            progress_bar((i+1)/number)
+    # simulant pool and backgrounds are loaded once for all scenes
+    assets = AssetCatalog()
+    backgrounds = assets.paths(args.backgrounds, 'hdr')
+    simulants = load_simulants(assets.paths(args.sims_dir, 'json'))
+    total = sum(distribution.values())
 
-            cmd = ['python', 'generate_scene_description.py',
-                   '--out_dir', args.out_dir,
-                   '--scene_dir', '/tmp',
-                   '--sims', args.sims_dir,
-                   '--number', str(sim_count),
-                   '--distribution', random.choice(loc_distributions),
-                   '--backgrounds', args.backgrounds]
+    scenes = scene_descriptors(simulants, distribution, backgrounds, args.scene_dir, loc_distributions, args.seed)
 
-            subprocess.check_call(cmd)
+    def report(scenes):
+        for i, scene_info in enumerate(scenes):
+            yield scene_info
+            if (i + 1) % 1000 == 0 or i + 1 == total:
+                progress_bar((i + 1) / total)
+
+    if args.store is not None:
+        DescriptorStore(args.store, 'scene_id').extend(report(scenes))
+    else:
+        mkdirp(args.out_dir)
+        for scene_info in report(scenes):
+            with open(os.path.join(args.out_dir, '{}.json'.format(scene_info['scene_id'])), 'w') as outfile:
+                json.dump(scene_info, outfile, indent=2)
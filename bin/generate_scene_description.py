@@ -3,11 +3,11 @@ from __future__ import absolute_import, division, print_function
 import os
 import json
 import random
-import uuid
 
 from argparse import ArgumentParser
-from dataset_toolbox.src.tools.common import find_filepaths, get_list, mkdirp
-from simulants.description import update_layers
+from dataset_toolbox.src.tools.common import AssetCatalog, mkdirp
+from simulants.description import scene_descriptor
+from simulants.tools.descriptor_store import DescriptorStore
 
 if __name__ == '__main__':
     parser = ArgumentParser()
@@ -19,45 +19,23 @@ if __name__ == '__main__':
                         default='uniform')
     parser.add_argument('--backgrounds', type=str, help='directory of backround hdr images',
                         default='/usr/local/share/datasets/hdris')
+    parser.add_argument('--seed', type=int, help='random seed, same seed gives the same scene', default=None)
+    parser.add_argument('--store', type=str, help='if set, append the scene to this json lines descriptor store '
+                                                  'instead of writing a json to out_dir', default=None)
 
     args = parser.parse_args()
 
-    backgrounds = find_filepaths(args.backgrounds, 'hdr')
+    assets = AssetCatalog()
+    backgrounds = assets.paths(args.backgrounds, 'hdr')
+    # only the sampled simulant jsons are parsed
+    simulants = assets.paths(args.sims, 'json')
 
-    # Random scene values
-    scene_id = str(uuid.uuid4())
-    background = random.choice(backgrounds)
-    background_rotation = random.uniform(0, 360)
+    scene_info = scene_descriptor(simulants, args.number, backgrounds, args.scene_dir, args.distribution,
+                                  random.Random(args.seed))
 
-    scene_info = {'scene_id': scene_id,
-                  'scene_path': os.path.join(args.scene_dir, '{}.blend'.format(scene_id)),
-                  'background': background,
-                  'background_rotation': background_rotation,
-                  'hdri_intensity': 1,
-                  'image_size': [720, 1280],
-                  'percent_size': 100,
-                  'tile_size': 32,
-                  'distribution': args.distribution}
-
-    simulants = find_filepaths(args.sims, 'json')
-
-    sim_sample = random.sample(simulants, args.number)
-
-    objects = []
-    for i, sim in enumerate(sim_sample):
-        try:
-            with open(sim) as jd:
-                simulant = json.load(jd)
-        except ValueError:
-            print('{} is broken'.format(sim))
-            simulants.remove(sim)
-            with open(random.choice(simulants)) as jd:
-                simulant = json.load(jd)
-        info = update_layers(simulant, i)
-        objects.append(info)
-
-    scene_info['objects'] = objects
-
-    mkdirp(args.out_dir)
-    with open(os.path.join(args.out_dir, '{}.json'.format(scene_id)), 'w') as outfile:
-        json.dump(scene_info, outfile, indent=2)
+    if args.store is not None:
+        DescriptorStore(args.store, 'scene_id').append(scene_info)
+    else:
+        mkdirp(args.out_dir)
+        with open(os.path.join(args.out_dir, '{}.json'.format(scene_info['scene_id'])), 'w') as outfile:
+            json.dump(scene_info, outfile, indent=2)
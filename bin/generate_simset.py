@@ -2,12 +2,13 @@ from __future__ import absolute_import, division, print_function
 
 import os
 import json
-import uuid
 
 from argparse import ArgumentParser
 from codenamize import codenamize
 from dataset_toolbox.src.tools.common import find_filepaths, get_list
-from simulants.description import SimulantDescriptionGenerator
+from simulants.description import SimulantBatch
+from simulants.tools.descriptor_store import DescriptorStore
+from simulants.tools.pose_archive import PoseArchive, PoseReferences
 
 if __name__ == '__main__':
     parser = ArgumentParser()
@@ -20,10 +21,16 @@ if __name__ == '__main__':
                         default='data/patterns')
     parser.add_argument('--pose_list', type=str, help='list of poses to use',
                         default='data/mocap_pose_list.txt')
+    parser.add_argument('--pose_archive', type=str, help='if set, draw poses from every frame of this pose archive '
+                                                         '(path without extension) instead of --pose_list',
+                        default=None)
     parser.add_argument('--hairs', type=str, help='base directory of hair models',
                         default='data/hairs')
     parser.add_argument('--clothes', type=str, help='base directory of clothing models',
                         default='data/clothes')
+    parser.add_argument('--store', type=str, help='if set, append simulants to this json lines descriptor store '
+                                                  'instead of writing a json each to out_dir', default=None)
+    parser.add_argument('--seed', type=int, help='random seed, same seed gives the same simulants', default=None)
     args = parser.parse_args()
 
     if not os.path.exists(args.out_dir):
@@ -33,7 +40,10 @@ if __name__ == '__main__':
         os.makedirs(args.sim_dir)
 
     textures = find_filepaths(args.textures, 'png')
-    poses = get_list(args.pose_list)
+    if args.pose_archive is not None:
+        poses = PoseReferences(PoseArchive(args.pose_archive))
+    else:
+        poses = get_list(args.pose_list)
 
     sim_info = {'out_path': args.sim_dir,
                 'hair_path': args.hairs,
@@ -41,10 +51,13 @@ if __name__ == '__main__':
                 'textures': textures,
                 'poses': poses}
 
-    for i in range(args.number):
-        sim_id = codenamize(str(uuid.uuid4()), 2, 0)
-        simulant = SimulantDescriptionGenerator(i, sim_id, sim_info)
-        info = simulant.desriptor()
+    simulants = SimulantBatch(args.number, sim_info, args.seed, name=lambda sim_uuid: codenamize(sim_uuid, 2, 0))
 
-        with open(os.path.join(args.out_dir, '{}.json'.format(sim_id)), 'w') as outfile:
-            json.dump(info, outfile, indent=2)
+    if args.store is not None:
+        DescriptorStore(args.store).extend(simulants)
+    else:
+        for info in simulants:
+            # named after the simulant id like its blend (<codename>_01_<instance>), so mass_sims can tell the simulant
+            # of a json is built from <sim_dir>/<json name>.blend
+            with open(os.path.join(args.out_dir, '{}.json'.format(info['id'])), 'w') as outfile:
+                json.dump(info, outfile, indent=2)
@@ -1,10 +1,13 @@
 import os
 import glob
 import json
-import subprocess
-import sys
 
-from joblib import Parallel, delayed
+from argparse import ArgumentParser
+from simulants.tools import scheduler, spool
+from simulants.tools.descriptor_store import DescriptorStore
+from simulants.tools.simulant_cache import SimulantCache
+
+jobs_db = 'tmp/jobs.db'
 
 
 def find_filepaths(path, extension):
@@ -15,42 +18,108 @@ def find_filenames(path, extension):
     return [os.path.basename(path) for path in find_filepaths(path, extension)]
 
 
-def write_error(work_item, exception):
+def write_error(job_id, command, exception):
     print('write_error')
     with open('err.log', 'a') as err:
-        err.write(str(work_item))
+        err.write(str(command))
         err.write(' --> ')
         err.write(str(exception))
         err.write('\n')
 
 
-def work(work_item):
-    sim_name = os.path.splitext(os.path.basename(work_item))[0]
-    token_path = os.path.join('tmp/simulants', '{}.blend'.format(sim_name))
+def json_items(paths):
+    """Work items (name, info arguments, descriptor loader) of simulants described by a json each"""
+    def loader(path):
+        def load():
+            with open(path) as jd:
+                return json.load(jd)
+        return load
 
-    if os.path.exists(token_path):
-        print('skipping {}'.format(token_path))
-        return
+    return [(os.path.splitext(os.path.basename(path))[0], ['--info', path], loader(path)) for path in paths]
 
-    # json_path = os.path.join('descriptors', '{}.json'.format(work_item))
 
-    command = ['blender', '-b', '-P', 'blender/make_a_simulant.py', '--', '--info', work_item]
+def store_items(store):
+    """Work items (name, info arguments, descriptor loader) of simulants in a descriptor store"""
+    def loader(descriptor_id):
+        return lambda: store.get(descriptor_id)
 
-    try:
-        subprocess.check_call(command)
-    except Exception as e:
-        write_error(work_item, e)
+    return [(sim_id, ['--info', store.path, '--id', sim_id], loader(sim_id)) for sim_id in store.ids()]
+
+
+def simulant_job(work_item):
+    """Job making the simulant of a work item, already done if its blend exists"""
+    sim_name, info_args, _ = work_item
+    blend_path = os.path.join('tmp/simulants', '{}.blend'.format(sim_name))
+
+    command = ['blender', '-b', '-P', 'blender/make_a_simulant.py', '--'] + info_args
+
+    return 'simulant/' + sim_name, command, 'simulant', (), 3, os.path.exists(blend_path)
+
+
+def cached_simulant_jobs(work_list, cache_dir, cache):
+    """Jobs making simulants through the simulant cache
+
+    Job ids include the descriptor's cache key, so a changed descriptor is a new job while unchanged ones stay done.
+    Of identical descriptors only the first is built, the rest wait for it and are made from its cached blend.
+    """
+    descriptors = []
+    for sim_name, info_args, load in work_list:
+        descriptors.append(dict(load(), work_name=sim_name, info_args=info_args))
+
+    jobs = []
+    for key, group in cache.plan(descriptors, 'make_a_simulant'):
+        build_id = None
+        for sim in group:
+            job_id = 'simulant/{}/{}'.format(sim['work_name'], key[:12])
+            command = ['blender', '-b', '-P', 'blender/make_a_simulant.py', '--'] + sim['info_args'] + \
+                      ['--cache', cache_dir]
+            depends_on = () if build_id is None else (build_id,)
+            jobs.append((job_id, command, 'simulant', depends_on, 3, cache.up_to_date(sim, 'make_a_simulant')))
+            build_id = build_id or job_id
+
+    return jobs
 
 
 if __name__ == '__main__':
-    work_list = find_filepaths('tmp/jsons', 'json')
+    parser = ArgumentParser()
+    parser.add_argument('--workers', type=int, help='number of simulants to make at once', default=2)
+    parser.add_argument('--warm', action='store_true', help='make simulants in long lived Blender workers instead of '
+                                                            'starting Blender for every simulant')
+    parser.add_argument('--cache', type=str, help='if set, simulant cache directory, identical descriptors are '
+                                                  'built once and changed ones rebuilt', default=None)
+    parser.add_argument('--store', type=str, help='if set, make the simulants of this descriptor store instead of '
+                                                  'the jsons in tmp/jsons', default=None)
+    parser.add_argument('--retry_failed', action='store_true', help='retry simulants that failed in an earlier run')
+    args = parser.parse_args()
+
+    if args.store is not None:
+        work_list = store_items(DescriptorStore(args.store))
+    else:
+        work_list = json_items(find_filepaths('tmp/jsons', 'json'))
 
     print('found {} items'.format(len(work_list)))
 
-    # prepare file system
+    # prepare job queue, only new descriptors are checked for an existing blend
+    queue = scheduler.JobQueue(jobs_db)
+    if args.cache is not None:
+        queue.add_many([job for job in cached_simulant_jobs(work_list, args.cache, SimulantCache(args.cache))
+                        if not queue.has(job[0])])
+    else:
+        queue.add_many([simulant_job(i) for i in work_list if not queue.has('simulant/' + i[0])])
+    if args.retry_failed:
+        print('retrying {} failed jobs'.format(queue.retry_failed(['simulant'])))
+    queue.close()
     try:
         os.remove('err.log')
     except:
         pass
 
-    Parallel(n_jobs=2)(delayed(work)(i) for i in work_list)
+    if args.warm:
+        pool = spool.BlenderPool('tmp/spool', args.workers)
+        pool.start()
+        scheduler.run(jobs_db, kinds=['simulant'], workers=args.workers, on_error=write_error,
+                      execute=pool.check_call)
+        pool.close()
+    else:
+        scheduler.run(jobs_db, kinds=['simulant'], workers=args.workers, on_error=write_error)
+    scheduler.print_summary(jobs_db)
@@ -4,23 +4,17 @@ from __future__ import absolute_import
 
 import os
 import json
-import Imath
-import OpenEXR
+import multiprocessing
 import numpy as np
 
-from PIL import Image, ImageChops, ImageStat
+from PIL import Image
 from argparse import ArgumentParser
 
+from simulants import exr_io
 
-def depth_array(file_path):
-    exr = OpenEXR.InputFile(file_path)
-    pixel_type = Imath.PixelType(Imath.PixelType.FLOAT)
-    dw = exr.header()['dataWindow']
-    size = (dw.max.x - dw.min.x + 1, dw.max.y - dw.min.y + 1)
 
-    z = exr.channel('R', pixel_type)
-    z = Image.frombytes('F', size, z)
-    z = np.asarray(z)
+def depth_array(file_path):
+    z = exr_io.read_depth(file_path)
 
     return z
 
@@ -32,43 +26,118 @@ def depth_values(depth_array, z_max=10000000000.0):
     return values
 
 
-if __name__ == '__main__':
+def person_mask(object_path, object_id, mask_parts=('hair', 'misc', 'pants', 'shirt', 'skin')):
+    """Sum of a person's part masks, clipped like ImageChops.add, as an (H, W) uint8 array"""
+    mask = None
+    for part in mask_parts:
+        part = np.asarray(Image.open(os.path.join(object_path, '{}_{}0001.png'.format(part, object_id))).convert('L'))
+        mask = part.astype(np.uint16) if mask is None else mask + part
 
-    parser = ArgumentParser()
-    parser.add_argument('--info', '-i', type=str, help='scene metadata json', required=True)
-    args, _ = parser.parse_known_args()
+    return np.minimum(mask, 255).astype(np.uint8)
+
+
+def mean_distances(depth, masks, z_max=10000000000.0):
+    """Mean depth under each fully opaque mask, in one weighted bincount over all masks
+
+    Masks may overlap, each pixel counts towards every mask covering it. Pixels at or beyond z_max are background.
 
-    with open(args.info) as jd:
+    :param depth: (H, W) depth array
+    :param masks: list of (H, W) uint8 masks
+    :param z_max: depth of empty space
+    :return: array of mean depth per mask, nan where a mask covers no foreground
+    """
+    depth = depth.ravel()
+    foreground = depth < z_max
+    pixels = [np.flatnonzero((mask.ravel() == 255) & foreground) for mask in masks]
+    labels = np.repeat(np.arange(len(masks)), [len(p) for p in pixels])
+    pixels = np.concatenate(pixels) if pixels else np.zeros(0, dtype=np.int64)
+
+    sums = np.bincount(labels, weights=depth[pixels], minlength=len(masks))
+    counts = np.bincount(labels, minlength=len(masks))
+    with np.errstate(invalid='ignore'):
+        distances = sums / counts
+
+    return distances
+
+
+def process_scene(info_path):
+    """Write combined masks for every object of a scene and add person distances to its metadata
+
+    :param info_path: path to scene metadata json
+    :return: scene id
+    """
+    with open(info_path) as jd:
         info = json.load(jd)
 
-    base_path = os.path.split(args.info)[0]
+    base_path = os.path.split(info_path)[0]
 
+    people = []
+    masks = []
     for obj in info['objects']:
+        object_path = os.path.join(base_path, obj['id'])
+
         if obj['class_name'] == 'head':
-            head_mask = Image.open(os.path.join(base_path, obj['id'], 'head_{}.png'.format(obj['id']))).convert('L')
-            head_mask.save(os.path.join(base_path, obj['id'], 'mask_{}.png'.format(obj['id'])))
-            if ImageStat.Stat(head_mask).extrema[0][0] == ImageStat.Stat(head_mask).extrema[0][1]:
+            head_mask = Image.open(os.path.join(object_path, 'head_{}.png'.format(obj['id']))).convert('L')
+            head_mask.save(os.path.join(object_path, 'mask_{}.png'.format(obj['id'])))
+            lo, hi = head_mask.getextrema()
+            if lo == hi:
                 obj['distance'] = float('nan')
 
         if obj['class_name'] == 'person':
-            mask_parts = ['hair', 'misc', 'pants', 'shirt', 'skin']
-            hair = Image.open(os.path.join(base_path, obj['id'],
-                                           'hair_{}0001.png').format(obj['id'])).convert('L')
-            mask = Image.new('L', hair.size, color=0)
-            for part in mask_parts:
-                part = Image.open(os.path.join(base_path, obj['id'],
-                                               '{}_{}0001.png'.format(part, obj['id']))).convert('L')
-                mask = ImageChops.add(mask, part)
+            mask = person_mask(object_path, obj['id'])
+            Image.fromarray(mask).save(os.path.join(object_path, 'mask_{}.png'.format(obj['id'])))
+            people.append(obj)
+            masks.append(mask)
+
+    # the scene's Z buffer is decoded once and shared by every person in it
+    if len(people) > 0:
+        depth = depth_array(os.path.join(base_path, 'z', '{}_0001.exr'.format(info['scene_id'])))
+        for obj, distance in zip(people, mean_distances(depth, masks)):
+            obj['distance'] = float(distance)
 
-            mask.save(os.path.join(base_path, obj['id'], 'mask_{}.png'.format(obj['id'])))
+    with open(os.path.join(base_path, 'metadata_{}.json'.format(info['scene_id'])), 'w') as outfile:
+        json.dump(info, outfile, indent=2)
 
-            mask_np = np.asarray(mask) / 255.0
+    return info['scene_id']
 
-            depth = depth_array(os.path.join(base_path, 'z', '{}_0001.exr'.format(info['scene_id'])))
-            np.putmask(depth, mask_np < 1, 10000000001.0)
-            distance = np.mean(depth_values(depth))
 
-            obj['distance'] = float(distance)
+def find_scenes(root):
+    """All metadata_*.json files below root"""
+    info_paths = []
+    for path, _, files in os.walk(root):
+        for name in files:
+            if name.startswith('metadata_') and name.endswith('.json'):
+                info_paths.append(os.path.join(path, name))
 
-    with open(os.path.join(base_path, 'metadata_{}.json'.format(info['scene_id'])), 'w') as outfile:
-        json.dump(info, outfile, indent=2)
\ No newline at end of file
+    return sorted(info_paths)
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser()
+    parser.add_argument('--info', '-i', type=str, help='scene metadata json', default=None)
+    parser.add_argument('--root', '-r', type=str, help='process every scene metadata json below this directory',
+                        default=None)
+    parser.add_argument('--workers', type=int, help='number of worker processes for --root', default=1)
+    args, _ = parser.parse_known_args()
+
+    assert (args.info is None) != (args.root is None), 'give one of --info or --root'
+
+    if args.info is not None:
+        process_scene(args.info)
+    else:
+        info_paths = find_scenes(args.root)
+
+        if args.workers > 1:
+            pool = multiprocessing.Pool(args.workers)
+            results = pool.imap_unordered(process_scene, info_paths)
+        else:
+            pool = None
+            results = (process_scene(p) for p in info_paths)
+
+        for done, scene_id in enumerate(results):
+            print('{}/{} {}'.format(done + 1, len(info_paths), scene_id))
+
+        if pool is not None:
+            pool.close()
+            pool.join()
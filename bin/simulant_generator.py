@@ -8,17 +8,25 @@ from argparse import ArgumentParser
 from codenamize import codenamize
 from dataset_toolbox.src.tools.common import find_filepaths, get_list, mkdirp
 from simulants.description import SimulantDescriptionGenerator, update_layers
+from simulants.tools.descriptor_store import DescriptorStore
 
 
-def make_a_simulant(sim_info, out_dir):
+def make_a_simulant(sim_info, out_dir, store=None):
+    """Describe a random simulant, written to a json in out_dir or appended to a descriptor store
+
+    :return: the simulant's descriptor
+    """
     sim_id = codenamize(str(uuid.uuid4()), 2, 0)
     simulant = SimulantDescriptionGenerator(0, sim_id, sim_info)
     info = simulant.desriptor()
 
-    with open(os.path.join(out_dir, '{}.json'.format(sim_id)), 'w') as outfile:
+    if store is not None:
+        DescriptorStore(store).append(info)
+    else:
+        with open(os.path.join(out_dir, '{}.json'.format(sim_id)), 'w') as outfile:
             json.dump(info, outfile, indent=2)
 
-    return sim_id
+    return info
 
 
 if __name__ == '__main__':
@@ -42,6 +50,12 @@ if __name__ == '__main__':
     parser.add_argument('--distribution', type=str, help='distribution function for sim positioning',
                         default='uniform')
     parser.add_argument('--layer_dir', type=str, help='directory for rendered layers', required=True)
+    parser.add_argument('--asset_library', type=str, help='if set, directory of shared textures that simulant and '
+                                                          'scene blends reference instead of packing', default=None)
+    parser.add_argument('--sim_store', type=str, help='if set, append the simulant to this json lines descriptor '
+                                                      'store instead of writing a json to out_dir', default=None)
+    parser.add_argument('--scene_store', type=str, help='if set, append the scene to this json lines descriptor '
+                                                        'store instead of writing a json to out_dir', default=None)
     args = parser.parse_args()
 
     mkdirp(args.out_dir)
@@ -57,7 +71,7 @@ if __name__ == '__main__':
                 'textures': textures,
                 'poses': poses}
 
-    sim_id = make_a_simulant(sim_info, args.out_dir)
+    simulant = make_a_simulant(sim_info, args.out_dir, args.sim_store)
 
     # Generate Scene Descriptor
     backgrounds = find_filepaths(args.backgrounds, 'hdr')
@@ -77,29 +91,32 @@ if __name__ == '__main__':
                   'tile_size': 32,
                   'distribution': args.distribution}
 
-    with open(os.path.join(args.out_dir, '{}.json'.format(sim_id))) as jd:
-        simulant = json.load(jd)
     objects = [update_layers(simulant, 0)]
     scene_info['objects'] = objects
 
     mkdirp(args.scene_dir)
-    scene_json = os.path.join(args.out_dir, '{}.json'.format(scene_id))
-    with open(scene_json, 'w') as outfile:
-        json.dump(scene_info, outfile, indent=2)
+    if args.scene_store is not None:
+        DescriptorStore(args.scene_store, 'scene_id').append(scene_info)
+        info_args = ['--info', args.scene_store, '--id', scene_id]
+    else:
+        scene_json = os.path.join(args.out_dir, '{}.json'.format(scene_id))
+        with open(scene_json, 'w') as outfile:
+            json.dump(scene_info, outfile, indent=2)
+        info_args = ['--info', scene_json]
 
     # Make a Scene
     scene_cmd = ['blender', '-b', '-P',
-                 'bin/blender/make_a_scene.py', '--',
-                 '--info', scene_json,
-                 '--base_scene', 'data/base_scene.blend']
-    
+                 'bin/blender/make_a_scene.py', '--'] + info_args + \
+                ['--base_scene', 'data/base_scene.blend']
+    if args.asset_library is not None:
+        scene_cmd += ['--asset_library', args.asset_library]
+
     subprocess.check_call(scene_cmd)
 
     # Render Scene
     command = ['blender', '-b', '-P',
-               'bin/blender/build_and_render_scene.py', '--',
-               '--info', scene_json,
-               '--out', args.layer_dir,
+               'bin/blender/build_and_render_scene.py', '--'] + info_args + \
+              ['--out', args.layer_dir,
                '--base', 'data/base_scene.blend']
 
     subprocess.check_call(command)
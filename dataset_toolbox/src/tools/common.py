@@ -3,6 +3,8 @@ from __future__ import division, absolute_import, print_function
 import json
 import os
 import glob
+import random
+import hashlib
 
 
 def find_filepaths(path, extension):
@@ -28,3 +30,60 @@ def get_list(path):
     list = [x.strip() for x in list]
 
     return list
+
+
+class AssetCatalog:
+    def __init__(self, manifest_dir=None):
+        """Sorted file listings of asset directories, scanned once and sampled in constant time
+
+        :param manifest_dir: if set, listings are also saved here as json and reused by later runs for as long as
+                             the listed directory's modification time is unchanged
+        """
+        self.manifest_dir = manifest_dir
+        self.listings = {}
+
+    def manifest_path(self, path, extension):
+        key = '{}|{}'.format(os.path.abspath(path), extension).encode('utf-8')
+
+        return os.path.join(self.manifest_dir, hashlib.sha1(key).hexdigest() + '.json')
+
+    def scan(self, path, extension):
+        """List file names in path with extension (skipping hidden files, like glob)"""
+        suffix = '.' + extension
+
+        return sorted(name for name in os.listdir(path) if name.endswith(suffix) and not name.startswith('.'))
+
+    def load(self, path, extension):
+        """Return file names from the manifest if it is still fresh, otherwise scan and update the manifest"""
+        if self.manifest_dir is None:
+            return self.scan(path, extension)
+
+        mtime = os.stat(path).st_mtime
+        manifest_path = self.manifest_path(path, extension)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest['mtime'] == mtime:
+                return manifest['files']
+
+        names = self.scan(path, extension)
+        mkdirp(self.manifest_dir)
+        with open(manifest_path, 'w') as f:
+            json.dump({'path': os.path.abspath(path), 'extension': extension, 'mtime': mtime, 'files': names}, f)
+
+        return names
+
+    def paths(self, path, extension):
+        """Sorted paths of all files in path with extension"""
+        key = (path, extension)
+        if key not in self.listings:
+            self.listings[key] = [os.path.join(path, name) for name in self.load(path, extension)]
+
+        return self.listings[key]
+
+    def choice(self, path, extension, rng=random):
+        """Random path of a file in path with extension"""
+        paths = self.paths(path, extension)
+        assert len(paths) > 0, 'no {} files in {}'.format(extension, path)
+
+        return rng.choice(paths)
@@ -0,0 +1,106 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import bpy
+import shutil
+import hashlib
+
+# sha1 of already hashed source files, keyed by (path, mtime), so a warm worker only hashes each texture once
+_digests = {}
+
+
+def file_digest(path):
+    key = (path, os.stat(path).st_mtime)
+    if key not in _digests:
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        _digests[key] = sha1.hexdigest()
+
+    return _digests[key]
+
+
+def library_path(path, library_dir):
+    """Content addressed path of a file in the asset library, copying it in if it is not there yet"""
+    ext = os.path.splitext(path)[1].lower()
+    stored = os.path.join(os.path.abspath(library_dir), file_digest(path) + ext)
+
+    if not os.path.exists(stored):
+        if not os.path.exists(library_dir):
+            os.makedirs(library_dir)
+        tmp_path = '{}.{}.tmp'.format(stored, os.getpid())
+        shutil.copyfile(path, tmp_path)
+        os.rename(tmp_path, stored)
+
+    return stored
+
+
+def store_images(library_dir):
+    """Point every file backed image at a shared copy in the asset library instead of packing it
+
+    Identical textures (MB-Lab skin maps, clothing patterns, hair textures) end up at the same library path for every
+    simulant, so blends only hold references and renders load each texture once.
+
+    :param library_dir: asset library directory, should be visible at the same path wherever the blends are used
+    """
+    for image in bpy.data.images:
+        if image.source != 'FILE' or image.packed_file is not None or image.library is not None:
+            continue
+
+        path = bpy.path.abspath(image.filepath)
+        if not os.path.isfile(path):
+            continue
+
+        image.filepath = library_path(path, library_dir)
+
+
+def save(filepath, library_dir=None):
+    """Save the current file, self-contained (packed) without a library, otherwise referencing library assets"""
+    if library_dir is None:
+        bpy.ops.file.pack_all()
+    else:
+        store_images(library_dir)
+
+    bpy.ops.wm.save_as_mainfile(filepath=filepath, relative_remap=library_dir is None)
+
+
+def load_objects(blend_path, suffix, link=False):
+    """Load the objects of a blend whose names end in suffix into the current scene
+
+    :param blend_path: blend to load from
+    :param suffix: object name suffix, i.e. a simulant id
+    :param link: link instead of appending, the objects then stay read-only references to blend_path
+    :return: list of loaded objects
+    """
+    with bpy.data.libraries.load(blend_path, link=link) as (source, target):
+        target.objects = [name for name in source.objects if name.endswith(suffix)]
+
+    objects = [obj for obj in target.objects if obj is not None]
+    for obj in objects:
+        bpy.context.scene.objects.link(obj)
+
+    return objects
+
+
+def merge_duplicate_images():
+    """Remap images sharing a file to a single datablock, i.e. after appending several library mode simulants
+
+    :return: number of images removed
+    """
+    by_path = {}
+    removed = 0
+    for image in list(bpy.data.images):
+        if image.source != 'FILE' or image.packed_file is not None:
+            continue
+
+        path = os.path.normpath(bpy.path.abspath(image.filepath, library=image.library))
+        if path not in by_path:
+            by_path[path] = image
+            continue
+
+        image.user_remap(by_path[path])
+        bpy.data.images.remove(image)
+        removed += 1
+
+    return removed
@@ -1,8 +1,26 @@
 from __future__ import absolute_import, division, print_function
 
+import copy
+import json
 import math
 import os
 import random
+import uuid
+
+import numpy as np
+
+BASE_MESHES = ['f_ca01', 'f_as01', 'f_af01', 'm_ca01', 'm_as01', 'm_af01']
+HAIRS = ['01', '02', '03', '04', '06', '07']
+RETEXTURE_TYPES = ['noise_wrinkle', 'wave_wrinkle', 'magic_wrinkle', 'new_texture']
+PANTS_MASKS = ['', 'shorts_1', 'shorts_2', 'shorts_3']
+SHIRT_MASKS = ['shirt_neck', 'shirt_sleeveless', 'shirt_croptop', 'shirt_open_front', 'shirt_short_1', 'shirt_short_2']
+RANDOMIZE = {'mblab_preserve_fantasy': 'True',
+             'mblab_preserve_mass': 'True',
+             'mblab_preserve_tone': 'True',
+             'mblab_preserve_height': 'False',
+             'mblab_preserve_body': 'False',
+             'mblab_preserve_face': 'False',
+             'mblab_preserve_phenotype': 'False'}
 
 
 class SimulantDescriptionGenerator:
@@ -14,12 +32,6 @@ class SimulantDescriptionGenerator:
         :param sim_info: dict containing out_path, hair_path, clothing_path, textures, and poses
         """
         layer_base = instance_id * 10
-        base_meshes = ['f_ca01', 'f_as01', 'f_af01', 'm_ca01', 'm_as01', 'm_af01']
-        hairs = ['01', '02', '03', '04', '06', '07']
-        retexture_types = ['noise_wrinkle', 'wave_wrinkle', 'magic_wrinkle', 'new_texture']
-        pants_masks = ['', 'shorts_1', 'shorts_2', 'shorts_3']
-        shirt_masks = ['shirt_neck', 'shirt_sleeveless', 'shirt_croptop', 'shirt_open_front',
-                       'shirt_short_1', 'shirt_short_2']
         location = random_position()
 
         self.instance_id = str(instance_id).zfill(4)
@@ -29,17 +41,11 @@ class SimulantDescriptionGenerator:
         self.skeleton = 'skeleton_{}'.format(self.id)
         self.geometry = 'body_{}'.format(self.id)
         self.path = os.path.join(sim_info['out_path'], '{}.blend'.format(self.id))
-        self.base_mesh = random.choice(base_meshes)
+        self.base_mesh = random.choice(BASE_MESHES)
         self.sex = which_sex(self.base_mesh)
         self.head_proxy = {'id': 'head_proxy_{}'.format(self.id),
                            'layer': instance_id + 1}
-        self.randomize = {'mblab_preserve_fantasy': 'True',
-                          'mblab_preserve_mass': 'True',
-                          'mblab_preserve_tone': 'True',
-                          'mblab_preserve_height': 'False',
-                          'mblab_preserve_body': 'False',
-                          'mblab_preserve_face': 'False',
-                          'mblab_preserve_phenotype': 'False'}
+        self.randomize = dict(RANDOMIZE)
         self.skin = {'hue': random.gauss(0.5, 0.2),
                      'saturation': random.uniform(0.6, 1),
                      'value': random.uniform(0.1, 1),
@@ -54,21 +60,21 @@ class SimulantDescriptionGenerator:
                        'mass': random.uniform(0, 1),
                        'tone': random.uniform(0, 1)}
         self.hair = {'model': os.path.join(sim_info['hair_path'],
-                                           '{}_hair_{}.blend'.format(self.sex, random.choice(hairs))),
+                                           '{}_hair_{}.blend'.format(self.sex, random.choice(HAIRS))),
                      'id': 'hair_{}'.format(self.id),
                      'rgb': {'r': random.uniform(0, 1), 'g': random.uniform(0, 1), 'b': random.uniform(0, 1)},
                      'render_layer': layer_base + 4}
         self.shirt = {'id': 'tshirt_{}'.format(self.id),
                       'model': os.path.join(sim_info['clothes_path'], 'human_{}_clothes.blend'.format(self.sex)),
-                      'retexture_type': random.choice(retexture_types),
+                      'retexture_type': random.choice(RETEXTURE_TYPES),
                       'texture': random.choice(sim_info['textures']),
-                      'style': random.choice(shirt_masks),
+                      'style': random.choice(SHIRT_MASKS),
                       'render_layer': layer_base + 2}
         self.pants = {'id': 'pants_{}'.format(self.id),
                       'model': os.path.join(sim_info['clothes_path'], 'human_{}_clothes.blend'.format(self.sex)),
-                      'retexture_type': random.choice(retexture_types),
+                      'retexture_type': random.choice(RETEXTURE_TYPES),
                       'texture': random.choice(sim_info['textures']),
-                      'style': random.choice(pants_masks),
+                      'style': random.choice(PANTS_MASKS),
                       'render_layer': layer_base + 3}
         self.pose = random.choice(sim_info['poses'])
         self.location = {'x': location[0],
@@ -99,6 +105,117 @@ class SimulantDescriptionGenerator:
                 'rotation': self.rotation}
 
 
+# Fields drawn per simulant by SimulantBatch, choices are indices into their lists
+VALUE_FIELDS = ['skin_hue', 'skin_saturation', 'skin_value', 'skin_age', 'skin_bump', 'eye_hue', 'eye_saturation',
+                'eye_value', 'age', 'mass', 'tone', 'hair_r', 'hair_g', 'hair_b', 'x', 'y', 'rotation']
+CHOICE_FIELDS = ['base_mesh', 'hair', 'shirt_retexture', 'shirt_texture', 'shirt_style', 'pants_retexture',
+                 'pants_texture', 'pants_style', 'pose']
+VALUE_DTYPE = np.dtype([(field, np.float64) for field in VALUE_FIELDS])
+CHOICE_DTYPE = np.dtype([(field, np.int64) for field in CHOICE_FIELDS])
+
+
+class SimulantBatch:
+    def __init__(self, number, sim_info, seed=None, first_instance=0, name=None):
+        """Draw the characteristics of many simulants at once, descriptors are made on access
+
+        Descriptors have the same fields and distributions as SimulantDescriptionGenerator.desriptor(), simulant
+        number i getting instance id first_instance + i. Only the random draws are kept in memory, so planning
+        millions of simulants takes seconds.
+
+        :param number: number of simulants
+        :param sim_info: dict containing out_path, hair_path, clothing_path, textures, and poses
+        :param seed: random seed, the same seed and inputs give the same simulants
+        :param first_instance: instance id of the first simulant
+        :param name: function making the simulant's name from a random uuid string, i.e. a codenamize; default
+                     uses the uuid as is
+        """
+        rng = np.random.default_rng(seed)
+        self.number = number
+        self.sim_info = sim_info
+        self.first_instance = first_instance
+        self.name = name or (lambda sim_uuid: sim_uuid)
+        self.uuids = rng.integers(0, 1 << 64, size=(number, 2), dtype=np.uint64)
+
+        # one contiguous block per dtype viewed as a structured array, then the few non unit ranges are rescaled
+        values = rng.random((number, len(VALUE_FIELDS))).view(VALUE_DTYPE)[:, 0]
+        values['skin_hue'] = rng.normal(0.5, 0.2, number)
+        values['skin_saturation'] = 0.6 + 0.4 * values['skin_saturation']
+        values['skin_value'] = 0.1 + 0.9 * values['skin_value']
+        values['rotation'] = 360 * values['rotation'] - 180
+        positions = random_positions(number, rng=rng)
+        values['x'] = positions[:, 0]
+        values['y'] = positions[:, 1]
+
+        sizes = {'base_mesh': len(BASE_MESHES), 'hair': len(HAIRS),
+                 'shirt_retexture': len(RETEXTURE_TYPES), 'shirt_texture': len(sim_info['textures']),
+                 'shirt_style': len(SHIRT_MASKS), 'pants_retexture': len(RETEXTURE_TYPES),
+                 'pants_texture': len(sim_info['textures']), 'pants_style': len(PANTS_MASKS),
+                 'pose': len(sim_info['poses'])}
+        choices = rng.random((number, len(CHOICE_FIELDS))) * [sizes[field] for field in CHOICE_FIELDS]
+        self.values = values
+        self.choices = choices.astype(np.int64).view(CHOICE_DTYPE)[:, 0]
+
+    def __len__(self):
+        return self.number
+
+    def __iter__(self):
+        for i in range(self.number):
+            yield self.descriptor(i)
+
+    def sim_uuid(self, i):
+        high, low = self.uuids[i]
+        return str(uuid.UUID(int=(int(high) << 64) | int(low), version=4))
+
+    def descriptor(self, i):
+        """Descriptor dict of simulant number i, as SimulantDescriptionGenerator.desriptor() gives it"""
+        d = dict(zip(VALUE_FIELDS, self.values[i].item()))
+        d.update(zip(CHOICE_FIELDS, self.choices[i].item()))
+        instance_id = self.first_instance + i
+        layer_base = instance_id * 10
+        name = self.name(self.sim_uuid(i))
+        sim_id = '{}_01_{}'.format(name, str(instance_id).zfill(4))
+        base_mesh = BASE_MESHES[d['base_mesh']]
+        sex = which_sex(base_mesh)
+        clothes = os.path.join(self.sim_info['clothes_path'], 'human_{}_clothes.blend'.format(sex))
+        textures = self.sim_info['textures']
+
+        return {'id': sim_id,
+                'class_name': 'simulant',
+                'head_id': '{}_91_{}'.format(name, str(instance_id).zfill(4)),
+                'skeleton': 'skeleton_{}'.format(sim_id),
+                'geometry': 'body_{}'.format(sim_id),
+                'path': os.path.join(self.sim_info['out_path'], '{}.blend'.format(sim_id)),
+                'sex': sex,
+                'head_proxy': {'id': 'head_proxy_{}'.format(sim_id), 'layer': instance_id + 1},
+                'base_mesh': base_mesh,
+                'skin': {'hue': d['skin_hue'], 'saturation': d['skin_saturation'], 'value': d['skin_value'],
+                         'age': d['skin_age'], 'bump': d['skin_bump'], 'render_layer': layer_base + 1},
+                'misc': {'render_layer': layer_base + 6},
+                'eye': {'hue': d['eye_hue'], 'saturation': d['eye_saturation'], 'value': d['eye_value']},
+                'traits': {'age': d['age'], 'mass': d['mass'], 'tone': d['tone']},
+                'randomize': dict(RANDOMIZE),
+                'hair': {'model': os.path.join(self.sim_info['hair_path'],
+                                               '{}_hair_{}.blend'.format(sex, HAIRS[d['hair']])),
+                         'id': 'hair_{}'.format(sim_id),
+                         'rgb': {'r': d['hair_r'], 'g': d['hair_g'], 'b': d['hair_b']},
+                         'render_layer': layer_base + 4},
+                'shirt': {'id': 'tshirt_{}'.format(sim_id),
+                          'model': clothes,
+                          'retexture_type': RETEXTURE_TYPES[d['shirt_retexture']],
+                          'texture': textures[d['shirt_texture']],
+                          'style': SHIRT_MASKS[d['shirt_style']],
+                          'render_layer': layer_base + 2},
+                'pants': {'id': 'pants_{}'.format(sim_id),
+                          'model': clothes,
+                          'retexture_type': RETEXTURE_TYPES[d['pants_retexture']],
+                          'texture': textures[d['pants_texture']],
+                          'style': PANTS_MASKS[d['pants_style']],
+                          'render_layer': layer_base + 3},
+                'pose': self.sim_info['poses'][d['pose']],
+                'location': {'x': d['x'], 'y': d['y'], 'z': 0},
+                'rotation': {'x': 0.0, 'y': 0.0, 'z': d['rotation']}}
+
+
 def which_sex(base_mesh):
     """From base mesh name, return simulant's sex"""
     sex = ''
@@ -132,6 +249,22 @@ def random_position(fov=30, min=2, max=10, camera=-2.5, type='beta'):
     return (x, y, z)
 
 
+def random_positions(number, fov=30, min=2, max=10, camera=-2.5, type='beta', rng=None):
+    """Generate number x,y,z positions within a given frustum at once, see random_position
+
+    :param rng: numpy random Generator
+    :return: (number, 3) array of coordinates
+    """
+    rng = rng or np.random.default_rng()
+    if type == 'beta':
+        rho = (1 - rng.beta(min, max, number)) * 10
+    else:
+        rho = rng.uniform(1.5, 10, number)
+    phi = rng.uniform(math.radians(-1*fov/2), math.radians(fov/2), number)
+
+    return np.stack([rho * np.sin(phi), rho * np.cos(phi) + camera, np.zeros(number)], axis=1)
+
+
 def update_layers(simulant, instance_id):
     """Update the layers & render layers of a simulant
 
@@ -147,3 +280,102 @@ def update_layers(simulant, instance_id):
     simulant['pants']['render_layer'] = layer_base + 3
 
     return simulant
+
+
+def load_simulants(paths):
+    """Parse simulant descriptor jsons once, skipping (and reporting) broken ones
+
+    :param paths: list of simulant json paths
+    :return: list of simulant descriptor dicts
+    """
+    simulants = []
+    for path in paths:
+        try:
+            with open(path) as jd:
+                simulants.append(json.load(jd))
+        except ValueError:
+            print('{} is broken'.format(path))
+
+    return simulants
+
+
+def sample_simulants(simulants, number, rng=random):
+    """Randomly sample simulants, parsing only the sampled ones when the pool is a list of json paths
+
+    Broken jsons in the sample are reported and replaced by another random simulant.
+
+    :param simulants: pool of simulant descriptors from load_simulants or of simulant json paths, left unchanged
+    :param number: number of simulants to sample
+    :param rng: random number generator
+    :return: list of sampled simulant descriptor dicts, copies of the pool's descriptors
+    """
+    assert number <= len(simulants), 'can not sample {} of {} simulants'.format(number, len(simulants))
+
+    # sampling indices draws the same sample as sampling the pool itself
+    indices = rng.sample(range(len(simulants)), number)
+    used = set(indices)
+    sample = []
+    while indices:
+        simulant = simulants[indices.pop(0)]
+        if isinstance(simulant, dict):
+            sample.append(copy.deepcopy(simulant))
+            continue
+
+        try:
+            with open(simulant) as jd:
+                sample.append(json.load(jd))
+        except ValueError:
+            print('{} is broken'.format(simulant))
+            unused = [i for i in range(len(simulants)) if i not in used]
+            assert len(unused) > 0, 'not enough unbroken simulants to sample {}'.format(number)
+            indices.append(rng.choice(unused))
+            used.add(indices[-1])
+
+    return sample
+
+
+def scene_descriptor(simulants, number, backgrounds, scene_dir, distribution='uniform', rng=random):
+    """Describe a scene of randomly sampled simulants
+
+    :param simulants: pool of simulant descriptors from load_simulants or of simulant json paths, see sample_simulants
+    :param number: number of simulants in the scene
+    :param backgrounds: list of background hdr paths
+    :param scene_dir: where the scene blend file would be saved
+    :param distribution: distribution function for sim positioning
+    :param rng: random number generator, seed a random.Random for reproducible scenes
+    :return: scene descriptor dict
+    """
+    scene_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+    scene_info = {'scene_id': scene_id,
+                  'scene_path': os.path.join(scene_dir, '{}.blend'.format(scene_id)),
+                  'background': rng.choice(backgrounds),
+                  'background_rotation': rng.uniform(0, 360),
+                  'hdri_intensity': 1,
+                  'image_size': [720, 1280],
+                  'percent_size': 100,
+                  'tile_size': 32,
+                  'distribution': distribution}
+
+    sample = sample_simulants(simulants, number, rng)
+    scene_info['objects'] = [update_layers(simulant, i) for i, simulant in enumerate(sample)]
+
+    return scene_info
+
+
+def scene_descriptors(simulants, counts, backgrounds, scene_dir, distributions=('uniform', 'beta'), seed=None):
+    """Stream scene descriptors, the same seed and inputs give the same scenes
+
+    :param simulants: pool of simulant descriptors from load_simulants
+    :param counts: dict of simulants per scene to number of such scenes
+    :param backgrounds: list of background hdr paths
+    :param scene_dir: where scene blend files would be saved
+    :param distributions: positioning distributions to choose from per scene
+    :param seed: random seed
+    :return: generator of scene descriptor dicts
+    """
+    rng = random.Random(seed)
+    for sim_count in sorted(counts):
+        for _ in range(counts[sim_count]):
+            distribution = rng.choice(distributions)
+            yield scene_descriptor(simulants, sim_count, backgrounds, scene_dir, distribution, rng)
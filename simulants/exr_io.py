@@ -0,0 +1,93 @@
+from __future__ import absolute_import, division, print_function
+
+import Imath
+import OpenEXR
+import numpy as np
+
+# Storage policy for depth maps: one channel, 32 bit float, lossless zip compression
+DEPTH_CHANNEL = 'Z'
+DEPTH_HALF = False
+DEPTH_COMPRESSION = 'ZIP_COMPRESSION'
+
+PIXEL_TYPES = {np.dtype(np.float32): Imath.PixelType.FLOAT, np.dtype(np.float16): Imath.PixelType.HALF}
+
+
+def pixel_dtype(half):
+    return np.dtype(np.float16) if half else np.dtype(np.float32)
+
+
+def exr_size(exr):
+    """(width, height) of an open EXR's data window"""
+    data_window = exr.header()['dataWindow']
+
+    return data_window.max.x - data_window.min.x + 1, data_window.max.y - data_window.min.y + 1
+
+
+def read_channels(file_path, channels, half=False):
+    """Decode the requested channels of an EXR straight into numpy
+
+    :param file_path: path to EXR file
+    :param channels: sequence of channel names, i.e. ('R', 'G')
+    :param half: if True decode to float16 instead of float32
+    :return: (len(channels), H, W) array
+    """
+    exr = OpenEXR.InputFile(file_path)
+    width, height = exr_size(exr)
+    dtype = pixel_dtype(half)
+    pixel_type = Imath.PixelType(PIXEL_TYPES[dtype])
+
+    data = np.empty((len(channels), height, width), dtype=dtype)
+    for i, raw in enumerate(exr.channels(list(channels), pixel_type)):
+        data[i] = np.frombuffer(raw, dtype=dtype).reshape(height, width)
+    exr.close()
+
+    return data
+
+
+def read_depth(file_path, half=False):
+    """Read an (H, W) depth map, from the Z channel if there is one, otherwise from R as Blender writes it
+
+    :param file_path: path to EXR depth map
+    :param half: if True decode to float16 instead of float32
+    :return: (H, W) array
+    """
+    exr = OpenEXR.InputFile(file_path)
+    channel = DEPTH_CHANNEL if DEPTH_CHANNEL in exr.header()['channels'] else 'R'
+    exr.close()
+
+    return read_channels(file_path, (channel,), half)[0]
+
+
+def write_channels(file_path, channels, half=False, compression=DEPTH_COMPRESSION):
+    """Write (H, W) arrays to an EXR as named channels
+
+    :param file_path: path of EXR to write
+    :param channels: dict of channel name to (H, W) array, all the same size
+    :param half: if True store as float16 instead of float32
+    :param compression: name of an Imath.Compression, i.e. 'ZIP_COMPRESSION'
+    """
+    dtype = pixel_dtype(half)
+    pixel_type = Imath.PixelType(PIXEL_TYPES[dtype])
+    shapes = set(np.shape(data) for data in channels.values())
+    assert len(shapes) == 1, 'channels have different sizes {}'.format(shapes)
+    height, width = shapes.pop()
+
+    header = OpenEXR.Header(width, height)
+    header['channels'] = dict((name, Imath.Channel(pixel_type)) for name in channels)
+    header['compression'] = Imath.Compression(getattr(Imath.Compression, compression))
+
+    exr = OpenEXR.OutputFile(file_path, header)
+    exr.writePixels(dict((name, np.ascontiguousarray(data, dtype=dtype).tobytes())
+                         for name, data in channels.items()))
+    exr.close()
+
+
+def write_depth(file_path, depth, half=DEPTH_HALF, compression=DEPTH_COMPRESSION):
+    """Write an (H, W) depth map as a single channel EXR following the depth storage policy
+
+    :param file_path: path of EXR to write
+    :param depth: (H, W) array or PIL 'F' image of depths
+    :param half: if True store as float16 instead of float32
+    :param compression: name of an Imath.Compression
+    """
+    write_channels(file_path, {DEPTH_CHANNEL: np.asarray(depth)}, half, compression)
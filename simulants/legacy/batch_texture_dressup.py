@@ -4,30 +4,19 @@ from __future__ import absolute_import
 
 import os
 import sys
-import random
 import subprocess
 
 from argparse import ArgumentParser
+from dataset_toolbox.src.tools.common import AssetCatalog
 
-
-def list_files(path_to_annotations, file_extension):
-    """Get list of files in a given directory"""
-    file_list = []
-    for file in os.listdir(path_to_annotations):
-        if file.endswith('.' + file_extension):
-            file_list.append(file)
-    return file_list
+# Directory listings of foregrounds, backgrounds, and textures, scanned once per run
+assets = AssetCatalog()
 
 
 def pick_random_images(base_dir, background_dir):
     """Return paths to randomly chosen fore/background images"""
-    foreground_list = list_files(base_dir, 'png')
-    background_list = list_files(background_dir, 'jpg')
-
-    base_image = random.choice(foreground_list)
-
-    foreground_image = os.path.join(base_dir, base_image)
-    background_image = os.path.join(background_dir, random.choice(background_list))
+    foreground_image = assets.choice(base_dir, 'png')
+    background_image = assets.choice(background_dir, 'jpg')
 
     return {'front': foreground_image, 'back': background_image}
 
@@ -105,9 +94,8 @@ if __name__ == '__main__':
         uv = os.path.join(args.input_dir, 'uv', os.path.splitext(base_name)[0] + '.exr')
         depth = os.path.join(args.input_dir, 'z', os.path.splitext(base_name)[0] + '.exr')
 
-        texture_list = list_files(args.texture, 'png')
-        pants_text = os.path.join(args.texture, random.choice(texture_list))
-        shirt_text = os.path.join(args.texture, random.choice(texture_list))
+        pants_text = assets.choice(args.texture, 'png')
+        shirt_text = assets.choice(args.texture, 'png')
 
         cmd = ['python', 'combine_layers.py',
                '--person', person,
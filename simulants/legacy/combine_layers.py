@@ -5,19 +5,26 @@ from __future__ import absolute_import
 import os
 import copy
 import math
-import Imath
 import random
-import OpenEXR
 import colorsys
 import datetime
 import numpy as np
 import simulants.tools.matching as match
+import simulants.tools.compositing as compositing
+import simulants.tools.texture as texture
+import simulants.tools.warp as warp
+import simulants.exr_io as exr_io
 
-from PIL import Image, ImageOps, ImageChops
+from PIL import Image, ImageChops
 from skimage import color
-from scipy import misc, ndimage
 from argparse import ArgumentParser
 
+# Decoded UV maps and textures are reused across calls (shirt and pants share one UV render)
+texture_mapper = texture.TextureMapper()
+
+# Histogram CDFs of backgrounds that are reused across composites
+background_stats = match.BackgroundStatsCache()
+
 
 def emoji_skin():
     """Skin colours from the 5 skin tone groups of emoji
@@ -119,17 +126,13 @@ def convert_to_binary(image):
     return image
 
 
-def colorize_hair(image, hair_mask):
-    image = image.convert(mode='L')
-    image = ImageOps.autocontrast(image, ignore=0)
-    mid_point = random.uniform(0,1)
+def random_hair_colors():
+    """Random dark and light RGB tuples split at a random brightness"""
+    mid_point = random.uniform(0, 1)
     dark = random_hsv_color(0, mid_point)
     light = random_hsv_color(mid_point, 1)
-    colorized = ImageOps.colorize(image, dark, light)
-    r, g, b = colorized.split()
-    just_hair = Image.merge('RGBA', (r, g, b, hair_mask))
 
-    return just_hair
+    return dark, light
 
 
 def mask2rgba(alpha_image):
@@ -141,111 +144,53 @@ def mask2rgba(alpha_image):
     return Image.fromarray(rgba.astype('uint8'))
 
 
-def map_texture(texture_path, uv_map):
-    """Use given UV map to map texture within mask area
-
-    :param texture_path: path to a texture to use
-    :param uv_map: OpenEXR image
-    :return: PIL mode 'RGB' mapped texture
-    """
-    texture = misc.imread(texture_path)
-    tex_size = texture.shape[0]
-
-    # EXR handling
-    pixel_type = Imath.PixelType(Imath.PixelType.FLOAT)
-    data_window = uv_map.header()['dataWindow']
-    size = (data_window.max.x - data_window.min.x + 1, data_window.max.y - data_window.min.y + 1)
-    x_raw = uv_map.channel('R', pixel_type)
-    y_raw = uv_map.channel('G', pixel_type)
-    x_norm = Image.frombytes('F', size, x_raw)
-    y_norm = Image.frombytes('F', size, y_raw)
-
-    x_map = np.asarray(x_norm) * tex_size
-    y_map = np.asarray(y_norm) * tex_size
-
-    uv = np.stack([x_map, y_map], axis=2)
-    uv = uv.transpose(2, 0, 1)
-
-    mapped_r = ndimage.map_coordinates(texture[:, :, 0], uv, prefilter=False, order=0)
-    mapped_g = ndimage.map_coordinates(texture[:, :, 1], uv, prefilter=False, order=0)
-    mapped_b = ndimage.map_coordinates(texture[:, :, 2], uv, prefilter=False, order=0)
-
-    mapped_texture = np.stack([mapped_r, mapped_g, mapped_b], axis=2)
-
-    return Image.fromarray(mapped_texture, mode='RGB')
+def random_appearance(textured):
+    """Draw skin colour, hair colours and, without clothing textures, shirt and pants colours
 
+    Draws in the same order as the original PIL chain so seeded runs are unchanged.
 
-def blend_overlay(base_img, overlay_img, opacity):
-    """Overlay blend of image and overlay image by factor of opacity
-
-    :param img_in: PIL 'RGBA' mode image
-    :param overlay_img: PIL 'RBBA' mode image
-    :param opacity: float [0,1]
-    :return: PIL RGBA
+    :param textured: True if shirt and pants are mapped with textures
+    :return: dict of skin, hair and (untextured) shirt and pants colours
     """
-    base_img = np.asarray(base_img).astype(np.float)
-    overlay_img = np.asarray(overlay_img).astype(np.float)
-
-    # sanity check of inputs
-    assert base_img.dtype.kind == 'f', 'Input variable img_in should be of numpy.float type.'
-    assert overlay_img.dtype.kind == 'f', 'Input variable overlay_img should be of numpy.float type.'
-    assert base_img.shape[2] == 4, 'Input variable img_in should be of shape [:, :,4].'
-    assert overlay_img.shape[2] == 4, 'Input variable overlay_img should be of shape [:, :,4].'
-    assert 0.0 <= opacity <= 1.0, 'Opacity needs to be between 0.0 and 1.0.'
-
-    base_img /= 255.0
-    overlay_img /= 255.0
-
-    comp_alpha = np.minimum(base_img[:, :, 3], overlay_img[:, :, 3]) * opacity
-    new_alpha = base_img[:, :, 3] + (1.0 - base_img[:, :, 3]) * comp_alpha
-    np.seterr(divide='ignore', invalid='ignore')
-    ratio = comp_alpha / new_alpha
-    ratio[ratio == np.NAN] = 0.0
-
-    comp = base_img[:,:,:3] * (base_img[:,:,:3] + (2 * overlay_img[:,:,:3]) * (1 - base_img[:,:,:3]))
-
-    ratio_rs = np.reshape(np.repeat(ratio, 3), [comp.shape[0], comp.shape[1], comp.shape[2]])
-    img_out = comp * ratio_rs + base_img[:, :, :3] * (1.0 - ratio_rs)
-    img_out = np.nan_to_num(np.dstack((img_out, base_img[:, :, 3])))  # add alpha channel and replace nans
-
-    return Image.fromarray((img_out * 255).astype(np.uint8), mode='RGBA')
-
-
-def apply_uv_texture(texture_path, uv_map, base_image, alpha_mask):
-    """Apply texture using uv wrapping and texture from original render"""
+    appearance = {'skin': randomize_skin(random.choice(emoji_skin())),
+                  'hair': random_hair_colors()}
 
-    mapped_texture = map_texture(texture_path, uv_map)
-    mapped_texture = ImageChops.multiply(mapped_texture, base_image.convert('RGB'))
-    t_r, t_g, t_b = mapped_texture.split()
-    mapped_with_alpha = Image.merge('RGBA', (t_r, t_g, t_b, alpha_mask))
+    if not textured:
+        appearance['shirt'] = random_hsv_color(0, 1)
+        appearance['pants'] = random_hsv_color(0, 1)
 
-    return mapped_with_alpha
+    return appearance
 
 
-def etc_layer(base_image, etc_alpha):
-    """Generate RGBA image of remaining parts"""
-    r, g, b, a = base_image.split()
-    etc = Image.merge('RGBA', (r, g, b, etc_alpha))
+def sequence_appearance(appearance):
+    """Appearance with the parts that do not depend on the frame precomputed, to clothe every frame of a sequence"""
+    return dict(appearance, hair_lut=compositing.colorize_lut(*appearance['hair']))
 
-    return etc
 
+def clothe_person(stack, appearance, pants_tex_path, shirt_tex_path, uv_path):
+    """Composite a layer stack with a given appearance, see make_clothed_person
 
-def mask_check(mask, name):
-    """Make sure mask is all 1s and 0s"""
-    mask_array = np.asarray(mask)
-    non_zero_mask = mask_array[np.nonzero(mask_array)]
-    fractional_mask = non_zero_mask[np.where(non_zero_mask < 1)]
-    num_nonzero = len(non_zero_mask)
-    num_fractional = len(fractional_mask)
-    assert num_fractional <= 0.01 * num_nonzero, '{} fractional values in {}'.format(num_fractional, name)
+    :param stack: layer stack from compositing.read_layer_stack
+    :param appearance: dict from random_appearance, or sequence_appearance
+    :return: tuple of full composite (RGBA), clothes mask (L), head mask (L), and non-head skin mask (L)
+    """
+    if pants_tex_path != '':
+        shirt = texture_mapper.map(shirt_tex_path, uv_path)
+        pants = texture_mapper.map(pants_tex_path, uv_path)
+    else:
+        shirt = appearance['shirt']
+        pants = appearance['pants']
 
+    hair = appearance.get('hair_lut', appearance['hair'])
+    composite, clothes_mask, whole_head_mask, body_mask = compositing.composite_person(stack, appearance['skin'], hair,
+                                                                                       shirt, pants, 0.85)
 
-def read_mask(mask_path):
-    """Read mask and check that it is binary"""
-    mask = Image.open(mask_path).convert('L')
-    mask_check(mask, mask_path)
+    final_comp = Image.fromarray(composite, mode='RGBA')
+    clothes_mask = Image.fromarray(clothes_mask, mode='L')
+    whole_head_mask = Image.fromarray(whole_head_mask, mode='L')
+    body_alpha = Image.fromarray(body_mask, mode='L')
 
-    return mask
+    return final_comp, clothes_mask, whole_head_mask, body_alpha
 
 
 def make_clothed_person(image_path, body_path, shirt_path, pants_path, hair_path, ao_path, head_path,
@@ -265,47 +210,12 @@ def make_clothed_person(image_path, body_path, shirt_path, pants_path, hair_path
     :param etc_path: path to eyes/teeth/etc mask
     :return: tuple of full composite (RGBA), clothes mask (L), head mask (L), and non-head skin mask (L)
     """
-    image = Image.open(image_path).convert('RGBA')
-    ao = Image.open(ao_path).convert('RGBA')
-    uv = OpenEXR.InputFile(uv_path)
-    body_alpha = read_mask(body_path)
-    shirt_alpha = read_mask(shirt_path)
-    pants_alpha = read_mask(pants_path)
-    hair_alpha = read_mask(hair_path)
-    head_alpha = read_mask(head_path)
-    etc_alpha = read_mask(etc_path)
-
-    skin_mask = ImageChops.add(head_alpha, body_alpha)
-    colored_skin = combine_with_color(image, skin_mask, skin_block(image, emoji_skin()))
-
-    colored_hair = colorize_hair(image, hair_alpha)
-
-    if pants_tex_path is not '':
-        colored_shirt = apply_uv_texture(shirt_tex_path, uv, image, shirt_alpha)
-        colored_pants = apply_uv_texture(pants_tex_path, uv, image, pants_alpha)
-
-    else:
-        colored_shirt = combine_with_color(image, shirt_alpha, color_block(image))
-        colored_pants = combine_with_color(image, pants_alpha, color_block(image))
+    mask_paths = {'body': body_path, 'shirt': shirt_path, 'pants': pants_path, 'hair': hair_path,
+                  'head': head_path, 'etc': etc_path}
+    stack = compositing.read_layer_stack(image_path, ao_path, mask_paths)
+    appearance = random_appearance(pants_tex_path != '')
 
-    colored_image = Image.alpha_composite(colored_skin, colored_hair)
-    colored_etc = etc_layer(image, etc_alpha)
-    colored_image = Image.alpha_composite(colored_image, colored_etc)
-    colored_image = Image.alpha_composite(colored_image, colored_shirt)
-    colored_image = Image.alpha_composite(colored_image, colored_pants)
-
-    composite = blend_overlay(colored_image, ao, 0.85)
-    comp_r, comp_g, comp_b, _ = composite.split()
-
-    whole_head_mask = ImageChops.add(hair_alpha, head_alpha)
-    clothes_mask = ImageChops.add(shirt_alpha, pants_alpha)
-    simulant_mask = ImageChops.add(whole_head_mask, clothes_mask)
-    simulant_mask = ImageChops.add(simulant_mask, body_alpha)
-    simulant_mask = ImageChops.add(simulant_mask, etc_alpha)
-
-    final_comp = Image.merge('RGBA', (comp_r, comp_g, comp_b, simulant_mask))
-
-    return final_comp, clothes_mask, whole_head_mask, body_alpha
+    return clothe_person(stack, appearance, pants_tex_path, shirt_tex_path, uv_path)
 
 
 def image_size(image_path):
@@ -393,52 +303,174 @@ def center_new_ul(person_size, bg_size):
     return (x, y)
 
 
-def new_part(image, new_size, new_rotation, new_xy, background_size, sampling):
-    """Resize, rotate, and position image in a given background size"""
+class SparseOverlay:
+    def __init__(self, image, xy, frame_size, fill=0):
+        """Layer placed in a frame, stored as the part of the transformed image inside the frame plus its offset
+
+        Stands for the full frame image new_part, mask_layer and resized_depth used to build, Image.new(mode,
+        frame_size, fill) with image pasted at xy, without allocating it.
+
+        :param image: transformed PIL image (RGBA, L or F)
+        :param xy: upper left corner of image in the frame, may be outside the frame
+        :param frame_size: (width, height) of the frame
+        :param fill: value of the frame outside image
+        """
+        left, upper = max(xy[0], 0), max(xy[1], 0)
+        right = min(xy[0] + image.size[0], frame_size[0])
+        lower = min(xy[1] + image.size[1], frame_size[1])
+        right, lower = max(right, left), max(lower, upper)
+
+        self.box = (left, upper, right, lower)
+        self.image = image.crop((left - xy[0], upper - xy[1], right - xy[0], lower - xy[1]))
+        self.frame_size = frame_size
+        self.fill = fill
+
+    def window(self):
+        """numpy index of the overlay's box in a (height, width) frame array"""
+        left, upper, right, lower = self.box
+        return slice(upper, lower), slice(left, right)
+
+    def replace(self, image):
+        """Same placement with a new image of the same size, i.e. after colour matching"""
+        assert image.size == self.image.size, 'image is {} not {}'.format(image.size, self.image.size)
+        overlay = copy.copy(self)
+        overlay.image = image
+
+        return overlay
+
+    def to_frame(self):
+        """Full frame PIL image"""
+        frame = Image.new(self.image.mode, self.frame_size, self.fill)
+        frame.paste(self.image, self.box[:2])
+
+        return frame
+
+
+def place_part(image, new_size, new_rotation, new_xy, background_size, sampling):
+    """Resize, rotate, and position image in a given background size, as a SparseOverlay"""
     resized_part = resize_image(image, new_size, sampling)
     rotated_part = rotate_image(resized_part, new_rotation, sampling)
-    full_size = blank_image(background_size)
-    full_size.paste(rotated_part, box=new_xy)
 
-    return full_size
+    return SparseOverlay(rotated_part, new_xy, background_size)
+
+
+def place_mask(mask, new_size, new_rotation, new_xy, background_size, sampling):
+    """Resize, rotate, and position a mask as an 'L' SparseOverlay"""
+    overlay = place_part(mask, new_size, new_rotation, new_xy, background_size, sampling)
+
+    return overlay.replace(overlay.image.convert('L'))
+
+
+def place_depth(depth, new_size, new_rotation, new_xy, background_size, farthest=10000000000.0):
+    """Resize, rotate, and position a depth map, the area around the person at farthest, as a SparseOverlay
+
+    Rotated on the canvas of the resized map, like the person and its masks, so the depth stays aligned with them
+    """
+    rotated_depth = warp.resize_rotate(depth, new_size, new_rotation, Image.NEAREST)
+
+    # Fill in rotation area with background distance
+    depth_array = np.asarray(rotated_depth).copy()
+    depth_array[depth_array == 0] = farthest
+
+    return SparseOverlay(Image.fromarray(depth_array, mode='F'), new_xy, background_size, farthest)
+
+
+def place_layers(person, masks, depth, new_size, new_rotation, new_xy, background_size, sampling,
+                 farthest=10000000000.0):
+    """Resize, rotate, and position a person with its masks and depth in one warp per image, as SparseOverlays
+
+    Resize and rotation are combined into a single affine transform, applied to the person, to the masks packed three
+    to an image (bilinear unless sampling is 'NEAREST') and to the depth with nearest sampling on the same canvas,
+    so every layer stays pixel aligned.
+
+    :param person: RGBA PIL of composited simulant
+    :param masks: list of PIL masks the size of person, converted to L
+    :param depth: 'F' PIL depth map, 0 where there is no person
+    :return: list of SparseOverlays of the person (RGBA), each mask (L) and the depth (F, farthest around the person)
+    """
+    resample = sample_method(sampling)
+    for mask in masks:
+        assert mask.size == person.size, 'mask is {} not {}'.format(mask.size, person.size)
+
+    warped = warp.resize_rotate(person.convert('RGBA'), new_size, new_rotation, resample)
+    warped_masks = warp.resize_rotate_layers([mask.convert('L') for mask in masks], new_size, new_rotation, resample)
+    warped_depth = np.array(warp.resize_rotate(depth, new_size, new_rotation, Image.NEAREST))
+    warped_depth[warped_depth == 0] = farthest
+
+    overlays = [SparseOverlay(warped, new_xy, background_size)]
+    overlays += [SparseOverlay(mask, new_xy, background_size) for mask in warped_masks]
+    overlays.append(SparseOverlay(Image.fromarray(warped_depth, mode='F'), new_xy, background_size, farthest))
+
+    return overlays
+
+
+def new_part(image, new_size, new_rotation, new_xy, background_size, sampling):
+    """Resize, rotate, and position image in a given background size"""
+    return place_part(image, new_size, new_rotation, new_xy, background_size, sampling).to_frame()
 
 
 def mask_layer(mask, new_size, new_rotation, new_xy, background_size, sampling):
     """Create rotated, resized, positioned mask image"""
-    resized_mask = resize_image(mask, new_size, sampling)
-    rotated_mask = rotate_image(resized_mask, new_rotation, sampling)
-    frame = Image.new('L', background_size)
-    frame.paste(rotated_mask, box=new_xy)
-
-    return frame
+    return place_mask(mask, new_size, new_rotation, new_xy, background_size, sampling).to_frame()
 
 
 def depth_array(file_path):
-    exr = OpenEXR.InputFile(file_path)
-    pixel_type = Imath.PixelType(Imath.PixelType.FLOAT)
-    dw = exr.header()['dataWindow']
-    size = (dw.max.x - dw.min.x + 1, dw.max.y - dw.min.y + 1)
-
-    z = exr.channel('R', pixel_type)
-    z = Image.frombytes('F', size, z)
+    """Read EXR depth map as PIL 'F' image"""
+    z = exr_io.read_depth(file_path)
 
-    return z
+    return Image.fromarray(z, mode='F')
 
 
 def resized_depth(depth, new_size, new_rotation, new_xy, background_size, farthest=10000000000.0):
-    resized_depth = resize_image(depth, new_size, 'NEAREST')
-    rotated_depth = resized_depth.rotate(new_rotation, resample=Image.NEAREST, expand=True)
+    return place_depth(depth, new_size, new_rotation, new_xy, background_size, farthest).to_frame()
 
-    # Fill in rotation area with background distance
-    rotated_array = np.asarray(rotated_depth)
-    depth_array = rotated_array.copy()
-    depth_array[depth_array == 0] = farthest
-    transformed_depth = Image.fromarray(depth_array, mode='F')
 
-    frame = Image.new('F', background_size, color=farthest)
-    frame.paste(transformed_depth, box=new_xy)
+def place_overlay(person, clothes_mask, head_mask, body_mask, bg_size, type, sampling, depth, scale_min=0.15,
+                  scale_max=2, rotate_min=-180, rotate_max=180):
+    """Randomly rotate, scale and position a simulant's layers on a background of bg_size, as SparseOverlays
+
+    :param depth: 'F' PIL depth map, see depth_array
+    :return: tuple of SparseOverlays of fully clothed simulant (RGBA), clothes mask (L), head mask (L), body mask (L)
+             and depth (F)
+    """
+    person_size = person.size
+
+    new_size = new_person_size(person_size, bg_size, scale_min, scale_max)
+    new_xy = new_ul_location(new_size, bg_size)
+    new_rotation = random.uniform(rotate_min, rotate_max)
 
-    return frame
+    if type == 'video':
+        new_edge = min(bg_size)
+        new_size = (new_edge, new_edge)
+        new_xy = center_new_ul(new_size, bg_size)
+        new_rotation = 0
+
+    if sampling in ('NEAREST', 'BILINEAR'):
+        return tuple(place_layers(person, [clothes_mask, head_mask, body_mask], depth, new_size, new_rotation, new_xy,
+                                  bg_size, sampling))
+
+    overlay = place_part(person, new_size, new_rotation, new_xy, bg_size, sampling)
+    clothes_overlay_mask = place_mask(clothes_mask, new_size, new_rotation, new_xy, bg_size, sampling)
+    head_overlay_mask = place_mask(head_mask, new_size, new_rotation, new_xy, bg_size, sampling)
+    body_overlay_mask = place_mask(body_mask, new_size, new_rotation, new_xy, bg_size, sampling)
+    new_depth = place_depth(depth, new_size, new_rotation, new_xy, bg_size)
+
+    return overlay, clothes_overlay_mask, head_overlay_mask, body_overlay_mask, new_depth
+
+
+def generate_sparse_overlay(person, clothes_mask, head_mask, body_mask, bg_image_loc, type, sampling, depth_path,
+                            scale_min=0.15, scale_max=2, rotate_min=-180, rotate_max=180):
+    """Generate randomly rotated, scaled overlay of simulant placed on the background image, without full frames
+
+    Takes the same arguments and draws the same random placement as generate_overlay, but returns the layers as
+    SparseOverlays holding only the region of the background the person covers. Nearest and bilinear sampling warp
+    all layers at once with place_layers, other sampling methods resample each layer with PIL.
+
+    :return: tuple of SparseOverlays of fully clothed simulant (RGBA), clothes mask (L), head mask (L), body mask (L)
+             and depth (F)
+    """
+    return place_overlay(person, clothes_mask, head_mask, body_mask, image_size(bg_image_loc), type, sampling,
+                         depth_array(depth_path), scale_min, scale_max, rotate_min, rotate_max)
 
 
 def generate_overlay(person, clothes_mask, head_mask, body_mask, bg_image_loc, type, sampling, depth_path, scale_min=0.15,
@@ -459,28 +491,10 @@ def generate_overlay(person, clothes_mask, head_mask, body_mask, bg_image_loc, t
     :param rotate_max: maximum rotation of overlaid simulant
     :return: tuple of fully clothed simulant (RGBA), clothes mask (L), head mask (L), and non-body skin mask (L)
     """
-    person_size = person.size
-    bg_size = image_size(bg_image_loc)
-
-    depth = depth_array(depth_path)
+    layers = generate_sparse_overlay(person, clothes_mask, head_mask, body_mask, bg_image_loc, type, sampling,
+                                     depth_path, scale_min, scale_max, rotate_min, rotate_max)
 
-    new_size = new_person_size(person_size, bg_size, scale_min, scale_max)
-    new_xy = new_ul_location(new_size, bg_size)
-    new_rotation = random.uniform(rotate_min, rotate_max)
-
-    if type == 'video':
-        new_edge = min(bg_size)
-        new_size = (new_edge, new_edge)
-        new_xy = center_new_ul(new_size, bg_size)
-        new_rotation = 0
-
-    overlay = new_part(person, new_size, new_rotation, new_xy, bg_size, sampling)
-    clothes_overlay_mask = mask_layer(clothes_mask, new_size, new_rotation, new_xy, bg_size, sampling)
-    head_overlay_mask = mask_layer(head_mask, new_size, new_rotation, new_xy, bg_size, sampling)
-    body_overlay_mask = mask_layer(body_mask, new_size, new_rotation, new_xy, bg_size, sampling)
-    new_depth = resized_depth(depth, new_size, new_rotation, new_xy, bg_size)
-
-    return overlay, clothes_overlay_mask, head_overlay_mask, body_overlay_mask, new_depth
+    return tuple(layer.to_frame() for layer in layers)
 
 
 def generate_mask(foreground):
@@ -502,9 +516,9 @@ def random_crop(imgs, crop_factor=0.99, stddev=0.14):
     image_size = np.array(sizes[0])
 
     # calculate cropped image size and a random offset from tl of the image
-    crop_size = (crop_factor * image_size).astype(np.int)
+    crop_size = (crop_factor * image_size).astype(int)
     max_offset = image_size - crop_size
-    random_offset = np.round(np.clip(np.random.normal(0.5, stddev, 2), 0, 1) * max_offset).astype(np.int)
+    random_offset = np.round(np.clip(np.random.normal(0.5, stddev, 2), 0, 1) * max_offset).astype(int)
 
     # convert into PIL's box format
     x1 = random_offset[1]
@@ -532,23 +546,103 @@ def mult_by_noise(image):
     return Image.fromarray(new_image, mode='RGBA')
 
 
-def matching_method(foreground, background, method_setting):
-    if method_setting == 'RGB':
-        foreground = match.match_background_rgb(foreground, background)
-    elif method_setting == 'LAB':
-        foreground = match.match_background_lab(foreground, background)
-    elif method_setting == 'HSV':
-        foreground = match.match_background_hsv(foreground, background)
-    elif method_setting == 'SAT':
-        foreground = match.match_background_sat(foreground, background)
-    elif method_setting == 'SATVAL':
-        foreground = match.match_background_sat_val(foreground, background)
-    else:
-        pass
+def matching_method(foreground, background, method_setting, background_key=None):
+    """Histogram match foreground to background with the given method ('RGB', 'LAB', 'HSV', 'SAT' or 'SATVAL')
+
+    :param background_key: if set (i.e. the background path), cache the background statistics under this key
+    """
+    if method_setting in match.METHOD_SPACES:
+        foreground = match.match_background(foreground, background, method_setting, background_stats, background_key)
 
     return foreground
 
 
+def sparse_matching(overlay, background, method_setting, background_key=None, matcher=None):
+    """matching_method for a SparseOverlay, histogram matching only the region the overlay covers
+
+    Matches the same pixels with the same weights as matching the full frame. The one difference is the range of
+    the foreground histogram, which for the full frame also spans the transparent black around the overlay, and
+    fully transparent pixels outside the region keep their colour.
+
+    :param matcher: optional match.SequenceMatcher to match with instead, for the frames of a sequence
+    """
+    if method_setting not in match.METHOD_SPACES or overlay.image.getbbox() is None:
+        return overlay
+
+    if matcher is not None:
+        return overlay.replace(matcher.match(np.asarray(overlay.image), background))
+
+    return overlay.replace(matching_method(np.asarray(overlay.image), background, method_setting, background_key))
+
+
+def sparse_composite(background, overlay):
+    """Image.alpha_composite(background, overlay.to_frame()) compositing only the overlay's region"""
+    comp = background.copy()
+    if overlay.image.size[0] > 0 and overlay.image.size[1] > 0:
+        comp.alpha_composite(overlay.image, overlay.box[:2])
+
+    return comp
+
+
+def sparse_mask(overlay, occluder=None):
+    """Full frame L mask of an overlay, with what is in front of it cut out
+
+    :param overlay: SparseOverlay of an RGBA layer (its alpha is the mask) or an L mask
+    :param occluder: optional full frame L mask of everything in front, multiplied in inverted like mask_with_others
+    :return: L PIL image
+    """
+    region = overlay.image.split()[-1]
+    if occluder is not None:
+        region = ImageChops.multiply(ImageChops.invert(occluder.crop(overlay.box)), region)
+
+    return SparseOverlay(region, overlay.box[:2], overlay.frame_size).to_frame()
+
+
+def composite_outputs(layers, bg, matching, background_key=None, noise_type='', parts=False, matcher=None):
+    """Composite placed layers over a background and randomly crop every output together
+
+    :param layers: tuple of SparseOverlays from generate_sparse_overlay
+    :param bg: RGBA PIL background
+    :param matching: foreground / background matching method
+    :param background_key: if set (i.e. the background path), cache the background statistics under this key
+    :param noise_type: '', 'foreground' or 'all'
+    :param parts: also output head, cloth and body masks
+    :param matcher: optional match.SequenceMatcher, see sparse_matching
+    :return: list of cropped composite, mask and depth, followed by head, cloth and body masks if parts
+    """
+    foreground, clothes_mask, head_mask, body_mask, depth = layers
+    foreground = sparse_matching(foreground, bg, matching, background_key, matcher)
+
+    if noise_type == 'foreground':
+        foreground = foreground.replace(mult_by_noise(foreground.image))
+
+    comp = sparse_composite(bg, foreground)
+
+    if noise_type == 'all':
+        comp = mult_by_noise(comp)
+
+    # Mask for entire foreground
+    outputs = [comp, sparse_mask(foreground), depth.to_frame()]
+
+    if parts:
+        outputs += [sparse_mask(head_mask), sparse_mask(clothes_mask), sparse_mask(body_mask)]
+
+    return random_crop(outputs)
+
+
+def save_outputs(cropped, comp_id, composite_dir, mask_dir, parts_out):
+    """Save the outputs of composite_outputs, part masks and depth go to heads/, cloth/, body/ and depth/ of parts_out"""
+    if len(cropped) > 3:
+        cropped[3].save(os.path.join(parts_out, 'heads', comp_id + '.png'))
+        cropped[4].save(os.path.join(parts_out, 'cloth', comp_id + '.png'))
+        cropped[5].save(os.path.join(parts_out, 'body', comp_id + '.png'))
+
+    # Save composite image, mask, and annotation
+    cropped[0].save(os.path.join(composite_dir, comp_id + '.png'))
+    cropped[1].save(os.path.join(mask_dir, comp_id + '.png'))
+    exr_io.write_depth(os.path.join(parts_out, 'depth', comp_id + '.exr'), cropped[2])
+
+
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('--person', '-p', type=str, help='foreground person image', required=True)
@@ -582,44 +676,16 @@ if __name__ == '__main__':
     person, clothes, head, body = make_clothed_person(args.person, args.skin_path, args.shirt_path, args.pants_path,
                                                       args.hair_path, args.ao_path, args.head, args.p_tex, args.s_tex,
                                                       args.uv, args.etc_path)
-    foreground, clothes_mask, head_mask, body_mask, depth = generate_overlay(person, clothes, head, body, args.background,
-                                                                      args.type, args.sample_method, args.depth)
+    layers = generate_sparse_overlay(person, clothes, head, body, args.background, args.type, args.sample_method,
+                                     args.depth)
 
-    foreground = matching_method(foreground, bg, args.matching_method)
-
-    if args.noise_type == 'foreground':
-        foreground = mult_by_noise(foreground)
-
-    comp = Image.alpha_composite(bg, foreground)
-
-    if args.noise_type == 'all':
-        comp = mult_by_noise(comp)
-
-    # Mask for entire foreground
-    mask = generate_mask(foreground)
+    cropped = composite_outputs(layers, bg, args.matching_method, args.background, args.noise_type,
+                                args.parts_out != '')
 
     timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
     comp_id = 'simulant_{}'.format(timestamp)
 
-    if args.out_name is not '':
+    if args.out_name != '':
         comp_id = args.out_name
 
-    if args.parts_out is not '':
-        head_mask = generate_mask(head_mask)
-        cloth_mask = generate_mask(clothes_mask)
-        body_mask = generate_mask(body_mask)
-        cropped = random_crop([comp, mask, depth, head_mask, cloth_mask, body_mask])
-        cropped[3].save(os.path.join(args.parts_out, 'heads', comp_id + '.png'))
-        cropped[4].save(os.path.join(args.parts_out, 'cloth', comp_id + '.png'))
-        cropped[5].save(os.path.join(args.parts_out, 'body', comp_id + '.png'))
-    else:
-        cropped = random_crop([comp, mask, depth])
-
-    # Save composite image, mask, and annotation
-    cropped[0].save(os.path.join(args.composite, comp_id + '.png'))
-    cropped[1].save(os.path.join(args.mask, comp_id + '.png'))
-    depth_cropped = cropped[2]
-    exr = OpenEXR.OutputFile(os.path.join(args.parts_out, 'depth', comp_id + '.exr'),
-                             OpenEXR.Header(depth_cropped.size[0], depth_cropped.size[1]))
-    depth_cropped = np.asarray(depth_cropped)
-    exr.writePixels({'R': depth_cropped, 'G': depth_cropped, 'B': depth_cropped})
+    save_outputs(cropped, comp_id, args.composite, args.mask, args.parts_out)
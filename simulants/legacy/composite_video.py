@@ -3,10 +3,23 @@ from __future__ import print_function
 from __future__ import absolute_import
 
 import os
+import sys
 import uuid
-import subprocess
-
+import random
+import threading
+import image_pan
+import combine_layers
+import simulants.tools.compositing as compositing
+import simulants.tools.matching as match
+
+from PIL import Image
 from argparse import ArgumentParser
+from multiprocessing.pool import ThreadPool
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 
 def get_file_list(path, extension):
@@ -26,14 +39,137 @@ def out_dir(out_path, name):
     return new_dir
 
 
-def make_background_video(image_path, video_dir, number_frames):
-    cmd = ['python', 'image_pan.py',
-           '--input', image_path,
-           '--output', video_dir,
-           '--number_frames', str(number_frames)]
-    print(cmd)
-
-    subprocess.check_call(cmd)
+def frame_paths(input, front, background):
+    """Paths of every layer of one rendered frame and its background frame
+
+    background is only used as a key for cached background statistics when background frames are made in memory,
+    see composite_sequence
+    """
+    name = os.path.splitext(front)[0]
+    layers = {'person': 'image_combined', 'body': 'body_material_index', 'shirt': 'shirt_material_index',
+              'pants': 'pants_material_index', 'hair': 'hair_material_index', 'etc': 'etc_material_index',
+              'ao': 'ambient_occlusion', 'head': 'head_material_index'}
+
+    paths = dict((layer, os.path.join(input, directory, front)) for layer, directory in layers.items())
+    paths['uv'] = os.path.join(input, 'uv', name + '.exr')
+    paths['depth'] = os.path.join(input, 'depth', name + '.exr')
+    paths['background'] = background
+    paths['name'] = name
+
+    return paths
+
+
+def load_frame(paths, background=None):
+    """Read the layer stack, depth and background of a frame, background is read from disk if not given
+
+    The background is kept as given in 'background_frame' and converted to RGBA in 'background'
+    """
+    mask_paths = dict((name, paths[name]) for name in compositing.MASK_NAMES)
+    if background is None:
+        background = Image.open(paths['background'])
+
+    return {'stack': compositing.read_layer_stack(paths['person'], paths['ao'], mask_paths),
+            'depth': combine_layers.depth_array(paths['depth']),
+            'background': background.convert('RGBA'),
+            'background_frame': background}
+
+
+def prefetch(items, load, ahead=4):
+    """Yield (item, load(item)) for every item, loading up to ahead items in advance in a background thread"""
+    loaded = queue.Queue(ahead)
+    done = object()
+
+    def reader():
+        try:
+            for item in items:
+                loaded.put((item, load(item)))
+        except Exception:
+            loaded.put(sys.exc_info())
+        loaded.put(done)
+
+    thread = threading.Thread(target=reader)
+    thread.daemon = True
+    thread.start()
+
+    while True:
+        entry = loaded.get()
+        if entry is done:
+            break
+        if len(entry) == 3:
+            raise entry[1]
+        yield entry
+
+    thread.join()
+
+
+def composite_sequence(frames, output, pants_tex, shirt_tex, seed, matching='SAT', sampling='BILINEAR', writers=4,
+                       ahead=4, coherent=False, refresh=1, backgrounds=None, background_dir=None):
+    """Composite every frame of a video sequence in this process, with one appearance for the whole sequence
+
+    The skin, hair and clothing draw is made once from seed, frames are read ahead in a background thread and outputs
+    are saved by a pool of writer threads.
+
+    In coherent mode what does not change from frame to frame is computed once per sequence: the hair colour lookup
+    table and the background histogram CDFs, taken from the first background frame since the pan frames are crops of
+    one image. The histogram matching curves can also be reused for refresh frames. Decoded textures are always kept
+    by combine_layers' texture mapper.
+
+    Background frames can be made on demand, i.e. by an image_pan.BackgroundPan, in the read ahead thread instead of
+    being written out and read back.
+
+    :param frames: list of frame_paths dicts in frame order
+    :param output: output directory with composite, masks, heads, cloth, body and depth directories
+    :param pants_tex: path to pants texture
+    :param shirt_tex: path to shirt texture
+    :param seed: seed of the sequence's appearance
+    :param matching: foreground / background matching method
+    :param sampling: sampling method to use for scaling
+    :param writers: number of writer threads
+    :param ahead: number of frames to read ahead
+    :param coherent: reuse per sequence state across frames
+    :param refresh: in coherent mode, frames between recomputing the histogram matching curves
+    :param backgrounds: background frames indexed by frame number, None to read the frame_paths backgrounds
+    :param background_dir: also save the background frames to this directory
+    """
+    random.seed(seed)
+    appearance = combine_layers.random_appearance(pants_tex != '')
+    matcher = None
+    if coherent:
+        appearance = combine_layers.sequence_appearance(appearance)
+        if matching in match.METHOD_SPACES:
+            matcher = match.SequenceMatcher(matching, refresh)
+
+    composite_dir = os.path.join(output, 'composite')
+    mask_dir = os.path.join(output, 'masks')
+
+    pool = ThreadPool(writers)
+    pending = []
+
+    def load(item):
+        index, paths = item
+        return load_frame(paths, backgrounds[index] if backgrounds is not None else None)
+
+    for (_, paths), frame in prefetch(list(enumerate(frames)), load, ahead):
+        person, clothes, head, body = combine_layers.clothe_person(frame['stack'], appearance, pants_tex, shirt_tex,
+                                                                   paths['uv'])
+        layers = combine_layers.place_overlay(person, clothes, head, body, frame['background'].size, 'video',
+                                              sampling, frame['depth'])
+        cropped = combine_layers.composite_outputs(layers, frame['background'], matching, paths['background'],
+                                                   parts=True, matcher=matcher)
+
+        pending.append(pool.apply_async(combine_layers.save_outputs,
+                                        (cropped, paths['name'], composite_dir, mask_dir, output)))
+        if background_dir is not None and backgrounds is not None:
+            pending.append(pool.apply_async(frame['background_frame'].save,
+                                            (os.path.join(background_dir, paths['name'] + '.png'),)))
+        # keep the number of frames waiting to be written bounded, raising any write error
+        while len(pending) > 2 * writers:
+            pending.pop(0).get()
+
+    pool.close()
+    for result in pending:
+        result.get()
+    pool.join()
 
 
 if __name__ == '__main__':
@@ -43,6 +179,15 @@ if __name__ == '__main__':
     parser.add_argument('--shirt_tex', '-s', type=str, help='path to shirt texture', required=True)
     parser.add_argument('--pants_tex', '-p', type=str, help='path to pants texture', required=True)
     parser.add_argument('--output', '-o', type=str, help='output directory', required=True)
+    parser.add_argument('--seed', type=str, help='seed of the sequence appearance, random if not set', default=None)
+    parser.add_argument('--writers', type=int, help='number of threads saving frames', default=4)
+    parser.add_argument('--coherent', action='store_true', help='compute per sequence state (hair colours, background '
+                                                                'histograms) once instead of for every frame')
+    parser.add_argument('--refresh', type=int, help='with --coherent, frames between recomputing the histogram '
+                                                    'matching curves', default=1)
+    parser.add_argument('--resized_background', action='store_true', help='resize the background once and crop the '
+                                                                          'pan frames from it')
+    parser.add_argument('--save_background', action='store_true', help='also save the background pan frames')
     args = parser.parse_args()
 
     input = args.input
@@ -52,56 +197,14 @@ if __name__ == '__main__':
     frame_list = sorted(frame_list)
     num_frames = len(frame_list)
 
-    background_video_dir = out_dir(args.output, 'background')
-    composite_dir = out_dir(args.output, 'composite')
-    mask_dir = out_dir(args.output, 'masks')
-    head_dir = out_dir(args.output, 'heads')
-    out_dir(args.output, 'cloth')
-    out_dir(args.output, 'body')
-
-    make_background_video(args.background, background_video_dir, num_frames)
-    background_frames = sorted(get_file_list(background_video_dir, 'png'))
-
-    assert len(background_frames) == num_frames, 'number of background and foreground frames do not match'
-
-    seed = str(uuid.uuid4())
-
-    for front, back in zip(frame_list, background_frames):
-        person = os.path.join(input, 'image_combined', front)
-        skin = os.path.join(input, 'body_material_index', front)
-        shirt = os.path.join(input, 'shirt_material_index', front)
-        pants = os.path.join(input, 'pants_material_index', front)
-        hair = os.path.join(input, 'hair_material_index', front)
-        etc = os.path.join(input, 'etc_material_index', front)
-        ao = os.path.join(input, 'ambient_occlusion', front)
-        head = os.path.join(input, 'head_material_index', front)
-        uv = os.path.join(input, 'uv', os.path.splitext(front)[0] + '.exr')
-        depth = os.path.join(input, 'depth', os.path.splitext(front)[0] + '.exr')
-        background = os.path.join(background_video_dir, back)
-        name = front[:-4]
-
-        cmd = ['python', 'combine_layers.py',
-               '--person', person,
-               '--skin_path', skin,
-               '--shirt_path', shirt,
-               '--pants_path', pants,
-               '--hair_path', hair,
-               '--etc_path', etc,
-               '--ao_path', ao,
-               '--background', background,
-               '--composite', composite_dir,
-               '--mask', mask_dir,
-               '--type', 'video',
-               '--out_name', name,
-               '--seed', seed,
-               '--head', head,
-               '--uv', uv,
-               '--parts_out', args.output,
-               '--p_tex', args.pants_tex,
-               '--s_tex', args.shirt_tex,
-               '--matching_method', 'SAT',
-               '--depth', depth]
-
-        # print(cmd)
-
-        subprocess.check_call(cmd)
+    background_dir = out_dir(args.output, 'background') if args.save_background else None
+    for name in ['composite', 'masks', 'heads', 'cloth', 'body', 'depth']:
+        out_dir(args.output, name)
+
+    pan = image_pan.BackgroundPan(args.background, num_frames, resized_source=args.resized_background)
+
+    seed = args.seed if args.seed is not None else str(uuid.uuid4())
+
+    frames = [frame_paths(input, front, '{}:{}'.format(args.background, i)) for i, front in enumerate(frame_list)]
+    composite_sequence(frames, args.output, args.pants_tex, args.shirt_tex, seed, writers=args.writers,
+                       coherent=args.coherent, refresh=args.refresh, backgrounds=pan, background_dir=background_dir)
@@ -4,9 +4,10 @@ from __future__ import absolute_import
 
 import os
 import json
-import numpy as np
+import functools
+import multiprocessing
+import simulants.tools.annotations as annotations
 
-from scipy import misc
 from argparse import ArgumentParser
 
 
@@ -19,68 +20,9 @@ def list_files(path, extension):
     return file_list
 
 
-def histograms(mask):
-    """
-    computes histogram of binaries images along y axis
-    (vertical downward) and x axis (horizontal forward)
-
-    returns a tuple of np.arrays (histo_y, histo_x)
-
-    """
-
-    histogram_y = np.dot(mask, np.ones((mask.shape[1], 1)))
-    histogram_x = np.dot(mask.T, np.ones((mask.shape[0], 1)))
-
-    return (histogram_y, histogram_x)
-
-
-def min_max(one_dimensional_array):
-    """
-    computes the coordinate of the first and last non null
-    element in a list or one dimmentional array
-
-    returns a tuple (x_min, x_max)
-
-    """
-
-    x_min = 0
-    x_max = len(one_dimensional_array) - 1
-
-    done_min = False
-    done_max = False
-
-    count = 0
-    
-    while(True):
-        
-        if one_dimensional_array[x_min] == 0 and done_min == False and x_min < len(one_dimensional_array) - 1:
-            x_min += 1
-        else:
-            done_min = True
-        if one_dimensional_array[x_max] == 0 and done_max == False and x_max > 0:
-            x_max -= 1
-        else:
-            done_max = True
-        if done_min == True and done_max == True:
-            return (x_min, x_max)
-
-        count += 1
-
-        if count > 10000:
-            print("over 10000 null elements in list")
-            return (x_min, x_max)
-
-        if x_min > x_max:
-            print("only null elements here")
-            return (0, 0)
-
-
 def get_mask(path):
     """read in mask image and make sure it is binary"""
-    mask = misc.imread(path)
-    assert len(mask.shape) == 2, 'mask {} is not binary'.format(path)
-
-    return mask
+    return annotations.read_mask(path)
 
 
 def normalize_bbox(bbox, mask_shape):
@@ -106,10 +48,8 @@ def normalize_bbox(bbox, mask_shape):
 
 def generate_annotation(path):
     mask = get_mask(path)
-    histogram_y, histogram_x = histograms(mask)
-    xmin, xmax = min_max(histogram_x)
-    ymin, ymax = min_max(histogram_y)
-    bbox = (xmin, xmax, ymin, ymax)
+    # empty masks get a zero box, as the old histogram scan gave them
+    bbox = annotations.bbox(mask) or (0, 0, 0, 0)
     normalized_bbox = normalize_bbox(bbox, mask.shape)
 
     image_h, image_w = mask.shape
@@ -122,19 +62,46 @@ def generate_annotation(path):
     return annotation
 
 
+def write_annotation(mask, mask_path, out_path):
+    file_id = os.path.splitext(mask)[0]
+    annotation = generate_annotation(os.path.join(mask_path, mask))
+
+    with open(os.path.join(out_path, file_id + '.json'), 'w') as file:
+        json.dump(annotation, file, indent=2)
+
+    return file_id
+
+
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('--mask_path', '-m', type=str, help='directory of mask images to process')
     parser.add_argument('--out_path', '-o', type=str, help='directroy for output json files to go')
+    parser.add_argument('--coco', type=str, help='if set, write one COCO instances json with boxes, areas and RLE '
+                                                 'segmentations to this path instead of a json per mask', default=None)
+    parser.add_argument('--instance_ids', action='store_true', help='with --coco, treat distinct mask values as separate instances')
+    parser.add_argument('--workers', type=int, help='number of worker processes', default=1)
     args, _ = parser.parse_known_args()
 
-    file_list = list_files(args.mask_path, 'png')
-    for mask in file_list:
-        file_id = os.path.splitext(mask)[0]
-        print('processing {}'.format(file_id))
-
-        annotation = generate_annotation(os.path.join(args.mask_path, mask))
+    if args.coco is not None:
+        dataset = annotations.annotate_directory(args.mask_path, workers=args.workers,
+                                                 instance_ids=args.instance_ids)
+        print('{} instances in {} masks'.format(len(dataset['annotations']), len(dataset['images'])))
+        with open(args.coco, 'w') as file:
+            json.dump(dataset, file)
+    else:
+        file_list = list_files(args.mask_path, 'png')
+        work = functools.partial(write_annotation, mask_path=args.mask_path, out_path=args.out_path)
+
+        if args.workers > 1:
+            pool = multiprocessing.Pool(args.workers)
+            results = pool.imap_unordered(work, file_list, chunksize=64)
+        else:
+            pool = None
+            results = (work(mask) for mask in file_list)
 
-        with open(os.path.join(args.out_path, file_id + '.json'), 'w') as file:
-            json.dump(annotation, file, indent=2)
+        for file_id in results:
+            print('processed {}'.format(file_id))
 
+        if pool is not None:
+            pool.close()
+            pool.join()
@@ -5,16 +5,20 @@ from __future__ import absolute_import
 import os
 import sys
 import uuid
-import random
+import numpy as np
+import simulants.tools.compositing as compositing
 
 from PIL import Image
-from PIL import ImageChops
 from argparse import ArgumentParser
 
 from combine_layers import make_clothed_person
 from combine_layers import generate_overlay
 from combine_layers import matching_method
-from combine_layers import generate_mask
+
+from dataset_toolbox.src.tools.common import AssetCatalog
+
+# Directory listings of textures, backgrounds, and simulants, scanned once per run
+assets = AssetCatalog()
 
 
 def mkdirp(path):
@@ -23,30 +27,14 @@ def mkdirp(path):
         os.makedirs(path)
 
 
-def list_files(path_to_annotations, file_extension):
-    """Get list of files in a given directory"""
-    file_list = []
-    for file in os.listdir(path_to_annotations):
-        if file.endswith('.' + file_extension):
-            file_path = os.path.join(path_to_annotations, file)
-            file_list.append(file_path)
-    return file_list
-
-
 def patterns_path(pattern_dir):
     """Return a random texture path"""
-    patterns = list_files(pattern_dir, 'png')
-    patterns = sorted(patterns)
-
-    return random.choice(patterns)
+    return assets.choice(pattern_dir, 'png')
 
 
 def background_path(background_dir):
     """Return random background image"""
-    backgrounds = list_files(background_dir, 'jpg')
-    backgrounds = sorted(backgrounds)
-
-    return random.choice(backgrounds)
+    return assets.choice(background_dir, 'jpg')
 
 
 def progress_bar(progress, bar_length=30):
@@ -75,9 +63,7 @@ def progress_bar(progress, bar_length=30):
 
 def simulant_id(simulant_dir):
     """Return random simulant id"""
-    simulant_paths = list_files(os.path.join(simulant_dir, 'image_combined'), 'png')
-    simulant_paths = sorted(simulant_paths)
-    simulant_path = random.choice(simulant_paths)
+    simulant_path = assets.choice(os.path.join(simulant_dir, 'image_combined'), 'png')
 
     return os.path.splitext(os.path.split(simulant_path)[1])[0]
 
@@ -144,47 +130,59 @@ def ensure_dirs(path, name_list):
     return paths
 
 
-def mask_with_others(priors, mask, file_path):
-    """Save image mask for current objects with what is on top removed
+def overlay_box(overlay):
+    """Bounding box of everything an overlay covers (foreground alpha, clothes and head), None if it is empty"""
+    boxes = [overlay[name].split()[-1].getbbox() for name in ['foreground', 'clothes', 'head']]
+    boxes = [box for box in boxes if box is not None]
+    if len(boxes) == 0:
+        return None
+
+    return (min(box[0] for box in boxes), min(box[1] for box in boxes),
+            max(box[2] for box in boxes), max(box[3] for box in boxes))
 
-    :param priors: Mask of all objects in front
-    :param mask: Mask of current object
-    :param file_path: Path (with name) to save mask
-    """
-    front_mask = ImageChops.invert(priors)
-    new_mask = ImageChops.multiply(front_mask, mask)
-    new_mask.save(file_path)
+
+def save_mask(size, box, mask, file_path):
+    """Save a mask cropped to box as a full frame image"""
+    image = Image.new('L', size, 0)
+    if box is not None:
+        image.paste(Image.fromarray(mask), box[:2])
+    image.save(file_path)
 
 
 def write_images(comp_source, out_path, composite_id, matching_type):
-    """Write composite images"""
+    """Write composite images
+
+    Overlays are composited front to back, the first one nearest the camera, each only within its bounding box. The
+    masks of every simulant have the simulants in front of it removed and instances/ holds a 16 bit map of the
+    nearest simulant at each pixel (its index + 1, 0 for background).
+    """
 
-    paths = ensure_dirs(out_path, ['image', 'masks', 'heads', 'clothes'])
+    paths = ensure_dirs(out_path, ['image', 'masks', 'heads', 'clothes', 'instances'])
 
     background_path = comp_source['background']
     overlays = comp_source['overlays']
 
     bg = Image.open(background_path).convert('RGBA')
-    plate = Image.new('RGBA', bg.size)
+    compositor = compositing.InstanceCompositor(bg.size)
 
     for count, overlay in enumerate(overlays):
         mask_id = '{}_{}.png'.format(composite_id, str(count).zfill(2))
-        foreground = overlay['foreground']
-        clothes = generate_mask(overlay['clothes'])
-        head = generate_mask(overlay['head'])
-        body_mask = generate_mask(foreground)
-
-        # Start with blank plate, updated on each run
-        plate_mask = generate_mask(plate)
-
-        mask_with_others(plate_mask, body_mask, os.path.join(paths['masks'], mask_id))
-        mask_with_others(plate_mask, clothes, os.path.join(paths['clothes'], mask_id))
-        mask_with_others(plate_mask, head, os.path.join(paths['heads'], mask_id))
-
-        # Update plate with this mask to be used next loop
-        plate = Image.alpha_composite(foreground, plate)
-
-    plate = matching_method(plate, bg, matching_type)
+        box = overlay_box(overlay)
+        if box is None:
+            masks = [None, None, None]
+        else:
+            foreground = np.asarray(overlay['foreground'].convert('RGBA').crop(box))
+            clothes = np.asarray(overlay['clothes'].split()[-1].crop(box))
+            head = np.asarray(overlay['head'].split()[-1].crop(box))
+            masks = compositor.add(box, foreground, [foreground[:, :, 3], clothes, head])
+
+        for name, mask in zip(['masks', 'clothes', 'heads'], masks):
+            save_mask(bg.size, box, mask, os.path.join(paths[name], mask_id))
+
+    Image.fromarray((compositor.ids + 1).astype(np.uint16)).save(
+        os.path.join(paths['instances'], '{}.png'.format(composite_id)))
+
+    plate = matching_method(Image.fromarray(compositor.composite()), bg, matching_type)
 
     comp = Image.alpha_composite(bg, plate)
     comp.save(os.path.join(paths['image'], '{}.png'.format(composite_id)))
@@ -3,7 +3,6 @@ from __future__ import print_function
 from __future__ import absolute_import
 
 import os
-import math
 import random
 import numpy as np
 
@@ -11,52 +10,87 @@ from PIL import Image
 from argparse import ArgumentParser
 
 
-if __name__ == '__main__':
-    parser = ArgumentParser()
-    parser.add_argument('--input', '-i', type=str, help='input image', required=True)
-    parser.add_argument('--output', '-o', type=str, help='output directory', required=True)
-    parser.add_argument('--number_frames', '-n', type=str, help='number of frames to generate', required=True)
-    args = parser.parse_args()
+class BackgroundPan:
+    def __init__(self, background, number_frames, frame_size=1024, resized_source=False):
+        """Frames of a camera pan across a background image, made on demand
 
-    number_frames = int(args.number_frames)
+        Each frame is a square crop of 90% of the image's short side, moved a step along a random direction (horizontal,
+        vertical or diagonal) per frame and resized to frame_size with bicubic sampling. The pan runs forward or
+        backward at random.
 
-    image_name = os.path.splitext(os.path.split(args.input)[1])[0]
+        :param background: PIL image or path to the background image
+        :param number_frames: number of frames in the pan
+        :param frame_size: width and height of the frames
+        :param resized_source: resize the whole background once and crop frames out of it, instead of resizing every
+                               crop; much cheaper per frame, with crop offsets rounded to whole resized pixels
+        """
+        if not isinstance(background, Image.Image):
+            background = Image.open(background)
+        width, height = background.size
+
+        self.number_frames = number_frames
+        self.frame_size = frame_size
+        self.crop_side = int(min(width, height) * 0.9)
+
+        direction = random.choice(['horiz', 'vert', 'diag'])
+        width_delta = width - self.crop_side
+        height_delta = height - self.crop_side
+        distance = {'horiz': [0, width_delta], 'vert': [height_delta, 0], 'diag': [height_delta, width_delta]}
+        self.step_size = np.array(distance[direction]) / number_frames
+        self.motion = random.choice(['forward', 'backward'])
+
+        self.scale = 1
+        self.background = background
+        if resized_source:
+            self.scale = frame_size / self.crop_side
+            new_size = (int(round(width * self.scale)), int(round(height * self.scale)))
+            self.background = background.resize(new_size, Image.BICUBIC)
+
+    def __len__(self):
+        return self.number_frames
 
-    background = Image.open(args.input)
-    width, height = background.size
+    def __getitem__(self, index):
+        return self.frame(index)
 
-    short_side = min(width, height)
-    long_side = max(width, height)
+    def __iter__(self):
+        for index in range(self.number_frames):
+            yield self.frame(index)
 
-    width_new = int(short_side * 0.9)
-    height_new = width_new
-    size_new = np.array([height_new, width_new])
+    def step(self, index):
+        """Pan step shown in frame index"""
+        if self.motion == 'backward':
+            return self.number_frames - index - 1
 
-    width_delta = width - width_new
-    height_delta = height - height_new
+        return index
 
-    direction = random.choice(['horiz', 'vert', 'diag'])
+    def frame(self, index):
+        """PIL image of frame index, in the mode of the background"""
+        assert 0 <= index < self.number_frames, 'frame {} of {}'.format(index, self.number_frames)
+        tl = np.round(self.step_size * self.step(index)).astype(int)
 
-    if direction is 'horiz':
-        distance = [0, width_delta]
-    elif direction is 'vert':
-        distance = [height_delta, 0]
-    elif direction is 'diag':
-        distance = [height_delta, width_delta]
-    else:
-        print('something has gone wrong and a random direction was not chosen')
+        if self.scale == 1:
+            br = tl + self.crop_side
+            image_cropped = self.background.crop(box=(tl[1], tl[0], br[1], br[0]))
+            return image_cropped.resize((self.frame_size, self.frame_size), Image.BICUBIC)
 
-    step_size = np.array(distance) / number_frames
+        width, height = self.background.size
+        top = min(int(round(tl[0] * self.scale)), height - self.frame_size)
+        left = min(int(round(tl[1] * self.scale)), width - self.frame_size)
 
-    motion = random.choice(['forward', 'backward'])
+        return self.background.crop(box=(left, top, left + self.frame_size, top + self.frame_size))
 
-    # print('moving {} in {} direction at step size of {}'.format(motion, direction, step_size))
 
-    for frame in range(number_frames):
-        tl = np.round(step_size * frame).astype(np.int)
-        br = tl + size_new
-        image_cropped = background.crop(box=(tl[1], tl[0], br[1], br[0]))
-        image_resized = image_cropped.resize((1024, 1024), Image.BICUBIC)
-        if motion is 'backward':
-            frame = number_frames - frame - 1
-        image_resized.save(os.path.join(args.output, '{}_{}.png'.format(image_name, str(frame).zfill(4))))
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--input', '-i', type=str, help='input image', required=True)
+    parser.add_argument('--output', '-o', type=str, help='output directory', required=True)
+    parser.add_argument('--number_frames', '-n', type=str, help='number of frames to generate', required=True)
+    args = parser.parse_args()
+
+    number_frames = int(args.number_frames)
+
+    image_name = os.path.splitext(os.path.split(args.input)[1])[0]
+
+    pan = BackgroundPan(args.input, number_frames)
+    for frame, image in enumerate(pan):
+        image.save(os.path.join(args.output, '{}_{}.png'.format(image_name, str(frame).zfill(4))))
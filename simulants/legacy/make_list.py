@@ -12,6 +12,19 @@ def get_list(path):
     return list
 
 
+def bvh_frames(path):
+    """Number of frames of a bvh mocap clip from its MOTION header, None if it can not be read"""
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        for line in f:
+            if line.startswith('Frames:'):
+                return int(line.split()[1])
+
+    return None
+
+
 def split(a, n):
     k, m = divmod(len(a), n)
     return (a[i * k + min(i, m):(i + 1) * k + min(i + 1, m)] for i in range(n))
@@ -39,20 +52,30 @@ for mocap in mocaps:
     # Additional Settings
     output = os.path.join('/usr/local/share/datasets/simulants/sequences_hair', render_id)
     percent_size = str(50)
-    stride = str(5)
-
-    work_item = {'render_id': render_id,
-                 'token': os.path.join(dataset, 'simulants', 'sequence_check', render_id),
-                 'command': ['blender', '-b', '--python-exit-code', '1', '-P', 'render_layers.py', '--',
-                 '--blend_in', blend_file,
-                 '--background', background,
-                 '--render_id', render_id,
-                 '--img_out', output,
-                 '--percent_size', percent_size,
-                 '--animation', mocap_file,
-                 '--stride', stride]}
-
-    work_items.append(work_item)
+    stride = 5
+    # long clips are split into parts of about this many rendered frames, rendered as separate jobs
+    shard_frames = 200
+
+    frames = bvh_frames(mocap_file)
+    shards = 1 if frames is None else max(1, int(round(float(frames) / (stride * shard_frames))))
+
+    for shard in range(shards):
+        work_item = {'render_id': render_id,
+                     'shard': shard,
+                     'shards': shards,
+                     'token': os.path.join(dataset, 'simulants', 'sequence_check', render_id),
+                     'command': ['blender', '-b', '--python-exit-code', '1', '-P', 'render_layers.py', '--',
+                     '--blend_in', blend_file,
+                     '--background', background,
+                     '--render_id', render_id,
+                     '--img_out', output,
+                     '--percent_size', percent_size,
+                     '--animation', mocap_file,
+                     '--stride', str(stride),
+                     '--shard', str(shard),
+                     '--shards', str(shards)]}
+
+        work_items.append(work_item)
 
 with open('./lists/work_list.json', 'w') as outfile:
     json.dump(work_items, outfile, indent=2)
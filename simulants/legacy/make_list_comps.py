@@ -20,6 +20,10 @@ with open('./lists/work_list.json', 'r') as f:
 composite_list = []
 
 for render in render_list:
+    if render.get('shard', 0) > 0:
+        # one composite per render, after all of its shards
+        continue
+
     token = render['token']
     comp_id = os.path.split(token)[1]
 
@@ -28,6 +32,7 @@ for render in render_list:
     output = os.path.join('/usr', 'local', 'share', 'datasets', 'simulants', 'sequences_hair_renders', comp_id)
 
     composite_item = {'composite_id': comp_id,
+                      'shards': render.get('shards', 1),
                       'token': token,
                       'command': ['python', 'composite_video.py',
                                   '--input', layers_path,
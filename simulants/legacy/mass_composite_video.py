@@ -1,67 +1,52 @@
 import os
 import json
-import subprocess
-import sys
-import time
 
-from joblib import Parallel, delayed
+from simulants.tools import scheduler
+from mass_render_video import jobs_db, render_job_ids
 
+error_log = 'comp.err.log'
 
-def write_token(token_path, content):
-    with open(token_path, 'w') as token_file:
-        token_file.write(content)
 
-
-def write_error(work_item, exception):
+def write_error(job_id, command, exception):
     print('write_error')
-    with open('comp.err.log', 'a') as err:
-        err.write(str(work_item))
+    with open(error_log, 'a') as err:
+        err.write(str(command))
         err.write(' --> ')
         err.write(str(exception))
         err.write('\n')
 
 
-def work(work_item):
-    token_path = work_item['token'] + '.comp'
-
-    if os.path.exists(token_path):
-        return
+def composite_job(work_item, kind, token_suffix):
+    """Composite job depending on every render shard of the same id, unless a token file run already rendered it"""
+    render_token = work_item['token']
+    depends_on = ()
+    if not os.path.exists(render_token):
+        depends_on = tuple(render_job_ids(work_item['composite_id'], work_item.get('shards', 1)))
+    done = os.path.exists(render_token + token_suffix)
 
-    command = work_item['command']
-
-    try:
-        subprocess.check_call(command)
-        write_token(token_path, 'ok')
-    except Exception as e:
-        write_error(work_item, e)
+    return '{}/{}'.format(kind, work_item['composite_id']), work_item['command'], kind, depends_on, 3, done
 
 
-def render_token_written(work_item):
-    return os.path.exists(work_item['token'])
+def add_jobs(queue, work_items, kind='composite', token_suffix='.comp'):
+    jobs = [composite_job(i, kind, token_suffix) for i in work_items
+            if not queue.has('{}/{}'.format(kind, i['composite_id']))]
+    queue.add_many(jobs)
 
-
-def composite_token_written(work_item):
-    return os.path.exists(work_item['token'] + '.comp')
+    return len(jobs)
 
 
 if __name__ == '__main__':
     with open('./lists/work_list_comp.json', 'r') as f:
         work_items = json.load(f)
 
+    queue = scheduler.JobQueue(jobs_db)
+    print('added {} composite jobs'.format(add_jobs(queue, work_items)))
+    queue.close()
     try:
-        os.remove('comp.err.log')
+        os.remove(error_log)
     except:
         pass
 
-    def is_done():
-        composited_items = [i for i in work_items if composite_token_written(i)]
-        num_done = len(composited_items)
-        num_total = len(work_items)
-        print('composited %d / %d' % (num_done, num_total))
-        return num_done == num_total
-
-    while not is_done():
-        rendered_items = (i for i in work_items if render_token_written(i) and not composite_token_written(i))
-        Parallel(n_jobs=10)(delayed(work)(i) for i in rendered_items)
-
-        time.sleep(60)
+    # composites start as soon as their render is done, run alongside mass_render_video
+    scheduler.run(jobs_db, kinds=['composite'], workers=10, on_error=write_error)
+    scheduler.print_summary(jobs_db)
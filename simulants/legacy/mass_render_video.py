@@ -1,57 +1,52 @@
 import os
 import json
-import subprocess
-import sys
 
-from joblib import Parallel, delayed
+from simulants.tools import scheduler
 
+jobs_db = './lists/jobs.db'
 
-def ensure_token_dir(work_item):
-    token_path = work_item['token']
-    token_dir = os.path.dirname(token_path)
 
-    if not os.path.exists(token_dir):
-        os.makedirs(token_dir)
-
-
-def write_token(token_path, content):
-    with open(token_path, 'w') as token_file:
-        token_file.write(content)
-
-
-def write_error(work_item, exception):
+def write_error(job_id, command, exception):
     print('write_error')
     with open('err.log', 'a') as err:
-        err.write(str(work_item))
+        err.write(str(command))
         err.write(' --> ')
         err.write(str(exception))
         err.write('\n')
 
 
-def work(work_item):
-    token_path = work_item['token']
+def render_job_ids(render_id, shards=1):
+    """Ids of the render jobs of every shard of a render"""
+    if shards == 1:
+        return ['render/' + render_id]
 
-    if os.path.exists(token_path):
-        return
+    return ['render/{}/{}'.format(render_id, shard) for shard in range(shards)]
 
-    command = work_item['command']
 
-    try:
-        subprocess.check_call(command)
-        write_token(token_path, 'ok')
-    except Exception as e:
-        write_error(work_item, e)
+def render_job_id(work_item):
+    return render_job_ids(work_item['render_id'], work_item.get('shards', 1))[work_item.get('shard', 0)]
+
+
+def add_jobs(queue, work_list):
+    """Add render jobs that are not in the queue yet, marking those with a token from a token file run as done"""
+    jobs = [(render_job_id(i), i['command'], 'render', (), 3, os.path.exists(i['token']))
+            for i in work_list if not queue.has(render_job_id(i))]
+    queue.add_many(jobs)
+
+    return len(jobs)
 
 
 if __name__ == '__main__':
     with open('./lists/work_list.json', 'r') as f:
         work_list = json.load(f)
 
-    # prepare file system
-    ensure_token_dir(work_list[0])
+    # prepare job queue
+    queue = scheduler.JobQueue(jobs_db)
+    print('added {} render jobs'.format(add_jobs(queue, work_list)))
+    queue.close()
     try:
         os.remove('err.log')
     except:
         pass
 
-    Parallel(n_jobs=10)(delayed(work)(i) for i in work_list)
+    scheduler.run(jobs_db, kinds=['render'], workers=10, on_error=write_error)
@@ -423,7 +423,76 @@ def set_texture(material, texture):
     add_wrinkles(mat, texture)
 
 
-def render_multi_pass(render_id, image_out, percent_size, tile_size, animation):
+def progress_path(image_out, render_id, pass_name):
+    return os.path.join(image_out, 'progress', '{}_{}.txt'.format(render_id, pass_name))
+
+
+def rendered_frames(image_out, render_id, pass_name):
+    """Frames of a pass whose outputs have all been written, read from the pass' progress file"""
+    path = progress_path(image_out, render_id, pass_name)
+    if not os.path.exists(path):
+        return set()
+
+    with open(path) as f:
+        # a line without newline is a write cut short
+        return set(int(line) for line in f if line.endswith('\n'))
+
+
+def frame_recorder(image_out, render_id, pass_name):
+    """render_write handler appending every frame written by an animation render to the pass' progress file"""
+    path = progress_path(image_out, render_id, pass_name)
+    if os.path.exists(path):
+        # drop a line cut short by a crash so the next frame starts on a line of its own
+        with open(path, 'rb+') as f:
+            f.truncate(f.read().rfind(b'\n') + 1)
+
+    def record(scene, *args):
+        with open(path, 'a') as f:
+            f.write('{}\n'.format(scene.frame_current))
+
+    return record
+
+
+def shard_frames(frame_start, frame_end, step, shard=0, shards=1):
+    """Frames an animation render with frame_step visits, split into shards contiguous ranges
+
+    :return: list of the frames of shard
+    """
+    frames = list(range(frame_start, frame_end + 1, step))
+    k, m = divmod(len(frames), shards)
+
+    return frames[shard * k + min(shard, m):(shard + 1) * k + min(shard + 1, m)]
+
+
+def render_pass(pass_name, render_id, image_out, frames=None, write_still=False):
+    """Render the current frame, or the frames of an animation from the first one the pass has not written yet
+
+    :param pass_name: name of the pass for its progress file, 'uv', 'head' or 'full'
+    :param frames: frames of the animation to render, on the scene's frame_step; None to render a still
+    """
+    if frames is None:
+        bpy.ops.render.render(write_still=write_still)
+        return
+
+    done = rendered_frames(image_out, render_id, pass_name)
+    missing = [frame for frame in frames if frame not in done]
+    if len(missing) == 0:
+        print('{} pass of {} frames {}-{} already rendered'.format(pass_name, render_id, frames[0], frames[-1]))
+        return
+
+    bpy.context.scene.frame_start = missing[0]
+    bpy.context.scene.frame_end = frames[-1]
+
+    record = frame_recorder(image_out, render_id, pass_name)
+    bpy.app.handlers.render_write.append(record)
+    try:
+        bpy.ops.render.render(animation=True, write_still=write_still)
+    finally:
+        bpy.app.handlers.render_write.remove(record)
+
+
+def render_multi_pass(render_id, image_out, percent_size, tile_size, frames=None):
+    """Render the UV, head and full passes, of a still image or of the given animation frames"""
     # Set up material render layers for masks
     render.set_render_layers()
 
@@ -431,7 +500,7 @@ def render_multi_pass(render_id, image_out, percent_size, tile_size, animation):
     render.set_uv_passes(bpy.context)
     set_output_nodes(bpy.context, render_id, image_out)
     render.set_uv_render_settings(percent_size, tile_size)
-    bpy.ops.render.render(animation=animation)
+    render_pass('uv', render_id, image_out, frames)
 
     # Head Proxy Render
     render.set_head_passes(bpy.context)
@@ -439,7 +508,7 @@ def render_multi_pass(render_id, image_out, percent_size, tile_size, animation):
     render.set_head_render_settings(percent_size, tile_size)
     head_mask_path = os.path.join(image_out, 'head_masks', render_id + '.png')
     bpy.context.scene.render.filepath = head_mask_path
-    bpy.ops.render.render(animation=animation, write_still=True)
+    render_pass('head', render_id, image_out, frames, write_still=True)
 
     # Anti-Aliased Normal Render
     head_proxy = get_blend_obj('head_proxy')
@@ -447,17 +516,25 @@ def render_multi_pass(render_id, image_out, percent_size, tile_size, animation):
     render.set_passes(bpy.context)
     set_output_nodes(bpy.context, render_id, image_out)
     render.set_render_settings(percent_size, tile_size)
-    bpy.ops.render.render(animation=animation)
+    render_pass('full', render_id, image_out, frames)
 
 
 def render_character(blend_in, background, image_out, percent_size, render_id, blend_save, animation, steps,
-                     wrinkles, shirt, pants):
-    """Import character, set up rendering, and render layers"""
+                     wrinkles, shirt, pants, shard=0, shards=1):
+    """Import character, set up rendering, and render layers
+
+    Animations are rendered shard of shards contiguous parts of the frame range, resuming every pass from the first
+    frame it has not written yet.
+    """
+    if animation != '':
+        # shards and resumed runs of an animation have to draw the same clothing
+        random.seed(render_id)
+
     import_character(blend_in)
 
     hdri_lighting(background, 1)
 
-    if animation is '':
+    if animation == '':
         set_head_camera()
         background_rotation = random.uniform(0, 360)
         camera.rotate_env_tex(background_rotation)
@@ -477,15 +554,17 @@ def render_character(blend_in, background, image_out, percent_size, render_id, b
         with open(info_path, 'w') as outfile:
             json.dump(info, outfile, indent=2)
 
-        render_multi_pass(render_id, image_out, percent_size, 32, False)
+        render_multi_pass(render_id, image_out, percent_size, 32)
 
     else:
         set_mocap_camera()
         load_animation(animation)
-        bpy.context.scene.frame_step = steps
-        render_multi_pass(render_id, image_out, percent_size, 32, True)
+        scene = bpy.context.scene
+        scene.frame_step = steps
+        frames = shard_frames(scene.frame_start, scene.frame_end, steps, shard, shards)
+        render_multi_pass(render_id, image_out, percent_size, 32, frames)
 
-    if blend_save is not '':
+    if blend_save != '':
         bpy.ops.file.pack_all()
         bpy.ops.wm.save_as_mainfile(filepath=os.path.join(blend_save, render_id + '.blend'))
 
@@ -510,6 +589,9 @@ if __name__ == '__main__':
     parser.add_argument('--blend_save', '-b', type=str, help='if set, directory to save blend files', default='')
     parser.add_argument('--animation', '-a', type=str, help='if set, directory to mocap animation file', default='')
     parser.add_argument('--stride', '-s', type=int, help='frame steps; 1 is all frames', default=5)
+    parser.add_argument('--shard', type=int, help='part of the animation frame range to render, from 0', default=0)
+    parser.add_argument('--shards', type=int, help='number of parts to split the animation frame range into',
+                        default=1)
     parser.add_argument('--wrinkles', '-w', type=bool, help='flag for usage of wrinkles', default=False)
     parser.add_argument('--shirt', '-t', type=str, help='path to shirt texture', required=True)
     parser.add_argument('--pants', '-n', type=str, help='path to pants texture', required=True)
@@ -527,8 +609,9 @@ if __name__ == '__main__':
     shirt = os.path.abspath(args.shirt)
 
     common.mkdirp(os.path.join(output, 'metadata'))
+    common.mkdirp(os.path.join(output, 'progress'))
 
     file_id = args.render_id
 
     render_character(args.blend_in, args.background, output, args.percent_size, file_id, args.blend_save,
-                     args.animation, args.stride, args.wrinkles, shirt, pants)
+                     args.animation, args.stride, args.wrinkles, shirt, pants, args.shard, args.shards)
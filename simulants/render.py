@@ -197,6 +197,61 @@ def set_head_render_settings(image_size, percent_size, tile_size):
     bpy.context.scene.cycles.max_bounces = 2
 
 
+def set_single_render_passes(context):
+    """Enable the full image passes and the UV pass on the base render layer, so both come from one render"""
+    set_passes(context)
+
+    rl = context.scene.render.layers['RenderLayer']
+    rl.use_pass_uv = True
+    rl.layers = [i == 0 for i in range(len(rl.layers))]
+
+
+def head_mask_path(character):
+    """Relative path (without frame number) the head mask of a character is written to in single render mode"""
+    return os.path.join(character['head_id'], 'head_{}'.format(character['head_id']))
+
+
+def add_head_index_layers(context, simulants, image_name):
+    """Add a one sample, object index only render layer per head proxy and write each as a mask
+
+    Every layer holds just its own proxy, so like the separate head renders the masks are whole head silhouettes
+    regardless of occlusion, but they are rendered in the same render call (and BVH build) as the full image.
+    Call after set_output_nodes, which clears the compositor node tree.
+
+    :param context: blender context
+    :param simulants: simulant descriptors of the scene, with head_id and head_proxy
+    :param image_name: output directory of the scene
+    """
+    scene = context.scene
+    tree = scene.node_tree
+    links = tree.links
+
+    output_node = tree.nodes.new('CompositorNodeOutputFile')
+    output_node.base_path = image_name
+
+    for index, character in enumerate(simulants, 1):
+        layer_id = int(character['head_proxy']['layer'])
+        bpy.data.objects[character['head_proxy']['id']].pass_index = index
+        scene.layers[layer_id] = True
+
+        rl = scene.render.layers.new('head_{}'.format(character['head_id']))
+        rl.layers = [i == layer_id for i in range(len(rl.layers))]
+        rl.samples = 1
+        rl.use_pass_combined = False
+        rl.use_pass_z = False
+        rl.use_pass_object_index = True
+
+        layer_node = tree.nodes.new('CompositorNodeRLayers')
+        layer_node.layer = rl.name
+        id_mask = tree.nodes.new('CompositorNodeIDMask')
+        id_mask.index = index
+        links.new(layer_node.outputs['IndexOB'], id_mask.inputs[0])
+
+        output_node.file_slots.new(name=rl.name)
+        output_node.file_slots[-1].path = head_mask_path(character)
+        links.new(id_mask.outputs[0], output_node.inputs[-1])
+
+
 def hdri_lighting(background, intensity):
     """use background image as hdri environment lighting source"""
     nw_world = bpy.data.worlds.new('hdri_tree')
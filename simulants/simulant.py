@@ -11,6 +11,7 @@ from simulants.generators.shirt import ShirtGenerator
 from simulants.generators.pants import PantsGenerator
 
 from simulants.blend_ops import parent_to_skeleton, deselect_all, get_blend_obj, proxy_fit
+from simulants.tools.pose_archive import is_pose_reference, read_pose
 
 
 class SimulantGenerator:
@@ -153,12 +154,26 @@ def finalize():
 
 
 def pose(body, pose_path):
+    """Pose a simulant from a MB-Lab pose json or a pose archive reference, see simulants.tools.pose_archive"""
     deselect_all()
     human = get_blend_obj(body)
+    if is_pose_reference(pose_path):
+        set_bone_rotations(human.find_armature(), *read_pose(pose_path))
+        return
+
     human.select = True
     bpy.ops.mbast.pose_load(filepath=pose_path)
 
 
+def set_bone_rotations(skeleton, bones, rotations):
+    """Set the local rotation of every named bone the skeleton has to a (w, x, y, z) quaternion"""
+    for name, rotation in zip(bones, rotations):
+        if name in skeleton.pose.bones:
+            bone = skeleton.pose.bones[name]
+            bone.rotation_mode = 'QUATERNION'
+            bone.rotation_quaternion = [float(x) for x in rotation]
+
+
 def uncensor(body):
     """set all skin geometry to skin texture (i.e. remove modesty material)"""
     human = get_blend_obj(body)
@@ -231,3 +246,34 @@ def head_proxy_properties(head_proxy):
     distance = get_blend_obj('Camera').location - head_center
 
     return {'radius': head_radius, 'center': head_center, 'distance': distance.length}
+
+
+def rename_simulant(old_id, new_id):
+    """Rename the objects of a simulant built as old_id (body_<id>, skeleton_<id>, hair_<id>, ...) to new_id"""
+    for obj in bpy.data.objects:
+        if obj.name.endswith(old_id):
+            obj.name = obj.name[:-len(old_id)] + new_id
+
+
+def from_cache(config, cache, variant=''):
+    """Make the simulant blend at config['path'] from the blend of an identical descriptor, if one is cached
+
+    :param config: simulant descriptor
+    :param cache: SimulantCache
+    :param variant: build procedure the cached blend has to come from
+    :return: True if the blend was made from the cache
+    """
+    entry = cache.lookup(config, variant)
+    if entry is None:
+        return False
+
+    if entry['built_id'] == config['id']:
+        cache.materialize(entry, config['path'])
+    else:
+        # same simulant under another id, only the object names differ
+        bpy.ops.wm.open_mainfile(filepath=cache.blend_path(entry['key']))
+        rename_simulant(entry['built_id'], config['id'])
+        bpy.ops.wm.save_as_mainfile(filepath=config['path'])
+    cache.record_output(config, variant)
+
+    return True
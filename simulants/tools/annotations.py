@@ -0,0 +1,142 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import functools
+import multiprocessing
+import numpy as np
+
+from PIL import Image
+from pycocotools import mask as mask_utils
+
+PERSON = {'id': 1, 'name': 'person', 'supercategory': 'person'}
+
+
+def read_mask(path):
+    """Read a mask image as an (H, W) array, asserting it is single channel"""
+    mask = np.asarray(Image.open(path))
+    assert len(mask.shape) == 2, 'mask {} is not binary'.format(path)
+
+    return mask
+
+
+def bbox(mask):
+    """Inclusive [xmin, xmax, ymin, ymax] of the non zero pixels of a mask, or None if it is empty
+
+    :param mask: (H, W) array
+    :return: tuple of xmin, xmax, ymin, ymax
+    """
+    rows = np.any(mask, axis=1)
+    if not rows[rows.argmax()]:
+        return None
+    cols = np.any(mask, axis=0)
+
+    ymin = rows.argmax()
+    ymax = len(rows) - 1 - rows[::-1].argmax()
+    xmin = cols.argmax()
+    xmax = len(cols) - 1 - cols[::-1].argmax()
+
+    return int(xmin), int(xmax), int(ymin), int(ymax)
+
+
+def coco_bbox(box):
+    """Convert an inclusive [xmin, xmax, ymin, ymax] box to COCO [x, y, width, height]"""
+    xmin, xmax, ymin, ymax = box
+
+    return [xmin, ymin, xmax - xmin + 1, ymax - ymin + 1]
+
+
+def instance_masks(mask, instance_ids=False):
+    """Yield (instance value, boolean mask) pairs
+
+    :param mask: (H, W) array
+    :param instance_ids: if True every distinct non zero value is its own instance, otherwise all non zero pixels
+                         (i.e. an anti-aliased alpha mask) form a single instance
+    """
+    if not instance_ids:
+        yield 1, mask != 0
+        return
+
+    for value in np.unique(mask):
+        if value != 0:
+            yield int(value), mask == value
+
+
+def encode(instance):
+    """COCO compressed RLE of a boolean mask, with counts as a string so it can go straight into json"""
+    rle = mask_utils.encode(np.asfortranarray(instance, dtype=np.uint8))
+    if isinstance(rle['counts'], bytes):
+        rle['counts'] = rle['counts'].decode('ascii')
+
+    return rle
+
+
+def annotate(mask, instance_ids=False):
+    """Box, area and RLE segmentation of every instance in a mask, in one pass over each instance
+
+    :param mask: (H, W) array
+    :param instance_ids: treat distinct values as separate instances, see instance_masks
+    :return: list of dicts with instance, bbox (COCO format), area and segmentation
+    """
+    annotations = []
+    for value, instance in instance_masks(mask, instance_ids):
+        box = bbox(instance)
+        if box is None:
+            continue
+        annotations.append({'instance': value, 'bbox': coco_bbox(box), 'area': int(np.count_nonzero(instance)),
+                            'segmentation': encode(instance)})
+
+    return annotations
+
+
+def annotate_file(path, instance_ids=False):
+    """Annotate one mask image
+
+    :param path: path to mask image
+    :param instance_ids: treat distinct values as separate instances, see instance_masks
+    :return: tuple of (file name, height, width) and the list of instance annotations
+    """
+    mask = read_mask(path)
+    height, width = mask.shape
+
+    return (os.path.split(path)[1], height, width), annotate(mask, instance_ids)
+
+
+def annotate_directory(mask_path, extension='png', workers=1, instance_ids=False, category=PERSON, chunksize=64):
+    """Annotate every mask in a directory into one COCO instances dataset, in parallel
+
+    Images are numbered in sorted file name order so the output does not depend on the number of workers.
+
+    :param mask_path: directory of mask images
+    :param extension: mask file extension
+    :param workers: number of worker processes
+    :param instance_ids: treat distinct values as separate instances, see instance_masks
+    :param category: COCO category dict every instance is labeled with
+    :param chunksize: masks handed to a worker at a time
+    :return: COCO dict with images, annotations and categories
+    """
+    paths = sorted(os.path.join(mask_path, f) for f in os.listdir(mask_path) if f.endswith('.' + extension))
+    work = functools.partial(annotate_file, instance_ids=instance_ids)
+
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap(work, paths, chunksize=chunksize)
+    else:
+        pool = None
+        results = (work(p) for p in paths)
+
+    images = []
+    annotations = []
+    for image_id, ((file_name, height, width), instances) in enumerate(results, 1):
+        images.append({'id': image_id, 'file_name': file_name, 'height': height, 'width': width})
+        for instance in instances:
+            annotations.append({'id': len(annotations) + 1, 'image_id': image_id, 'category_id': category['id'],
+                                'iscrowd': 0, 'bbox': instance['bbox'], 'area': instance['area'],
+                                'segmentation': instance['segmentation']})
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    return {'images': images, 'annotations': annotations, 'categories': [category]}
@@ -0,0 +1,43 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import collections
+
+
+class LRUCache:
+    def __init__(self, max_items):
+        """Least recently used cache of at most max_items entries
+
+        :param max_items: number of entries to keep before evicting the oldest
+        """
+        self.max_items = max_items
+        self.items = collections.OrderedDict()
+
+    def get(self, key):
+        """Return cached value for key (marking it as recently used) or None"""
+        value = self.items.pop(key, None)
+        if value is not None:
+            self.items[key] = value
+
+        return value
+
+    def put(self, key, value):
+        """Store value for key, evicting the least recently used entries if full"""
+        self.items.pop(key, None)
+        self.items[key] = value
+        while len(self.items) > self.max_items:
+            self.items.popitem(last=False)
+
+        return value
+
+    def fetch(self, key, load):
+        """Return cached value for key, calling load() and caching its result on a miss"""
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, load())
+
+        return value
+
+    def clear(self):
+        self.items.clear()
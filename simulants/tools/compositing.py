@@ -0,0 +1,252 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import numpy as np
+
+from PIL import Image, ImageOps
+
+# Channel layout of a simulant layer stack
+IMAGE = slice(0, 4)
+AO = slice(4, 8)
+MASK_NAMES = ['body', 'shirt', 'pants', 'hair', 'head', 'etc']
+MASKS = dict((name, 8 + i) for i, name in enumerate(MASK_NAMES))
+NUM_CHANNELS = 8 + len(MASK_NAMES)
+
+
+def read_layer_stack(image_path, ao_path, mask_paths, stack=None):
+    """Read every render layer of a simulant into one (H, W, C) uint8 array
+
+    Channels 0-3 hold the RGBA render, 4-7 the RGBA ambient occlusion and the rest one 'L' material index mask each,
+    in the order of MASK_NAMES.
+
+    :param image_path: path to base image (RGBA render of simulant)
+    :param ao_path: path to RGBA ambient occlusion render
+    :param mask_paths: dict of mask name to path for every name in MASK_NAMES
+    :param stack: optional preallocated array to reuse, must be (H, W, NUM_CHANNELS) uint8
+    :return: (H, W, NUM_CHANNELS) uint8 layer stack
+    """
+    image = Image.open(image_path).convert('RGBA')
+    width, height = image.size
+
+    if stack is None or stack.shape != (height, width, NUM_CHANNELS):
+        stack = np.empty((height, width, NUM_CHANNELS), dtype=np.uint8)
+
+    stack[:, :, IMAGE] = np.asarray(image)
+    stack[:, :, AO] = np.asarray(Image.open(ao_path).convert('RGBA'))
+
+    for name in MASK_NAMES:
+        mask = Image.open(mask_paths[name]).convert('L')
+        assert mask.size == image.size, 'mask {} is {} not {}'.format(mask_paths[name], mask.size, image.size)
+        stack[:, :, MASKS[name]] = np.asarray(mask)
+        mask_check(stack[:, :, MASKS[name]], mask_paths[name])
+
+    return stack
+
+
+def mask_check(mask, name):
+    """Make sure a uint8 mask is binary, allowing 1% of its non zero pixels to be fractional"""
+    num_nonzero = np.count_nonzero(mask)
+    num_fractional = num_nonzero - np.count_nonzero(mask == 255)
+    assert num_fractional <= 0.01 * num_nonzero, '{} fractional values in {}'.format(num_fractional, name)
+
+
+def luminance(rgb):
+    """ITU-R 601-2 luma of a uint8 RGB array, rounded the same way as PIL's convert('L')"""
+    rgb = rgb.astype(np.uint32)
+    luma = (rgb[:, :, 0] * 19595 + rgb[:, :, 1] * 38470 + rgb[:, :, 2] * 7471 + 0x8000) >> 16
+
+    return luma.astype(np.uint8)
+
+
+def autocontrast_lut(gray, ignore=0):
+    """256 entry lookup table equivalent to ImageOps.autocontrast(image, ignore=ignore)"""
+    histogram = np.bincount(gray.ravel(), minlength=256)
+    histogram[ignore] = 0
+    used = np.flatnonzero(histogram)
+
+    if len(used) == 0 or used[-1] <= used[0]:
+        return np.arange(256, dtype=np.uint8)
+
+    lo, hi = used[0], used[-1]
+    scale = 255.0 / (hi - lo)
+    offset = -lo * scale
+    lut = (np.arange(256) * scale + offset).astype(np.int64)
+
+    return np.clip(lut, 0, 255).astype(np.uint8)
+
+
+def colorize_lut(dark, light):
+    """(256, 3) lookup table equivalent to ImageOps.colorize(image, dark, light)"""
+    ramp = Image.frombytes('L', (256, 1), bytes(bytearray(range(256))))
+
+    return np.asarray(ImageOps.colorize(ramp, dark, light))[0]
+
+
+def colorize_hair(rgb, hair_colors):
+    """Autocontrast the luma of the render and map it between the dark and light hair colours
+
+    :param rgb: (H, W, 3) uint8 render
+    :param hair_colors: (dark, light) tuple of RGB tuples, or their colorize_lut to reuse across frames
+    :return: (H, W, 3) uint8 colourized render
+    """
+    if not isinstance(hair_colors, np.ndarray):
+        hair_colors = colorize_lut(*hair_colors)
+
+    gray = luminance(rgb)
+    lut = hair_colors[autocontrast_lut(gray)]
+
+    return lut[gray]
+
+
+def over(premultiplied, alpha, rgb, rgb_alpha):
+    """In place Porter-Duff 'over' of a straight alpha layer onto a premultiplied float32 accumulator"""
+    rgb_alpha = rgb_alpha[:, :, np.newaxis]
+    premultiplied *= 1.0 - rgb_alpha
+    premultiplied += rgb * rgb_alpha
+    alpha *= 1.0 - rgb_alpha[:, :, 0]
+    alpha += rgb_alpha[:, :, 0]
+
+
+def clothing_layer(item, rgb, image_alpha, item_alpha):
+    """Colour and alpha of a clothing item
+
+    A flat RGB colour tints the whole render with the render's own alpha, as combine_with_color always has; a mapped
+    (H, W, 3) texture is shaded by the render and cut out with the item mask.
+    """
+    if isinstance(item, np.ndarray):
+        return item * rgb / np.float32(255), item_alpha
+
+    return rgb * (np.asarray(item, dtype=np.float32) / 255), image_alpha
+
+
+def composite_person(stack, skin_color, hair_colors, shirt, pants, opacity=0.85):
+    """Fused numpy replacement for the PIL layer chain of make_clothed_person
+
+    Composites skin, hair, eyes/teeth/etc, shirt and pants, overlay blends the ambient occlusion and builds the part
+    masks in a single float32 pass over the layer stack. Against the original chain of ImageChops and
+    Image.alpha_composite calls every channel matches to within 3 levels, with over 98% of values within 1; the
+    difference comes from PIL rounding each intermediate composite to 8 bits where this keeps full precision until the
+    end. The returned masks are identical.
+
+    :param stack: (H, W, NUM_CHANNELS) uint8 array from read_layer_stack
+    :param skin_color: RGB tuple of skin tone
+    :param hair_colors: (dark, light) RGB tuples for colorizing hair, or their colorize_lut
+    :param shirt: RGB tuple for a flat colour, or (H, W, 3) uint8 mapped texture
+    :param pants: RGB tuple for a flat colour, or (H, W, 3) uint8 mapped texture
+    :param opacity: ambient occlusion overlay opacity [0, 1]
+    :return: tuple of full composite (RGBA), clothes mask, head mask, and body mask as uint8 arrays
+    """
+    assert stack.shape[2] == NUM_CHANNELS, 'stack has {} channels'.format(stack.shape[2])
+    assert 0.0 <= opacity <= 1.0, 'Opacity needs to be between 0.0 and 1.0.'
+
+    image_rgb = stack[:, :, 0:3]
+    rgb = image_rgb.astype(np.float32)
+    image_alpha = stack[:, :, 3] / np.float32(255)
+
+    def mask(name):
+        return stack[:, :, MASKS[name]] / np.float32(255)
+
+    # Skin tinted render is the base layer, then everything else goes over it
+    alpha = image_alpha.copy()
+    premultiplied = rgb * (np.asarray(skin_color, dtype=np.float32) / 255)
+    premultiplied *= alpha[:, :, np.newaxis]
+
+    over(premultiplied, alpha, colorize_hair(image_rgb, hair_colors), mask('hair'))
+    over(premultiplied, alpha, rgb, mask('etc'))
+    over(premultiplied, alpha, *clothing_layer(shirt, rgb, image_alpha, mask('shirt')))
+    over(premultiplied, alpha, *clothing_layer(pants, rgb, image_alpha, mask('pants')))
+
+    # Overlay blend ambient occlusion, working in [0, 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        base = premultiplied / (255 * alpha[:, :, np.newaxis])
+    ao = stack[:, :, AO] / np.float32(255)
+
+    comp_alpha = np.minimum(alpha, ao[:, :, 3]) * opacity
+    new_alpha = alpha + (1.0 - alpha) * comp_alpha
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = (comp_alpha / new_alpha)[:, :, np.newaxis]
+
+    blended = base * (base + 2 * ao[:, :, :3] * (1 - base))
+    blended *= ratio
+    blended += base * (1.0 - ratio)
+    blended = np.nan_to_num(blended, copy=False)
+
+    # Part masks, adding and clipping like ImageChops.add
+    masks = stack[:, :, 8:].astype(np.uint16)
+    whole_head = np.minimum(masks[:, :, MASKS['hair'] - 8] + masks[:, :, MASKS['head'] - 8], 255)
+    clothes = np.minimum(masks[:, :, MASKS['shirt'] - 8] + masks[:, :, MASKS['pants'] - 8], 255)
+    simulant = np.minimum(masks.sum(axis=2), 255)
+
+    composite = np.empty(stack.shape[:2] + (4,), dtype=np.uint8)
+    composite[:, :, :3] = blended * 255
+    composite[:, :, 3] = simulant
+
+    return (composite, clothes.astype(np.uint8), whole_head.astype(np.uint8),
+            stack[:, :, MASKS['body']].copy())
+
+
+def div255(value):
+    """Rounded value / 255 of non negative int64 arrays, in PIL's integer arithmetic"""
+    return ((value >> 8) + value) >> 8
+
+
+class InstanceCompositor:
+    def __init__(self, size):
+        """Front to back compositor of instance overlays that keeps track of which instance is visible where
+
+        Overlays are added nearest first and every add only touches the overlay's bounding box: its colour goes under
+        everything already added, its masks are cut by the alpha accumulated in front of it, and the pixels it covers
+        by more than half that no nearer instance covers get its index in the int16 id buffer (-1 is background).
+
+        The plate is kept in 8 bits with PIL's integer arithmetic, so the composite and the cut masks are identical to
+        alpha compositing every overlay under the plate and multiplying its masks by the inverted plate alpha in PIL.
+
+        :param size: (width, height) of the composite
+        """
+        width, height = size
+        self.size = size
+        self.count = 0
+        self.ids = np.full((height, width), -1, dtype=np.int16)
+        self.plate = np.zeros((height, width, 4), dtype=np.uint8)
+
+    def add(self, box, foreground, masks=()):
+        """Add the next overlay, behind every overlay added before
+
+        :param box: (left, upper, right, lower) bounding box of the overlay in the composite, as PIL's getbbox
+        :param foreground: RGBA uint8 array of the overlay cropped to box
+        :param masks: L uint8 arrays of the instance cropped to box, i.e. body, clothes and head masks
+        :return: list of the masks with what is in front removed, uint8 arrays cropped to box
+        """
+        left, upper, right, lower = box
+        window = (slice(upper, lower), slice(left, right))
+        assert foreground.shape[:2] == (lower - upper, right - left), \
+            'foreground is {} for box {}'.format(foreground.shape, box)
+
+        plate = self.plate[window]
+        front_alpha = plate[:, :, 3].astype(np.int64)
+        behind = 255 - front_alpha
+        # ImageChops.multiply of the mask and the inverted plate alpha, which truncates
+        visible = [(mask * behind // 255).astype(np.uint8) for mask in masks]
+
+        # Image.alpha_composite of the plate over the overlay, with PIL's 7 bit fixed point colour weights
+        alpha = foreground[:, :, 3].astype(np.int64)
+        alpha255 = front_alpha * 255 + alpha * behind
+        front_weight = front_alpha * (255 * 255 << 7) // np.maximum(alpha255, 1)
+        back_weight = (255 << 7) - front_weight
+        rgb = plate[:, :, :3] * front_weight[:, :, np.newaxis] + foreground[:, :, :3] * back_weight[:, :, np.newaxis]
+        composited = np.empty_like(plate)
+        composited[:, :, :3] = div255(rgb + (0x80 << 7)) >> 7
+        composited[:, :, 3] = div255(alpha255 + 0x80)
+        # where nothing is in front the overlay is copied as it is
+        self.plate[window] = np.where(front_alpha[:, :, np.newaxis] == 0, foreground, composited)
+
+        ids = self.ids[window]
+        ids[(ids < 0) & (foreground[:, :, 3] > 127)] = self.count
+        self.count += 1
+
+        return visible
+
+    def composite(self):
+        """RGBA uint8 array of every overlay added so far over transparency"""
+        return self.plate.copy()
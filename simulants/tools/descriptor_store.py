@@ -0,0 +1,165 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import json
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS descriptors (
+    id TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS store (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class DescriptorStore:
+    def __init__(self, path, id_field='id'):
+        """Append only json lines file of descriptors with an id index for random access
+
+        Next to the store, path + '.idx' is a SQLite table of id, byte offset and length of every descriptor, so a
+        lookup reads one index entry and one line whatever the size of the store. The index also records the end of
+        the indexed lines. Appends hold the index's write lock while they write the store, so concurrent writers take
+        turns; complete lines past the indexed end (i.e. after a crash between the two writes) are indexed by the next
+        append and a partly written last line is dropped. Readers never write, lines not indexed yet are invisible to
+        get. Appending a descriptor with an id already in the store replaces it for get, iteration yields every line.
+
+        SQLite locking is unreliable on network file systems, keep the store on a local disk.
+
+        :param path: path of the .jsonl store, created on first append
+        :param id_field: descriptor field holding the id, 'id' for simulants and 'scene_id' for scenes
+        """
+        self.path = path
+        self.index_path = path + '.idx'
+        self.id_field = id_field
+        self.db = None
+
+    def index(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.index_path, timeout=60, isolation_level=None)
+            self.db.executescript(SCHEMA)
+
+        return self.db
+
+    def end(self):
+        """Byte offset the indexed lines end at"""
+        row = self.index().execute("SELECT value FROM store WHERE key = 'end'").fetchone()
+
+        return 0 if row is None else row[0]
+
+    def tail_entries(self, end):
+        """(id, offset, length) of the complete lines of the store past end"""
+        entries = []
+        if not os.path.exists(self.path):
+            return entries
+
+        with open(self.path, 'rb') as f:
+            f.seek(end)
+            offset = end
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                descriptor_id = json.loads(line.decode('utf-8'))[self.id_field]
+                entries.append((str(descriptor_id), offset, len(line)))
+                offset += len(line)
+
+        return entries
+
+    def extend(self, descriptors):
+        """Append descriptors to the store and the index, indexing lines a crashed append left unindexed first"""
+        db = self.index()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            entries = self.tail_entries(self.end())
+            offset = entries[-1][1] + entries[-1][2] if entries else self.end()
+            with open(self.path, 'ab') as f:
+                # drop a partly written last line
+                f.truncate(offset)
+                for descriptor in descriptors:
+                    line = (json.dumps(descriptor, sort_keys=True) + '\n').encode('utf-8')
+                    f.write(line)
+                    entries.append((str(descriptor[self.id_field]), offset, len(line)))
+                    offset += len(line)
+
+            db.executemany('INSERT OR REPLACE INTO descriptors (id, offset, length) VALUES (?, ?, ?)', entries)
+            db.execute("INSERT OR REPLACE INTO store (key, value) VALUES ('end', ?)", (offset,))
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+    def append(self, descriptor):
+        self.extend([descriptor])
+
+    def get(self, descriptor_id):
+        """Read one descriptor by id"""
+        row = None
+        if os.path.exists(self.index_path):
+            row = self.index().execute('SELECT offset, length FROM descriptors WHERE id = ?',
+                                       (str(descriptor_id),)).fetchone()
+        assert row is not None, 'no descriptor {} in {}'.format(descriptor_id, self.path)
+
+        with open(self.path, 'rb') as f:
+            f.seek(row[0])
+            line = f.read(row[1])
+
+        return json.loads(line.decode('utf-8'))
+
+    def ids(self):
+        if not os.path.exists(self.index_path):
+            return []
+
+        return [row[0] for row in self.index().execute('SELECT id FROM descriptors ORDER BY offset')]
+
+    def __contains__(self, descriptor_id):
+        if not os.path.exists(self.index_path):
+            return False
+
+        return self.index().execute('SELECT 1 FROM descriptors WHERE id = ?',
+                                    (str(descriptor_id),)).fetchone() is not None
+
+    def __len__(self):
+        if not os.path.exists(self.index_path):
+            return 0
+
+        return self.index().execute('SELECT COUNT(*) FROM descriptors').fetchone()[0]
+
+    def __iter__(self):
+        """Stream every descriptor in the order they were appended"""
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if line.endswith(b'\n'):
+                    yield json.loads(line.decode('utf-8'))
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+def load_descriptor(info, descriptor_id=None, id_field='id'):
+    """Read a descriptor from a json file, or by id from a descriptor store
+
+    :param info: path of a descriptor json, or of a .jsonl store when descriptor_id is given
+    :param descriptor_id: id of the descriptor in the store
+    :param id_field: descriptor field the store is indexed by
+    :return: descriptor dict
+    """
+    if descriptor_id is not None:
+        store = DescriptorStore(info, id_field)
+        try:
+            return store.get(descriptor_id)
+        finally:
+            store.close()
+
+    with open(info) as jd:
+        return json.load(jd)
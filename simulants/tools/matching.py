@@ -6,6 +6,14 @@ import numpy as np
 
 from PIL import Image
 from skimage import color
+from simulants.tools.cache import LRUCache
+
+# Colour space each matching method works in, and the channels of that space it matches
+METHOD_SPACES = {'RGB': 'RGB', 'LAB': 'LAB', 'HSV': 'HSV', 'SAT': 'HSV', 'SATVAL': 'HSV'}
+METHOD_CHANNELS = {'RGB': (0, 1, 2), 'LAB': (0, 1, 2), 'HSV': (0, 1, 2), 'SAT': (1,), 'SATVAL': (1, 2)}
+
+# Number of entries in the lookup table used to match float (LAB, HSV) channels
+FLOAT_LUT_SIZE = 16384
 
 
 def as_ndarray(image):
@@ -176,4 +184,246 @@ def match_background_sat_val(foreground_img, background_img):
     matched[:, :, :3] = matched_rgb[:, :, :3]
     matched = Image.fromarray(matched.astype('uint8'))
 
-    return matched
\ No newline at end of file
+    return matched
+
+
+def to_space(rgb, space):
+    """Convert (H, W, 3) RGB array to the given colour space"""
+    if space == 'LAB':
+        return color.rgb2lab(rgb)
+    elif space == 'HSV':
+        return color.rgb2hsv(rgb)
+
+    return rgb
+
+
+def from_space(image, space):
+    """Convert (H, W, 3) array in the given colour space to [0, 255] RGB"""
+    if space == 'LAB':
+        return color.lab2rgb(image) * 255
+    elif space == 'HSV':
+        return color.hsv2rgb(image) * 255
+
+    return image
+
+
+def background_stats(background_img, space, n_bins=255):
+    """Histogram bin edges and normalized CDF of every background channel in a colour space
+
+    :param background_img: RGB(A) ndimage or PIL image
+    :param space: 'RGB', 'LAB' or 'HSV'
+    :param n_bins: number of bins to match (usually 255)
+    :return: list of (bin edges, cdf) per channel
+    """
+    background_img = as_ndarray(background_img)
+    background = to_space(background_img[:, :, :3], space)
+
+    stats = []
+    for d in range(3):
+        b_hist, bins = np.histogram(background[:, :, d], bins=n_bins, density=True)
+        stats.append((bins[:-1], cdf_norm(b_hist, n_bins)))
+
+    return stats
+
+
+class BackgroundStatsCache:
+    def __init__(self, max_backgrounds=1024):
+        """Per colour space background histogram CDFs, so a background reused across composites is analysed once
+
+        :param max_backgrounds: number of (background, colour space) entries to keep
+        """
+        self.stats_cache = LRUCache(max_backgrounds)
+
+    def stats(self, background_img, space, key=None):
+        """Return background_stats for background_img, cached under key (i.e. its path) if one is given"""
+        if key is None:
+            return background_stats(background_img, space)
+
+        return self.stats_cache.fetch((key, space), lambda: background_stats(background_img, space))
+
+    def clear(self):
+        self.stats_cache.clear()
+
+
+def uint8_curve(channel, alpha, bins, cdf_b, n_bins=255):
+    """256 entry lookup table histogram matching one uint8 channel, see match_uint8_channel"""
+    levels = np.arange(256)
+    counts = np.bincount(channel.ravel(), minlength=256)
+    present = np.flatnonzero(counts)
+    weights = np.bincount(channel.ravel(), weights=alpha.ravel(), minlength=256)
+
+    f_hist, _ = np.histogram(levels, bins=n_bins, range=(present[0], present[-1]), density=True, weights=weights)
+    cdf_f = cdf_norm(f_hist, n_bins)
+
+    return np.interp(np.interp(levels, bins, cdf_f), cdf_b, bins).astype(np.uint8)
+
+
+def match_uint8_channel(channel, alpha, bins, cdf_b, n_bins=255):
+    """Histogram match one uint8 channel through a 256 entry lookup table
+
+    Histograms and interpolates the 256 possible levels rather than every pixel. Matches match_channels exactly,
+    except that the alpha weights are summed as floats; np.histogram accumulates uint8 weights in uint8, so the
+    foreground histogram of match_background_rgb wraps around for any level covering more than 255 opaque pixels.
+    """
+    return uint8_curve(channel, alpha, bins, cdf_b, n_bins).take(channel)
+
+
+def float_curve(channel, alpha, bins, cdf_b, n_bins=255, lut_size=FLOAT_LUT_SIZE):
+    """Lookup table histogram matching one float channel, see match_float_channel
+
+    :return: (lo, scale, lut) where a value c maps to lut[rint((c - lo) * scale)]
+    """
+    f_hist, _ = np.histogram(channel, bins=n_bins, density=True, weights=alpha.astype(np.float64))
+    cdf_f = cdf_norm(f_hist, n_bins)
+
+    lo, hi = channel.min(), channel.max()
+    if hi == lo:
+        return lo, 0.0, np.interp(np.interp([lo], bins, cdf_f), cdf_b, bins)
+
+    samples = np.linspace(lo, hi, lut_size)
+    lut = np.interp(np.interp(samples, bins, cdf_f), cdf_b, bins)
+
+    return lo, (lut_size - 1) / (hi - lo), lut
+
+
+def apply_float_curve(channel, curve):
+    """Map a float channel through a float_curve, values outside the curve's range take its end points"""
+    lo, scale, lut = curve
+    index = np.rint((channel - lo) * scale).astype(np.intp)
+
+    return lut.take(np.clip(index, 0, len(lut) - 1))
+
+
+def match_float_channel(channel, alpha, bins, cdf_b, n_bins=255, lut_size=FLOAT_LUT_SIZE):
+    """Histogram match one float channel through a lookup table sampled over the channel's range
+
+    Pixels take the nearest of lut_size evenly spaced samples of the matching curve instead of interpolating it
+    exactly. Once converted back to 8 bit RGB all but about 0.03% of pixels, those next to steps in the background
+    CDF, come out within a level of match_channels.
+    """
+    return apply_float_curve(channel, float_curve(channel, alpha, bins, cdf_b, n_bins, lut_size))
+
+
+def matching_curves(foreground_img, stats, method):
+    """Per channel lookup tables matching a foreground to precomputed background statistics
+
+    :param foreground_img: ndimage 4 channel array
+    :param stats: background_stats in the method's colour space
+    :param method: 'RGB', 'LAB', 'HSV', 'SAT' or 'SATVAL'
+    :return: dict of channel to uint8_curve (RGB) or float_curve (other spaces)
+    """
+    foreground_img = as_ndarray(foreground_img)
+    space = METHOD_SPACES[method]
+    alpha = foreground_img[:, :, 3]
+
+    if space == 'RGB':
+        return dict((d, uint8_curve(foreground_img[:, :, d], alpha, *stats[d])) for d in METHOD_CHANNELS[method])
+
+    converted = to_space(foreground_img[:, :, :3], space)
+
+    return dict((d, float_curve(converted[:, :, d], alpha, *stats[d])) for d in METHOD_CHANNELS[method])
+
+
+def apply_curves(foreground_img, curves, method):
+    """Map a foreground through matching_curves, which may come from another (i.e. earlier) foreground
+
+    :return: PIL RGBA image
+    """
+    foreground_img = as_ndarray(foreground_img)
+    space = METHOD_SPACES[method]
+
+    if space == 'RGB':
+        matched = foreground_img.copy()
+        for d, lut in curves.items():
+            matched[:, :, d] = lut.take(foreground_img[:, :, d])
+
+        return Image.fromarray(matched)
+
+    converted = to_space(foreground_img[:, :, :3], space)
+    for d, curve in curves.items():
+        converted[:, :, d] = apply_float_curve(converted[:, :, d], curve)
+
+    matched = np.empty(foreground_img.shape, dtype=np.uint8)
+    matched[:, :, :3] = from_space(converted, space)
+    matched[:, :, 3] = foreground_img[:, :, 3]
+
+    return Image.fromarray(matched)
+
+
+def match_with_stats(foreground_img, stats, method):
+    """Histogram match a foreground to precomputed background statistics
+
+    :param foreground_img: ndimage 4 channel array
+    :param stats: background_stats in the method's colour space
+    :param method: 'RGB', 'LAB', 'HSV', 'SAT' or 'SATVAL'
+    :return: PIL RGBA image
+    """
+    return apply_curves(foreground_img, matching_curves(foreground_img, stats, method), method)
+
+
+def match_background(foreground_img, background_img, method, cache=None, key=None):
+    """Fast path of the match_background_* functions using cached background statistics
+
+    :param foreground_img: ndimage 4 channel array
+    :param background_img: ndimage
+    :param method: 'RGB', 'LAB', 'HSV', 'SAT' or 'SATVAL'
+    :param cache: optional BackgroundStatsCache
+    :param key: key identifying the background in the cache, i.e. its path
+    :return: PIL RGBA image
+    """
+    return match_background_batch([foreground_img], background_img, method, cache, key)[0]
+
+
+def match_background_batch(foreground_imgs, background_img, method, cache=None, key=None):
+    """Match several foregrounds against one background, analysing the background only once
+
+    :param foreground_imgs: list of ndimage 4 channel arrays
+    :param background_img: ndimage
+    :param method: 'RGB', 'LAB', 'HSV', 'SAT' or 'SATVAL'
+    :param cache: optional BackgroundStatsCache
+    :param key: key identifying the background in the cache, i.e. its path
+    :return: list of PIL RGBA images
+    """
+    assert method in METHOD_SPACES, 'unknown matching method {}'.format(method)
+    space = METHOD_SPACES[method]
+
+    if cache is None:
+        stats = background_stats(background_img, space)
+    else:
+        stats = cache.stats(background_img, space, key)
+
+    return [match_with_stats(foreground_img, stats, method) for foreground_img in foreground_imgs]
+
+
+class SequenceMatcher:
+    def __init__(self, method, refresh=1):
+        """Histogram matching for the frames of a sequence against the same (panned) background
+
+        The background statistics are computed from the first frame's background and kept for the whole sequence.
+        The matching curves are recomputed every refresh frames and reused in between, so a frame in between costs
+        one lookup per pixel.
+
+        :param method: 'RGB', 'LAB', 'HSV', 'SAT' or 'SATVAL'
+        :param refresh: frames between recomputing the matching curves, 1 recomputes them for every frame
+        """
+        assert method in METHOD_SPACES, 'unknown matching method {}'.format(method)
+        assert refresh >= 1, 'refresh must be at least 1, not {}'.format(refresh)
+        self.method = method
+        self.refresh = refresh
+        self.stats = None
+        self.curves = None
+        self.frames = 0
+
+    def match(self, foreground_img, background_img):
+        """Match the next frame's foreground, see match_background
+
+        :return: PIL RGBA image
+        """
+        foreground_img = as_ndarray(foreground_img)
+        if self.stats is None:
+            self.stats = background_stats(background_img, METHOD_SPACES[self.method])
+        if self.frames % self.refresh == 0:
+            self.curves = matching_curves(foreground_img, self.stats, self.method)
+        self.frames += 1
+
+        return apply_curves(foreground_img, self.curves, self.method)
@@ -0,0 +1,124 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import random
+import shutil
+import numpy as np
+
+from pycocotools import mask as mask_utils
+from pycocotools.coco import COCO
+
+IMAGE_DTYPE = np.dtype([('id', np.int64), ('height', np.int32), ('width', np.int32), ('first', np.int64),
+                        ('count', np.int32), ('file_name', 'S64')])
+
+
+def rle_counts(coco, annotation):
+    """Compressed RLE counts string of an annotation (polygon, RLE, or crowd RLE)"""
+    counts = coco.annToRLE(annotation)['counts']
+    if not isinstance(counts, bytes):
+        counts = counts.encode('ascii')
+
+    return counts
+
+
+def build_index(coco_json, out_path, exclude_cat_ids=(1,)):
+    """Write a compact, memory mappable index of images without the excluded categories that have annotations
+
+    The index is a directory of three .npy files: one IMAGE_DTYPE record per image, the offset of each annotation's
+    RLE counts, and all RLE counts concatenated into one byte array. It is written to a temporary directory renamed
+    into place, so an interrupted build leaves no index behind.
+
+    :param coco_json: path to coco instances json
+    :param out_path: directory to write the index to
+    :param exclude_cat_ids: skip images containing any of these categories (1 is person)
+    :return: number of images indexed
+    """
+    assert coco_json is not None and os.path.exists(coco_json), 'coco json {} not found'.format(coco_json)
+    coco = COCO(coco_json)
+    excluded = set(coco.getImgIds(catIds=list(exclude_cat_ids))) if exclude_cat_ids else set()
+    image_ids = sorted(set(coco.getImgIds()) - excluded)
+
+    images = []
+    offsets = [0]
+    counts = []
+    for image_id in image_ids:
+        annotation_ids = coco.getAnnIds(imgIds=image_id)
+        if len(annotation_ids) == 0:
+            continue
+
+        info = coco.loadImgs(ids=image_id)[0]
+        assert len(info['file_name']) <= IMAGE_DTYPE['file_name'].itemsize, \
+            'file name {} longer than the index holds'.format(info['file_name'])
+        images.append((image_id, info['height'], info['width'], len(offsets) - 1, len(annotation_ids),
+                       info['file_name'].encode('ascii')))
+        for annotation in coco.loadAnns(annotation_ids):
+            rle = rle_counts(coco, annotation)
+            counts.append(rle)
+            offsets.append(offsets[-1] + len(rle))
+
+    assert len(images) > 0, 'no images to index in {}'.format(coco_json)
+
+    tmp_path = '{}.{}.tmp'.format(out_path.rstrip(os.sep), os.getpid())
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, 'images.npy'), np.array(images, dtype=IMAGE_DTYPE))
+    np.save(os.path.join(tmp_path, 'offsets.npy'), np.array(offsets, dtype=np.int64))
+    np.save(os.path.join(tmp_path, 'counts.npy'), np.frombuffer(b''.join(counts), dtype=np.uint8))
+
+    if os.path.exists(out_path):
+        shutil.rmtree(out_path)
+    os.rename(tmp_path, out_path)
+
+    return len(images)
+
+
+class OccluderIndex:
+    def __init__(self, index_path):
+        """Memory mapped occluder masks written by build_index
+
+        :param index_path: directory containing the index
+        """
+        self.images = np.load(os.path.join(index_path, 'images.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(index_path, 'offsets.npy'), mmap_mode='r')
+        self.counts = np.load(os.path.join(index_path, 'counts.npy'), mmap_mode='r')
+        assert len(self.images) > 0, 'occluder index {} is empty'.format(index_path)
+
+    def __len__(self):
+        return len(self.images)
+
+    def image_info(self, image_index):
+        """Return (image id, file name) of an indexed image"""
+        image = self.images[image_index]
+
+        return int(image['id']), image['file_name'].decode('ascii')
+
+    def decode(self, image_index, annotation_number):
+        """Decode a single annotation of an indexed image into an (H, W) uint8 mask of ones and zeros"""
+        image = self.images[image_index]
+        assert 0 <= annotation_number < image['count'], 'image {} has {} annotations'.format(image['id'],
+                                                                                              image['count'])
+        annotation = int(image['first']) + annotation_number
+        counts = self.counts[self.offsets[annotation]:self.offsets[annotation + 1]].tobytes()
+        rle = {'size': [int(image['height']), int(image['width'])], 'counts': counts}
+
+        return mask_utils.decode(rle)
+
+    def random_mask(self, randomize=True, rng=random):
+        """Pick a random image and return one random annotation mask, or with randomize False the sum of all of them
+
+        :param randomize: return a single random annotation instead of all annotations of the image
+        :param rng: random number generator with randrange, defaults to the random module
+        :return: tuple of mask, image id, and image file name
+        """
+        image_index = rng.randrange(len(self.images))
+        count = int(self.images[image_index]['count'])
+
+        if randomize:
+            mask = self.decode(image_index, rng.randrange(count))
+        else:
+            mask = np.sum([self.decode(image_index, i) for i in range(count)], axis=0)
+
+        image_id, file_name = self.image_info(image_index)
+
+        return mask, image_id, file_name
@@ -0,0 +1,149 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import json
+import bisect
+import numpy as np
+
+# opened archives keyed by (path, index mtime), so pose references only read an archive's index once per process
+_archives = {}
+
+
+class PoseArchive:
+    def __init__(self, path):
+        """Joint rotations of whole mocap clips in one float32 array file with a json index
+
+        path + '.f32' holds one row of bones x (w, x, y, z) quaternions per frame, clip after clip. path + '.json' lists
+        the bone names and, per clip, its first row, number of frames and first frame number. Clips are appended whole
+        and the index is replaced after the rows are written, so an interrupted append leaves the archive as it was.
+
+        :param path: archive path without extension, created on first append
+        """
+        self.path = path
+        self.data_path = path + '.f32'
+        self.index_path = path + '.json'
+        self.bones = None
+        self.clips = {}
+        self.rows = 0
+        self.data = None
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+            self.bones = index['bones']
+            self.clips = index['clips']
+            self.rows = sum(clip['frames'] for clip in self.clips.values())
+
+        # clip names in row order and their first rows, for reference()
+        self.order = sorted(self.clips, key=lambda name: self.clips[name]['row'])
+        self.starts = [self.clips[name]['row'] for name in self.order]
+
+    def append(self, clip, rotations, bones, frame_start=1):
+        """Add all frames of a clip, replacing nothing: a clip name can only be added once
+
+        :param clip: clip name, i.e. the mocap file name without extension
+        :param rotations: (frames, bones, 4) array of bone rotation quaternions
+        :param bones: bone names in the order of rotations' second axis, the same for every clip
+        :param frame_start: frame number of the first frame
+        """
+        rotations = np.ascontiguousarray(rotations, dtype=np.float32)
+        assert clip not in self.clips, 'clip {} already in {}'.format(clip, self.path)
+        assert rotations.ndim == 3 and rotations.shape[1:] == (len(bones), 4) and len(rotations) > 0, \
+            'expected (frames, {}, 4) rotations, got {}'.format(len(bones), rotations.shape)
+        if self.bones is None:
+            self.bones = list(bones)
+        assert list(bones) == self.bones, 'bones of {} do not match the archive'.format(clip)
+
+        with open(self.data_path, 'ab') as f:
+            # drop rows of an append the index never recorded
+            f.truncate(self.rows * len(self.bones) * 4 * 4)
+            f.write(rotations.tobytes())
+
+        self.clips[clip] = {'row': self.rows, 'frames': len(rotations), 'frame_start': frame_start}
+        self.order.append(clip)
+        self.starts.append(self.rows)
+        self.rows += len(rotations)
+        self.data = None
+
+        tmp_path = '{}.{}.tmp'.format(self.index_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump({'bones': self.bones, 'clips': self.clips}, f, sort_keys=True)
+        os.rename(tmp_path, self.index_path)
+
+    def array(self):
+        """Read only (rows, bones, 4) memory map of every frame in the archive"""
+        if self.data is None:
+            self.data = np.memmap(self.data_path, dtype=np.float32, mode='r', shape=(self.rows, len(self.bones), 4))
+
+        return self.data
+
+    def clip(self, name):
+        """(frames, bones, 4) rotations of a clip"""
+        assert name in self.clips, 'no clip {} in {}'.format(name, self.path)
+        clip = self.clips[name]
+
+        return self.array()[clip['row']:clip['row'] + clip['frames']]
+
+    def frame(self, name, frame):
+        """(bones, 4) rotations of frame number frame of a clip"""
+        clip = self.clips[name]
+        assert 0 <= frame - clip['frame_start'] < clip['frames'], 'no frame {} in clip {}'.format(frame, name)
+
+        return self.clip(name)[frame - clip['frame_start']]
+
+    def reference(self, row):
+        """Pose reference string of a row, for descriptors, see read_pose"""
+        assert 0 <= row < self.rows, 'row {} of {}'.format(row, self.rows)
+        name = self.order[bisect.bisect_right(self.starts, row) - 1]
+        clip = self.clips[name]
+
+        return pose_reference(self.path, name, clip['frame_start'] + row - clip['row'])
+
+    def __contains__(self, clip):
+        return clip in self.clips
+
+    def __len__(self):
+        return self.rows
+
+
+class PoseReferences:
+    def __init__(self, archive):
+        """Every frame of an archive as a sequence of pose references, made on access
+
+        Stands in for the list of pose json paths in sim_info, random.choice and indexing work the same.
+        """
+        self.archive = archive
+
+    def __len__(self):
+        return len(self.archive)
+
+    def __getitem__(self, row):
+        return self.archive.reference(row)
+
+
+def pose_reference(path, clip, frame):
+    return '{}#{}#{}'.format(path, clip, frame)
+
+
+def is_pose_reference(pose):
+    """True for an archive pose reference, False for the path of a pose json"""
+    return pose.count('#') >= 2 and not pose.endswith('.json')
+
+
+def open_archive(path):
+    """PoseArchive of path, reused while its index does not change"""
+    key = (path, os.stat(path + '.json').st_mtime)
+    if key not in _archives:
+        _archives[key] = PoseArchive(path)
+
+    return _archives[key]
+
+
+def read_pose(reference):
+    """Bone names and (bones, 4) rotations of a pose reference"""
+    path, clip, frame = reference.rsplit('#', 2)
+    archive = open_archive(path)
+
+    return archive.bones, np.array(archive.frame(clip, int(frame)))
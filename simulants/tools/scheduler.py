@@ -0,0 +1,355 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import json
+import time
+import argparse
+import sqlite3
+import threading
+import subprocess
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    command TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    not_before REAL NOT NULL DEFAULT 0,
+    pid INTEGER,
+    started REAL,
+    finished REAL,
+    duration REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, kind, not_before);
+CREATE TABLE IF NOT EXISTS dependencies (
+    job TEXT NOT NULL,
+    depends_on TEXT NOT NULL,
+    PRIMARY KEY (job, depends_on)
+);
+CREATE INDEX IF NOT EXISTS dependencies_depends_on ON dependencies (depends_on);
+"""
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+
+    return True
+
+
+class JobQueue:
+    def __init__(self, db_path, backoff=30.0):
+        """Durable job queue in a local SQLite database
+
+        Jobs are commands with an id, a kind (i.e. 'render', 'composite'), a state, and optional dependencies on other
+        jobs; a job only becomes ready once everything it depends on has been added and is done. Failed jobs are
+        retried after an exponential backoff until they run out of attempts, and permanent failures fail their
+        dependents too. Adding a job again leaves a failed job failed, retry_failed puts failed jobs back.
+
+        SQLite locking is unreliable on network file systems, keep the database on a local disk.
+
+        :param db_path: path of the database, created if it does not exist
+        :param backoff: seconds to wait before the first retry, doubled for every further attempt
+        """
+        self.db_path = db_path
+        self.backoff = backoff
+        self.db = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    def add(self, job_id, command, kind, depends_on=(), max_attempts=3, done=False):
+        """Add a job, jobs that already exist are left as they are so a work list can be added again to resume
+
+        :param job_id: unique id of the job
+        :param command: argument list to run
+        :param kind: kind of job, runners pick up jobs by kind
+        :param depends_on: ids of jobs that have to be done first
+        :param max_attempts: number of times to try the job before it fails
+        :param done: add the job as already done, i.e. when its output exists from an earlier run
+        """
+        self.add_many([(job_id, command, kind, depends_on, max_attempts, done)])
+
+    def add_many(self, jobs):
+        """Add (job_id, command, kind, depends_on, max_attempts, done) tuples in one transaction"""
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            for job_id, command, kind, depends_on, max_attempts, done in jobs:
+                self.db.execute('INSERT OR IGNORE INTO jobs (id, kind, command, state, max_attempts) '
+                                'VALUES (?, ?, ?, ?, ?)',
+                                (job_id, kind, json.dumps(command), DONE if done else PENDING, max_attempts))
+                self.db.executemany('INSERT OR IGNORE INTO dependencies (job, depends_on) VALUES (?, ?)',
+                                    [(job_id, d) for d in depends_on])
+            self._fail_dependents()
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+
+    def _fail_dependents(self):
+        """Fail pending jobs depending on a failed job, i.e. added after it failed, within the current transaction"""
+        while True:
+            failed = self.db.execute(
+                'UPDATE jobs SET state = ?, error = (SELECT \'dependency \' || d.depends_on || \' failed\''
+                '                                    FROM dependencies d JOIN jobs j ON j.id = d.depends_on'
+                '                                    WHERE d.job = jobs.id AND j.state = ? LIMIT 1)'
+                ' WHERE state = ? AND EXISTS (SELECT 1 FROM dependencies d JOIN jobs j ON j.id = d.depends_on'
+                '                             WHERE d.job = jobs.id AND j.state = ?)',
+                (FAILED, FAILED, PENDING, FAILED)).rowcount
+            # repeat for jobs depending on the ones just failed
+            if failed == 0:
+                break
+
+    def has(self, job_id):
+        return self.db.execute('SELECT 1 FROM jobs WHERE id = ?', (job_id,)).fetchone() is not None
+
+    def requeue_orphans(self):
+        """Put running jobs whose runner process is gone back to pending, i.e. after a crash or a kill"""
+        orphans = [job_id for job_id, pid in self.db.execute('SELECT id, pid FROM jobs WHERE state = ?', (RUNNING,))
+                   if pid is None or not pid_alive(pid)]
+        self.db.executemany('UPDATE jobs SET state = ?, pid = NULL WHERE id = ? AND state = ?',
+                            [(PENDING, job_id, RUNNING) for job_id in orphans])
+
+        return len(orphans)
+
+    def retry_failed(self, kinds=None):
+        """Put failed jobs back to pending with all their attempts, i.e. after fixing what made them fail
+
+        Jobs that failed because a job they depend on failed are put back too, dependents of jobs that stay failed
+        (i.e. of another kind) fail again.
+
+        :param kinds: only retry jobs of these kinds, None for any
+        :return: number of jobs put back to pending
+        """
+        kind_sql, kind_args = self._kind_filter(kinds)
+
+        count_pending = 'SELECT COUNT(*) FROM jobs WHERE state = ?'
+
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            pending = self.db.execute(count_pending, (PENDING,)).fetchone()[0]
+            retry = [row[0] for row in self.db.execute(
+                'WITH RECURSIVE retry(id) AS ('
+                '    SELECT id FROM jobs WHERE state = ?' + kind_sql +
+                '    UNION SELECT d.job FROM dependencies d JOIN retry ON d.depends_on = retry.id)'
+                ' SELECT id FROM jobs WHERE id IN retry AND state = ?', (FAILED,) + kind_args + (FAILED,))]
+            self.db.executemany('UPDATE jobs SET state = ?, attempts = 0, not_before = 0, pid = NULL, error = NULL '
+                                'WHERE id = ?', [(PENDING, job_id) for job_id in retry])
+            self._fail_dependents()
+            retried = self.db.execute(count_pending, (PENDING,)).fetchone()[0] - pending
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+
+        return retried
+
+    def _kind_filter(self, kinds):
+        if kinds is None:
+            return '', ()
+
+        return ' AND kind IN ({})'.format(', '.join('?' * len(kinds))), tuple(kinds)
+
+    def claim(self, kinds=None):
+        """Atomically mark the next ready job as running
+
+        :param kinds: only claim jobs of these kinds, None for any
+        :return: tuple of job id and command, or None if no job is ready
+        """
+        kind_sql, kind_args = self._kind_filter(kinds)
+        now = time.time()
+
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            self._fail_dependents()
+            row = self.db.execute(
+                'SELECT id, command FROM jobs WHERE state = ? AND not_before <= ?' + kind_sql +
+                ' AND NOT EXISTS (SELECT 1 FROM dependencies d LEFT JOIN jobs j ON j.id = d.depends_on'
+                '                 WHERE d.job = jobs.id AND (j.state IS NULL OR j.state != ?))'
+                ' ORDER BY not_before, rowid LIMIT 1', (PENDING, now) + kind_args + (DONE,)).fetchone()
+            if row is not None:
+                self.db.execute('UPDATE jobs SET state = ?, pid = ?, started = ?, attempts = attempts + 1 '
+                                'WHERE id = ?', (RUNNING, os.getpid(), now, row[0]))
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+
+        if row is None:
+            return None
+
+        return row[0], json.loads(row[1])
+
+    def succeed(self, job_id):
+        now = time.time()
+        self.db.execute('UPDATE jobs SET state = ?, pid = NULL, finished = ?, duration = ? - started, error = NULL '
+                        'WHERE id = ?', (DONE, now, now, job_id))
+
+    def fail(self, job_id, error):
+        """Schedule a retry with backoff, or fail the job and everything depending on it when out of attempts
+
+        :return: True if the job will be retried
+        """
+        now = time.time()
+        attempts, max_attempts = self.db.execute('SELECT attempts, max_attempts FROM jobs WHERE id = ?',
+                                                 (job_id,)).fetchone()
+        retry = attempts < max_attempts
+
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            self.db.execute('UPDATE jobs SET state = ?, pid = NULL, finished = ?, duration = ? - started, error = ?, '
+                            'not_before = ? WHERE id = ?',
+                            (PENDING if retry else FAILED, now, now, str(error),
+                             now + self.backoff * 2 ** (attempts - 1), job_id))
+            if not retry:
+                self.db.execute(
+                    'WITH RECURSIVE dependents(id) AS ('
+                    '    SELECT job FROM dependencies WHERE depends_on = ?'
+                    '    UNION SELECT d.job FROM dependencies d JOIN dependents ON d.depends_on = dependents.id)'
+                    ' UPDATE jobs SET state = ?, error = ? WHERE id IN dependents AND state = ?',
+                    (job_id, FAILED, 'dependency {} failed'.format(job_id), PENDING))
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+
+        return retry
+
+    def unfinished(self, kinds=None):
+        """Number of pending or running jobs"""
+        kind_sql, kind_args = self._kind_filter(kinds)
+
+        return self.db.execute('SELECT COUNT(*) FROM jobs WHERE state IN (?, ?)' + kind_sql,
+                               (PENDING, RUNNING) + kind_args).fetchone()[0]
+
+    def waiting(self, kinds=None):
+        """Number of pending jobs that can still become ready: every job they depend on has been added and not failed"""
+        kind_sql, kind_args = self._kind_filter(kinds)
+
+        return self.db.execute(
+            'SELECT COUNT(*) FROM jobs WHERE state = ?' + kind_sql +
+            ' AND NOT EXISTS (SELECT 1 FROM dependencies d LEFT JOIN jobs j ON j.id = d.depends_on'
+            '                 WHERE d.job = jobs.id AND (j.state IS NULL OR j.state = ?))',
+            (PENDING,) + kind_args + (FAILED,)).fetchone()[0]
+
+    def running(self, kinds=None):
+        """Number of running jobs"""
+        kind_sql, kind_args = self._kind_filter(kinds)
+
+        return self.db.execute('SELECT COUNT(*) FROM jobs WHERE state = ?' + kind_sql,
+                               (RUNNING,) + kind_args).fetchone()[0]
+
+    def summary(self):
+        """Dict of kind to dict of state counts and mean duration of done jobs"""
+        summary = {}
+        for kind, state, count, duration in self.db.execute(
+                'SELECT kind, state, COUNT(*), AVG(duration) FROM jobs GROUP BY kind, state'):
+            summary.setdefault(kind, {})[state] = count
+            if state == DONE:
+                summary[kind]['mean_duration'] = duration
+
+        return summary
+
+    def close(self):
+        self.db.close()
+
+
+def run(db_path, kinds=None, workers=1, poll=1.0, backoff=30.0, on_error=None, execute=subprocess.check_call,
+        blocked_timeout=60.0):
+    """Run jobs with a fixed number of worker threads, each starting the next ready job as soon as its last one ends
+
+    Workers stop once no job of the given kinds is pending or running. Jobs that wait on another runner's work (i.e.
+    composites waiting on renders) are checked for every poll seconds, which only queries the local database. Jobs
+    depending on a job that was never added can not run; workers also stop when only such jobs are left and no job
+    of any kind has been running for blocked_timeout seconds.
+
+    :param db_path: path of the job database
+    :param kinds: only run jobs of these kinds, None for any
+    :param workers: number of jobs to run at once
+    :param poll: seconds to wait when no job is ready yet
+    :param backoff: seconds before the first retry of a failed job, see JobQueue
+    :param on_error: optional function called with job id, command and exception of every failed attempt
+    :param execute: function running a job's command and raising on failure, i.e. BlenderPool.check_call
+    :param blocked_timeout: seconds to wait for missing dependencies to be added, i.e. by another runner
+    """
+    queue = JobQueue(db_path)
+    requeued = queue.requeue_orphans()
+    if requeued > 0:
+        print('requeued {} jobs left running by a previous run'.format(requeued))
+    queue.close()
+
+    def worker():
+        queue = JobQueue(db_path, backoff)
+        blocked_since = None
+        while True:
+            job = queue.claim(kinds)
+            if job is None:
+                unfinished = queue.unfinished(kinds)
+                if unfinished == 0:
+                    break
+                if queue.waiting(kinds) > 0 or queue.running() > 0:
+                    blocked_since = None
+                elif blocked_since is None:
+                    blocked_since = time.time()
+                elif time.time() - blocked_since > blocked_timeout:
+                    print('stopping with {} jobs blocked on missing dependencies'.format(unfinished))
+                    break
+                time.sleep(poll)
+                continue
+
+            blocked_since = None
+
+            job_id, command = job
+            try:
+                execute(command)
+                queue.succeed(job_id)
+            except Exception as e:
+                retry = queue.fail(job_id, e)
+                print('{} failed{}: {}'.format(job_id, ', will retry' if retry else '', e))
+                if on_error is not None:
+                    on_error(job_id, command, e)
+        queue.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        # join with a timeout so KeyboardInterrupt still reaches the main thread
+        while thread.is_alive():
+            thread.join(1.0)
+
+
+def print_summary(db_path):
+    queue = JobQueue(db_path)
+    for kind, states in sorted(queue.summary().items()):
+        counts = ' '.join('{}: {}'.format(state, states.get(state, 0)) for state in (DONE, RUNNING, PENDING, FAILED))
+        mean = states.get('mean_duration')
+        print('{} {}{}'.format(kind, counts, '' if mean is None else ' mean: {:.1f}s'.format(mean)))
+    queue.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('db', type=str, nargs='?', help='path of the job database', default='jobs.db')
+    parser.add_argument('--retry_failed', '--retry-failed', action='store_true',
+                        help='put failed jobs and their failed dependents back to pending before the summary')
+    parser.add_argument('--kinds', type=str, nargs='+', help='only retry jobs of these kinds', default=None)
+    args = parser.parse_args()
+
+    if args.retry_failed:
+        queue = JobQueue(args.db)
+        print('retrying {} failed jobs'.format(queue.retry_failed(args.kinds)))
+        queue.close()
+    print_summary(args.db)
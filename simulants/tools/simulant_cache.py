@@ -0,0 +1,177 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+
+# Descriptor fields baked into a simulant blend; ids, paths, location and render layers are set per scene
+GEOMETRY_FIELDS = ['base_mesh', 'skin', 'eye', 'traits', 'randomize', 'pose', 'rotation', 'hair', 'shirt', 'pants']
+IGNORED_KEYS = ['id', 'render_layer']
+
+
+def canonical(descriptor):
+    """The part of a simulant descriptor that determines the built blend"""
+    fields = {}
+    for field in GEOMETRY_FIELDS:
+        value = descriptor[field]
+        if isinstance(value, dict):
+            value = dict((k, v) for k, v in value.items() if k not in IGNORED_KEYS)
+        fields[field] = value
+
+    return fields
+
+
+def descriptor_key(descriptor, variant=''):
+    """Hash of the canonical descriptor fields, identical simulants get the same key whatever their id
+
+    :param descriptor: simulant descriptor dict
+    :param variant: name of the build procedure, blends built differently from the same descriptor need different keys
+    :return: hex sha1
+    """
+    content = json.dumps({'variant': variant, 'fields': canonical(descriptor)}, sort_keys=True)
+
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class SimulantCache:
+    def __init__(self, cache_dir, max_bytes=None):
+        """Content addressed store of built simulant blends with a json manifest
+
+        Blends are stored as <key>.blend under cache_dir. The manifest records the simulant id each blend was built
+        with (its object name suffix), its size, when it was last used and the output paths it was copied to.
+        Manifest updates hold an exclusive lock so several workers can share a cache.
+
+        :param cache_dir: cache directory, created if it does not exist
+        :param max_bytes: least recently used blends are evicted to keep the cache below this size, None for no limit
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.manifest_path = os.path.join(cache_dir, 'manifest.json')
+
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def blend_path(self, key):
+        return os.path.join(self.cache_dir, key + '.blend')
+
+    def read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    def update_manifest(self, update):
+        """Apply update(manifest) to the manifest under an exclusive lock and write it back, return update's result"""
+        with open(os.path.join(self.cache_dir, 'manifest.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            manifest = self.read_manifest()
+            result = update(manifest)
+
+            tmp_path = '{}.{}.tmp'.format(self.manifest_path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+            os.rename(tmp_path, self.manifest_path)
+
+        return result
+
+    def lookup(self, descriptor, variant=''):
+        """Manifest entry of the blend built from an identical descriptor, marked as used, or None"""
+        key = descriptor_key(descriptor, variant)
+
+        def touch(manifest):
+            entry = manifest.get(key)
+            if entry is None or not os.path.exists(self.blend_path(key)):
+                manifest.pop(key, None)
+                return None
+            entry['last_used'] = time.time()
+            return dict(entry, key=key)
+
+        return self.update_manifest(touch)
+
+    def up_to_date(self, descriptor, variant=''):
+        """True if descriptor['path'] holds the blend cached for this descriptor, without touching Blender"""
+        entry = self.read_manifest().get(descriptor_key(descriptor, variant))
+        path = os.path.abspath(descriptor['path'])
+        if entry is None or path not in entry['outputs'] or not os.path.exists(path):
+            return False
+
+        return entry['outputs'][path] == os.stat(path).st_mtime
+
+    def add(self, descriptor, variant=''):
+        """Store the blend just built at descriptor['path'], then evict down to max_bytes
+
+        :return: cache key
+        """
+        key = descriptor_key(descriptor, variant)
+        blend = self.blend_path(key)
+        tmp_path = '{}.{}.tmp'.format(blend, os.getpid())
+        shutil.copyfile(descriptor['path'], tmp_path)
+        os.rename(tmp_path, blend)
+
+        def insert(manifest):
+            manifest[key] = {'built_id': descriptor['id'], 'variant': variant, 'size': os.path.getsize(blend),
+                             'last_used': time.time(), 'outputs': {}}
+            self.evict(manifest, keep=key)
+
+        self.update_manifest(insert)
+        self.record_output(descriptor, variant)
+
+        return key
+
+    def materialize(self, entry, path):
+        """Hard link (or copy) a cached blend to path, for a descriptor with the same id it was built with"""
+        if os.path.exists(path):
+            os.remove(path)
+        try:
+            os.link(self.blend_path(entry['key']), path)
+        except OSError:
+            shutil.copyfile(self.blend_path(entry['key']), path)
+
+    def record_output(self, descriptor, variant=''):
+        """Remember that descriptor['path'] now holds this descriptor's blend, see up_to_date"""
+        key = descriptor_key(descriptor, variant)
+        path = os.path.abspath(descriptor['path'])
+
+        def record(manifest):
+            if key in manifest:
+                manifest[key]['outputs'][path] = os.stat(path).st_mtime
+
+        self.update_manifest(record)
+
+    def evict(self, manifest, keep=None):
+        """Remove least recently used blends from manifest and disk until the cache fits in max_bytes"""
+        if self.max_bytes is None:
+            return
+
+        total = sum(entry['size'] for entry in manifest.values())
+        for key in sorted(manifest, key=lambda k: manifest[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= manifest.pop(key)['size']
+            if os.path.exists(self.blend_path(key)):
+                os.remove(self.blend_path(key))
+
+    def plan(self, descriptors, variant=''):
+        """Group descriptors by cache key, deduplicating identical simulants
+
+        :return: list of (key, descriptors) in first appearance order; the first descriptor of a group is the one
+                 to build if the key is not cached, the others can be made from its blend
+        """
+        groups = {}
+        order = []
+        for descriptor in descriptors:
+            key = descriptor_key(descriptor, variant)
+            if key not in groups:
+                groups[key] = []
+                order.append(key)
+            groups[key].append(descriptor)
+
+        return [(key, groups[key]) for key in order]
@@ -0,0 +1,220 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+import traceback
+import subprocess
+
+from argparse import ArgumentParser
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'bin', 'blender',
+                             'warm_worker.py')
+
+
+class Spool:
+    def __init__(self, path):
+        """Spool directory handing jobs from an orchestrator to long lived workers on the same machine
+
+        Jobs are json files moved between queue/, running/ and done/ with os.rename, which is atomic on a local file
+        system, so any number of workers can claim from the same queue.
+
+        :param path: spool directory, created if it does not exist
+        """
+        self.path = path
+        self.queue = os.path.join(path, 'queue')
+        self.running = os.path.join(path, 'running')
+        self.done = os.path.join(path, 'done')
+
+        for directory in (self.queue, self.running, self.done):
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+
+    def _write(self, directory, name, content):
+        tmp_path = os.path.join(self.path, '.{}.tmp'.format(uuid.uuid4().hex))
+        with open(tmp_path, 'w') as f:
+            json.dump(content, f)
+        os.rename(tmp_path, os.path.join(directory, name))
+
+    def submit(self, task, argv):
+        """Queue a job, jobs are claimed in submission order
+
+        :param task: name of the task a worker should run, i.e. 'make_a_simulant'
+        :param argv: list of arguments for the task
+        :return: job id
+        """
+        job_id = '{:017.6f}-{}'.format(time.time(), uuid.uuid4().hex[:8])
+        self._write(self.queue, job_id + '.json', {'id': job_id, 'task': task, 'argv': argv})
+
+        return job_id
+
+    def claim(self, worker_id):
+        """Move the oldest queued job to running/ for this worker, return it or None if the queue is empty"""
+        for name in sorted(os.listdir(self.queue)):
+            running_path = os.path.join(self.running, '{}__{}'.format(worker_id, name))
+            try:
+                os.rename(os.path.join(self.queue, name), running_path)
+            except OSError:
+                # another worker claimed it first
+                continue
+            with open(running_path) as f:
+                return json.load(f)
+
+        return None
+
+    def complete(self, job, worker_id, error=None, duration=None):
+        """Publish the result of a job and remove it from running/"""
+        self._write(self.done, job['id'] + '.json', {'id': job['id'], 'task': job['task'], 'worker': worker_id,
+                                                     'error': error, 'duration': duration})
+        os.remove(os.path.join(self.running, '{}__{}.json'.format(worker_id, job['id'])))
+
+    def result(self, job_id):
+        """Result dict of a finished job, removing it from the spool, or None if it is not finished"""
+        done_path = os.path.join(self.done, job_id + '.json')
+        if not os.path.exists(done_path):
+            return None
+
+        with open(done_path) as f:
+            result = json.load(f)
+        os.remove(done_path)
+
+        return result
+
+    def fail_running(self, worker_id, error):
+        """Complete every job a worker had claimed with an error, i.e. after the worker crashed"""
+        prefix = '{}__'.format(worker_id)
+        for name in os.listdir(self.running):
+            if name.startswith(prefix):
+                with open(os.path.join(self.running, name)) as f:
+                    self.complete(json.load(f), worker_id, error)
+
+    def stop_path(self):
+        return os.path.join(self.path, 'stop')
+
+    def stop(self):
+        open(self.stop_path(), 'w').close()
+
+    def stopped(self):
+        return os.path.exists(self.stop_path())
+
+
+def serve(spool, handle, worker_id, poll=0.05):
+    """Worker loop, run claimed jobs with handle(task, argv) until the spool is stopped
+
+    :param spool: Spool to take jobs from
+    :param handle: function called with the task name and argv list of every job, exceptions fail the job
+    :param worker_id: unique id of this worker
+    :param poll: seconds to wait when the queue is empty
+    """
+    while not spool.stopped():
+        job = spool.claim(worker_id)
+        if job is None:
+            time.sleep(poll)
+            continue
+
+        start = time.time()
+        try:
+            handle(job['task'], job['argv'])
+            error = None
+        except (Exception, SystemExit):
+            # argparse exits on bad arguments, that should fail the job rather than end the worker
+            error = traceback.format_exc()
+            print(error)
+        spool.complete(job, worker_id, error, time.time() - start)
+
+
+def blender_task(command):
+    """Split a 'blender -b -P script.py -- args' command into task name (the script's name) and argv"""
+    script = command[command.index('-P') + 1]
+    argv = command[command.index('--') + 1:] if '--' in command else []
+
+    return os.path.splitext(os.path.basename(script))[0], argv
+
+
+class BlenderPool:
+    def __init__(self, spool_path, workers=1, command=None, poll=0.05):
+        """Orchestrator running jobs on warm workers that keep Blender and the add-ons loaded between jobs
+
+        :param spool_path: spool directory shared with the workers, keep it on a local disk
+        :param workers: number of worker processes
+        :param command: worker command, with {spool} and {worker_id} placeholders; defaults to a background Blender
+                        running bin/blender/warm_worker.py, stub_command() gives a worker that needs no Blender
+        :param poll: seconds between checks for a finished job
+        """
+        self.spool = Spool(spool_path)
+        self.workers = workers
+        self.command = command or ['blender', '-b', '-P', WORKER_SCRIPT, '--',
+                                   '--spool', '{spool}', '--worker_id', '{worker_id}']
+        self.poll = poll
+        self.processes = {}
+        self.lock = threading.Lock()
+
+    def start_worker(self, worker_id):
+        command = [part.format(spool=self.spool.path, worker_id=worker_id) for part in self.command]
+        self.processes[worker_id] = subprocess.Popen(command)
+
+    def start(self):
+        if self.spool.stopped():
+            os.remove(self.spool.stop_path())
+        for i in range(self.workers):
+            self.start_worker('worker{}'.format(i))
+
+    def check_workers(self):
+        """Fail the jobs of workers that exited and start replacements"""
+        with self.lock:
+            for worker_id, process in self.processes.items():
+                if process.poll() is not None:
+                    self.spool.fail_running(worker_id, 'worker exited with code {}'.format(process.returncode))
+                    self.start_worker(worker_id)
+
+    def call(self, task, argv):
+        """Run a task on a worker and wait for it, thread safe
+
+        :return: result dict with error set to a traceback if the job failed
+        """
+        job_id = self.spool.submit(task, argv)
+        while True:
+            result = self.spool.result(job_id)
+            if result is not None:
+                return result
+            self.check_workers()
+            time.sleep(self.poll)
+
+    def check_call(self, command):
+        """Drop in for subprocess.check_call of a 'blender -b -P script.py -- args' command"""
+        result = self.call(*blender_task(command))
+        if result['error'] is not None:
+            raise subprocess.CalledProcessError(1, command, result['error'])
+
+    def close(self):
+        self.spool.stop()
+        for process in self.processes.values():
+            process.wait()
+        self.processes = {}
+
+
+def stub_command():
+    """Worker command for a python stub worker, to exercise a BlenderPool without Blender"""
+    return [sys.executable, '-m', 'simulants.tools.spool', '--spool', '{spool}', '--worker_id', '{worker_id}']
+
+
+def stub_handle(task, argv):
+    """Pretend to run a task, failing it if its argv contains 'fail' and exiting the worker on 'crash'"""
+    print('{} {}'.format(task, ' '.join(argv)))
+    if 'crash' in argv:
+        os._exit(1)
+    assert 'fail' not in argv, 'stub failure'
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--spool', type=str, help='spool directory', required=True)
+    parser.add_argument('--worker_id', type=str, help='unique id of this worker', required=True)
+    args = parser.parse_args()
+
+    serve(Spool(args.spool), stub_handle, args.worker_id)
@@ -0,0 +1,108 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import numpy as np
+
+from PIL import Image
+from simulants import exr_io
+from simulants.tools.cache import LRUCache
+
+
+def file_key(path):
+    """Cache key of a file that changes if the file is rewritten"""
+    return os.path.abspath(path), os.stat(path).st_mtime
+
+
+def read_uv(uv_path):
+    """Read normalized UV coordinates from a 32 bit EXR UV render
+
+    :param uv_path: path to EXR UV render
+    :return: (2, H, W) float32 array of u (R) and v (G) coordinates
+    """
+    uv = exr_io.read_channels(uv_path, ('R', 'G'))
+
+    return uv
+
+
+def read_texture(texture_path):
+    """Read texture as (rows * cols + 1, 3) uint8 array of pixels ending in one black pixel for out of range lookups
+
+    :param texture_path: path to a texture image
+    :return: tuple of flattened pixels and (rows, cols) texture shape
+    """
+    texture = np.asarray(Image.open(texture_path).convert('RGB'))
+    rows, cols = texture.shape[:2]
+
+    pixels = np.zeros((rows * cols + 1, 3), dtype=np.uint8)
+    pixels[:-1] = texture.reshape(-1, 3)
+
+    return pixels, (rows, cols)
+
+
+def lookup_table(uv, texture_shape):
+    """Flat texture pixel index for every UV pixel
+
+    Equivalent to ndimage.map_coordinates(..., order=0) with u scaled to rows and v to columns by the texture's first
+    dimension; coordinates that land outside the texture index the trailing black pixel from read_texture.
+
+    :param uv: (2, H, W) float32 normalized coordinates from read_uv
+    :param texture_shape: (rows, cols) of the texture
+    :return: (H, W) int64 array of flat indices
+    """
+    rows, cols = texture_shape
+    scaled = uv * np.float32(rows)
+
+    # constant mode gives cval (0) for coordinates outside the texture, order=0 picks the nearest pixel
+    with np.errstate(invalid='ignore'):
+        outside = ~((scaled[0] >= 0) & (scaled[0] <= rows - 1) & (scaled[1] >= 0) & (scaled[1] <= cols - 1))
+    scaled[:, outside] = 0
+    row = np.floor(scaled[0] + 0.5).astype(np.int64)
+    col = np.floor(scaled[1] + 0.5).astype(np.int64)
+
+    index = row * cols + col
+    index[outside] = rows * cols
+
+    return index
+
+
+class TextureMapper:
+    def __init__(self, max_uv_maps=16, max_textures=64):
+        """Map textures through UV renders, caching decoded UV maps, textures, and their lookup tables
+
+        Entries are keyed by absolute path and modification time so a re-rendered UV map or edited texture is reread.
+
+        :param max_uv_maps: number of decoded UV maps (and their lookup tables) to keep
+        :param max_textures: number of decoded textures to keep
+        """
+        self.uv_maps = LRUCache(max_uv_maps)
+        self.lookup_tables = LRUCache(max_uv_maps)
+        self.textures = LRUCache(max_textures)
+
+    def uv(self, uv_path):
+        return self.uv_maps.fetch(file_key(uv_path), lambda: read_uv(uv_path))
+
+    def texture(self, texture_path):
+        return self.textures.fetch(file_key(texture_path), lambda: read_texture(texture_path))
+
+    def lookup_table(self, uv_path, texture_shape):
+        return self.lookup_tables.fetch(file_key(uv_path) + (texture_shape,),
+                                        lambda: lookup_table(self.uv(uv_path), texture_shape))
+
+    def map(self, texture_path, uv_path):
+        """Use given UV render to map texture, with one gather over all channels
+
+        :param texture_path: path to a texture to use
+        :param uv_path: path to EXR 32 bit UV render
+        :return: (H, W, 3) uint8 mapped texture
+        """
+        pixels, texture_shape = self.texture(texture_path)
+        index = self.lookup_table(uv_path, texture_shape)
+
+        return pixels.take(index, axis=0)
+
+    def clear(self):
+        self.uv_maps.clear()
+        self.lookup_tables.clear()
+        self.textures.clear()
@@ -0,0 +1,82 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import math
+
+from PIL import Image
+
+
+def reduction_factor(source_size, new_size):
+    """Integer factor to box filter the source by first, so bilinear sampling never skips source pixels"""
+    scale = min(new_size[0] / source_size[0], new_size[1] / source_size[1])
+
+    return max(int(1 / scale), 1) if scale > 0 else 1
+
+
+def affine_data(source_size, new_size, rotation, factor=1):
+    """PIL AFFINE transform data resizing a source image to new_size and then rotating it, in a single mapping
+
+    Same geometry as image.resize(new_size).rotate(rotation): resize maps pixel edges to pixel edges and rotate turns
+    the image counter clockwise about its centre without changing its size.
+
+    :param source_size: (width, height) of the source image before any reduction
+    :param new_size: (width, height) of the resized image
+    :param rotation: angle in degrees
+    :param factor: the source was reduced by this factor, see reduction_factor
+    :return: (a, b, c, d, e, f) mapping output pixel coordinates to source pixel coordinates
+    """
+    width, height = new_size
+    angle = -math.radians(rotation)
+    cos, sin = math.cos(angle), math.sin(angle)
+    sx = source_size[0] / (factor * width)
+    sy = source_size[1] / (factor * height)
+    cx, cy = width / 2, height / 2
+
+    return (cos * sx, sin * sx, (cx - cos * cx - sin * cy) * sx,
+            -sin * sy, cos * sy, (cy + sin * cx - cos * cy) * sy)
+
+
+def resize_rotate(image, new_size, rotation, resample=Image.BILINEAR):
+    """Resize and rotate an image in one resampling pass instead of two
+
+    Bilinear sampling first box reduces the image to within twice the new size (Image.reduce), so downscaling averages
+    every source pixel like resize does; nearest sampling picks source pixels directly.
+
+    :param image: PIL image, RGBA is resampled with premultiplied alpha as PIL always does
+    :param new_size: (width, height) of the resized image
+    :param rotation: counter clockwise rotation in degrees
+    :param resample: Image.NEAREST or Image.BILINEAR
+    :return: PIL image of new_size, zero outside the rotated image
+    """
+    if rotation % 360 == 0:
+        # a plain resize is a single pass already
+        return image.resize(new_size, resample=resample)
+
+    source_size = image.size
+    factor = 1
+    if resample != Image.NEAREST:
+        factor = reduction_factor(image.size, new_size)
+        if factor > 1:
+            image = image.reduce(factor)
+
+    data = affine_data(source_size, new_size, rotation, factor)
+
+    return image.transform(new_size, Image.AFFINE, data, resample=resample)
+
+
+def resize_rotate_layers(images, new_size, rotation, resample=Image.BILINEAR):
+    """Resize and rotate single channel layers sharing a transform, packing them three to an image
+
+    :param images: list of 'L' PIL images of the same size
+    :return: list of transformed 'L' PIL images in the same order
+    """
+    layers = []
+    for start in range(0, len(images), 3):
+        group = images[start:start + 3]
+        if len(group) == 3:
+            layers.extend(resize_rotate(Image.merge('RGB', group), new_size, rotation, resample).split())
+        else:
+            layers.extend(resize_rotate(layer, new_size, rotation, resample) for layer in group)
+
+    return layers
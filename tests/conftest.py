@@ -0,0 +1,19 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def repo_pythonpath(monkeypatch):
+    """Put the repo on PYTHONPATH for subprocesses, i.e. stub spool workers run with -m"""
+    paths = [ROOT] + [p for p in os.environ.get('PYTHONPATH', '').split(os.pathsep) if p]
+    monkeypatch.setenv('PYTHONPATH', os.pathsep.join(paths))
@@ -0,0 +1,61 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import json
+
+import pytest
+
+from simulants.tools.descriptor_store import DescriptorStore, load_descriptor
+
+
+@pytest.fixture
+def path(tmpdir):
+    return str(tmpdir.join('sims.jsonl'))
+
+
+def test_get_and_replace(path):
+    store = DescriptorStore(path)
+    store.extend([{'id': 'a', 'n': 1}, {'id': 'b', 'n': 2}])
+    store.append({'id': 'a', 'n': 3})
+
+    assert store.get('b') == {'id': 'b', 'n': 2}
+    assert store.get('a') == {'id': 'a', 'n': 3}
+    assert len(store) == 2
+    assert 'a' in store and 'c' not in store
+    assert [d['n'] for d in store] == [1, 2, 3]
+    store.close()
+
+    assert load_descriptor(path, 'b') == {'id': 'b', 'n': 2}
+    with pytest.raises(AssertionError):
+        load_descriptor(path, 'c')
+
+
+def test_readers_never_write(path):
+    store = DescriptorStore(path, 'scene_id')
+
+    assert len(store) == 0 and store.ids() == [] and 'a' not in store
+    store.close()
+    assert not os.path.exists(path + '.idx')
+
+
+def test_recovers_from_a_crashed_append(path):
+    store = DescriptorStore(path)
+    store.append({'id': 'a'})
+    store.close()
+
+    # a crash after writing the store but before the index: one complete unindexed line and a partial one
+    with open(path, 'ab') as f:
+        f.write((json.dumps({'id': 'b'}) + '\n').encode('utf-8'))
+        f.write(b'{"id": "c", "trunc')
+
+    store = DescriptorStore(path)
+    assert 'b' not in store
+    store.append({'id': 'd'})
+
+    assert store.ids() == ['a', 'b', 'd']
+    assert store.get('b') == {'id': 'b'}
+    assert store.get('d') == {'id': 'd'}
+    assert [d['id'] for d in store] == ['a', 'b', 'd']
+    store.close()
@@ -0,0 +1,58 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+
+import numpy as np
+import pytest
+
+from simulants.tools.pose_archive import PoseArchive, PoseReferences, is_pose_reference, read_pose
+
+BONES = ['root', 'spine', 'head']
+
+
+def rotations(frames, value):
+    return np.full((frames, len(BONES), 4), value, dtype=np.float32)
+
+
+def test_clips_frames_and_references(tmpdir):
+    path = str(tmpdir.join('poses'))
+    archive = PoseArchive(path)
+    archive.append('walk', rotations(3, 1), BONES, frame_start=10)
+    archive.append('run', rotations(2, 2), BONES)
+
+    archive = PoseArchive(path)
+    assert len(archive) == 5 and 'walk' in archive
+    assert np.all(archive.clip('run') == 2)
+    assert np.all(archive.frame('walk', 12) == 1)
+    with pytest.raises(AssertionError):
+        archive.frame('walk', 13)
+    with pytest.raises(AssertionError):
+        archive.append('walk', rotations(1, 3), BONES)
+
+    references = PoseReferences(archive)
+    assert references[2] == '{}#walk#12'.format(path)
+    assert references[3] == '{}#run#1'.format(path)
+    assert is_pose_reference(references[3]) and not is_pose_reference('poses/walk_0001.json')
+
+    bones, pose = read_pose(references[4])
+    assert bones == BONES and np.all(pose == 2)
+
+
+def test_append_drops_rows_the_index_never_recorded(tmpdir):
+    path = str(tmpdir.join('poses'))
+    PoseArchive(path).append('walk', rotations(2, 1), BONES)
+
+    # an append interrupted after writing rows but before replacing the index
+    with open(path + '.f32', 'ab') as f:
+        f.write(rotations(4, 9).tobytes())
+
+    archive = PoseArchive(path)
+    assert len(archive) == 2
+    archive.append('run', rotations(1, 2), BONES)
+
+    assert os.path.getsize(path + '.f32') == 3 * len(BONES) * 4 * 4
+    archive = PoseArchive(path)
+    assert np.all(archive.clip('walk') == 1)
+    assert np.all(archive.clip('run') == 2)
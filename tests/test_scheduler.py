@@ -0,0 +1,133 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+
+import pytest
+
+from simulants.tools import scheduler, spool
+from simulants.tools.scheduler import JobQueue, DONE, FAILED, PENDING
+
+
+def job(job_id, depends_on=(), max_attempts=3, kind='render'):
+    return job_id, ['blender', '-b', '-P', 'blender/{}.py'.format(kind), '--', job_id], kind, depends_on, \
+        max_attempts, False
+
+
+def states(db_path):
+    queue = JobQueue(db_path)
+    rows = dict((job_id, (state, attempts, error)) for job_id, state, attempts, error in
+                queue.db.execute('SELECT id, state, attempts, error FROM jobs'))
+    queue.close()
+
+    return rows
+
+
+@pytest.fixture
+def queue(tmpdir):
+    queue = JobQueue(str(tmpdir.join('jobs.db')), backoff=0)
+    yield queue
+    queue.close()
+
+
+def test_retries_until_out_of_attempts(queue):
+    queue.add_many([job('a', max_attempts=2)])
+
+    assert queue.claim() == ('a', job('a')[1])
+    assert queue.fail('a', 'first')
+    assert queue.claim()[0] == 'a'
+    assert not queue.fail('a', 'second')
+    assert queue.claim() is None
+    assert states(queue.db_path)['a'] == (FAILED, 2, 'second')
+
+
+def test_dependencies_run_in_order_and_failures_cascade(queue):
+    queue.add_many([job('b', depends_on=('a',)), job('c', depends_on=('b',)), job('a', max_attempts=1),
+                    job('d', depends_on=('a',))])
+
+    assert queue.claim()[0] == 'a'
+    assert queue.claim() is None
+    assert not queue.fail('a', 'broken')
+
+    rows = states(queue.db_path)
+    assert rows['b'] == (FAILED, 0, 'dependency a failed')
+    assert rows['c'][0] == FAILED
+    assert rows['d'][0] == FAILED
+
+    # jobs added after their dependency failed fail as well
+    queue.add_many([job('e', depends_on=('c',))])
+    assert states(queue.db_path)['e'] == (FAILED, 0, 'dependency c failed')
+
+
+def test_readding_leaves_jobs_and_retry_failed_resets_them(queue):
+    queue.add_many([job('a', max_attempts=1), job('b', depends_on=('a',), kind='composite')])
+    queue.claim()
+    queue.fail('a', 'broken')
+
+    queue.add_many([job('a', max_attempts=1), job('b', depends_on=('a',), kind='composite')])
+    assert states(queue.db_path)['a'][0] == FAILED
+
+    # the dependency stays failed, so its dependent fails again
+    assert queue.retry_failed(['composite']) == 0
+    assert states(queue.db_path)['b'] == (FAILED, 0, 'dependency a failed')
+
+    assert queue.retry_failed(['render']) == 2
+    rows = states(queue.db_path)
+    assert rows['a'] == (PENDING, 0, None)
+    assert rows['b'] == (PENDING, 0, None)
+    assert queue.claim()[0] == 'a'
+
+
+def test_requeue_orphans(queue):
+    queue.add_many([job('a')])
+    queue.claim()
+    queue.db.execute('UPDATE jobs SET pid = NULL')
+
+    assert queue.requeue_orphans() == 1
+    assert queue.claim()[0] == 'a'
+
+
+def test_run_stops_on_missing_dependencies(tmpdir):
+    db_path = str(tmpdir.join('jobs.db'))
+    queue = JobQueue(db_path)
+    queue.add_many([job('a'), job('b', depends_on=('missing',))])
+    queue.close()
+
+    ran = []
+    scheduler.run(db_path, poll=0.01, execute=ran.append, blocked_timeout=0.1)
+
+    assert ran == [job('a')[1]]
+    assert states(db_path)['b'][0] == PENDING
+
+
+def test_run_on_stub_blender_pool(tmpdir, repo_pythonpath):
+    db_path = str(tmpdir.join('jobs.db'))
+    queue = JobQueue(db_path)
+    queue.add_many([job('ok{}'.format(i)) for i in range(6)] +
+                   [job('fail', max_attempts=2), job('after_fail', depends_on=('fail',)),
+                    job('crash', max_attempts=2), job('after_ok', depends_on=('ok0', 'ok1'))])
+    queue.close()
+
+    pool = spool.BlenderPool(str(tmpdir.join('spool')), workers=2, command=spool.stub_command(), poll=0.01)
+    pool.start()
+    errors = []
+    try:
+        scheduler.run(db_path, workers=3, poll=0.01, backoff=0, execute=pool.check_call,
+                      on_error=lambda job_id, command, e: errors.append((job_id, e.output)))
+    finally:
+        pool.close()
+
+    rows = states(db_path)
+    for i in range(6):
+        assert rows['ok{}'.format(i)] == (DONE, 1, None)
+    assert rows['after_ok'][0] == DONE
+    assert rows['fail'][:2] == (FAILED, 2)
+    assert len([output for job_id, output in errors if job_id == 'fail' and 'stub failure' in output]) == 2
+    assert rows['after_fail'] == (FAILED, 0, 'dependency fail failed')
+    assert rows['crash'][:2] == (FAILED, 2)
+
+    # the crashed worker's job failed with its exit code and a replacement worker kept serving jobs
+    crashes = [output for job_id, output in errors if job_id == 'crash']
+    assert crashes == ['worker exited with code 1'] * 2
+    assert sorted(os.listdir(pool.spool.queue) + os.listdir(pool.spool.running) + os.listdir(pool.spool.done)) == []
@@ -0,0 +1,68 @@
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+
+from simulants.tools.simulant_cache import SimulantCache, GEOMETRY_FIELDS, descriptor_key
+
+
+def descriptor(tmpdir, sim_id, base_mesh, size=100):
+    """Descriptor with a fake built blend of size bytes at its path"""
+    path = str(tmpdir.join('{}.blend'.format(sim_id)))
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+
+    sim = dict((field, {'id': sim_id}) for field in GEOMETRY_FIELDS)
+    sim.update(id=sim_id, path=path, base_mesh=base_mesh)
+
+    return sim
+
+
+def test_key_ignores_ids(tmpdir):
+    assert descriptor_key(descriptor(tmpdir, 's1', 'f_ca01')) == descriptor_key(descriptor(tmpdir, 's2', 'f_ca01'))
+    assert descriptor_key(descriptor(tmpdir, 's1', 'f_ca01')) != descriptor_key(descriptor(tmpdir, 's1', 'm_ca01'))
+    assert descriptor_key(descriptor(tmpdir, 's1', 'f_ca01')) != descriptor_key(descriptor(tmpdir, 's1', 'f_ca01'),
+                                                                                'other')
+
+
+def test_lookup_and_up_to_date(tmpdir):
+    cache = SimulantCache(str(tmpdir.join('cache')))
+    sim = descriptor(tmpdir, 's1', 'f_ca01')
+
+    assert cache.lookup(sim) is None
+    key = cache.add(sim)
+    assert cache.up_to_date(sim)
+
+    entry = cache.lookup(descriptor(tmpdir, 's2', 'f_ca01'))
+    assert entry['key'] == key and entry['built_id'] == 's1'
+
+    other = descriptor(tmpdir, 's3', 'f_ca01')
+    cache.materialize(entry, other['path'])
+    assert not cache.up_to_date(other)
+    cache.record_output(other)
+    assert cache.up_to_date(other)
+
+
+def test_evicts_least_recently_used(tmpdir):
+    cache = SimulantCache(str(tmpdir.join('cache')), max_bytes=250)
+    first = descriptor(tmpdir, 's1', 'f_ca01')
+    second = descriptor(tmpdir, 's2', 'f_as01')
+    third = descriptor(tmpdir, 's3', 'f_af01')
+
+    keys = [cache.add(first), cache.add(second)]
+    # using the first blend makes the second the least recently used
+    assert cache.lookup(first) is not None
+    keys.append(cache.add(third))
+
+    assert sorted(cache.read_manifest()) == sorted([keys[0], keys[2]])
+    assert not os.path.exists(cache.blend_path(keys[1]))
+    assert cache.lookup(second) is None
+
+
+def test_plan_groups_identical_descriptors(tmpdir):
+    sims = [descriptor(tmpdir, 's1', 'f_ca01'), descriptor(tmpdir, 's2', 'm_ca01'), descriptor(tmpdir, 's3', 'f_ca01')]
+
+    plan = SimulantCache(str(tmpdir.join('cache'))).plan(sims)
+
+    assert [[sim['id'] for sim in group] for _, group in plan] == [['s1', 's3'], ['s2']]